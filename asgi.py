@@ -0,0 +1,148 @@
+import asyncio
+import concurrent.futures
+import configparser
+import io
+import sys
+import traceback
+
+import main
+import responses
+import serving
+
+config = configparser.ConfigParser()
+config.read('config.conf')
+
+THREADS = config.getint('server', 'threads', fallback=32)
+MAX_BODY = config.getint('server', 'max_content_length', fallback=1048576)
+
+
+# ASGI entry point: `uvicorn asgi:app --workers N`.
+# Flask's synchronous request handling (routing, cookies, response building) runs on a
+# thread pool, and the async views it calls are scheduled back onto the server's event
+# loop, so pools, caches and locks created by coroutines live as long as the worker.
+class ASGIAdapter:
+    def __init__(self, wsgi_app, threads=THREADS, max_body=MAX_BODY):
+        self.wsgi_app = wsgi_app
+        self.max_body = max_body
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=threads, thread_name_prefix='request')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http':
+            serving.use_loop(asyncio.get_running_loop())
+            await self._http(scope, receive, send)
+        else:
+            raise ValueError(f"Unsupported ASGI scope type {scope['type']}")
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                serving.use_loop(asyncio.get_running_loop())
+                try:
+                    await serving.startup()
+                except Exception as e:
+                    traceback.print_exc()
+                    await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                    return
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                try:
+                    await serving.shutdown()
+                except Exception as e:
+                    traceback.print_exc()
+                    await send({'type': 'lifespan.shutdown.failed', 'message': str(e)})
+                    return
+                finally:
+                    self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _http(self, scope, receive, send):
+        # the body is buffered before Flask sees it, so its size is enforced here: up front
+        # from Content-Length, and as it arrives for chunked or understated bodies
+        for name, value in scope['headers']:
+            if name == b'content-length' and value.isdigit() and int(value) > self.max_body:
+                await self._too_large(send)
+                return
+        body = bytearray()
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            body += message.get('body', b'')
+            if len(body) > self.max_body:
+                await self._too_large(send)
+                return
+            if not message.get('more_body'):
+                break
+        environ = self._environ(scope, bytes(body))
+        loop = asyncio.get_running_loop()
+        status, headers, content = await loop.run_in_executor(self.executor, self._call, environ)
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': content})
+
+    async def _too_large(self, send):
+        # the rest of the body is never read, so the connection cannot be reused
+        await send({'type': 'http.response.start', 'status': 413, 'headers': [
+            (b'content-type', b'application/json'),
+            (b'connection', b'close'),
+        ]})
+        await send({'type': 'http.response.body', 'body': responses.dumps({'error': 'Request body is too large'})})
+
+    def _call(self, environ):
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and response:
+                raise exc_info[1].with_traceback(exc_info[2])
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+
+        result = self.wsgi_app(environ, start_response)
+        try:
+            content = b''.join(result)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        return response['status'], response['headers'], content
+
+    def _environ(self, scope, body):
+        server = scope.get('server') or ('localhost', 80)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+            'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': scope['query_string'].decode('latin-1'),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1]),
+            'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+        }
+        if scope.get('client'):
+            environ['REMOTE_ADDR'] = scope['client'][0]
+        for name, value in scope['headers']:
+            name, value = name.decode('latin-1'), value.decode('latin-1')
+            if name == 'content-length':
+                key = 'CONTENT_LENGTH'
+            elif name == 'content-type':
+                key = 'CONTENT_TYPE'
+            else:
+                key = 'HTTP_' + name.upper().replace('-', '_')
+            if key in environ:
+                # repeated headers are joined into one; cookies are separated by '; ', not ','
+                value = environ[key] + ('; ' if key == 'HTTP_COOKIE' else ',') + value
+            environ[key] = value
+        # the body has been read completely, whatever its transfer encoding was
+        environ['CONTENT_LENGTH'] = str(len(body))
+        return environ
+
+
+app = ASGIAdapter(main.app)
@@ -0,0 +1,300 @@
+import datetime
+import threading
+from collections import OrderedDict, namedtuple
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from intervals import IntervalIndex
+
+DAY = datetime.timedelta(days=1)
+DAY_SECONDS = 86400
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# open/close are seconds after midnight, days is the available_days_mask of the room:
+# bit n - 1 is set when the room can be booked on weekday n (1=Sunday, 7=Saturday)
+Room = namedtuple('Room', ['id', 'name', 'open', 'close', 'days'])
+ALL_DAYS = 0b1111111
+
+
+def weekday(day):
+    return day.isoweekday() % 7 + 1
+
+
+def days_mask(days):
+    mask = 0
+    for day in days:
+        day = int(day)
+        if not 1 <= day <= 7:
+            raise ValueError(f"Invalid weekday {day}")
+        mask |= 1 << (day - 1)
+    return mask
+
+
+def mask_days(mask):
+    return [day for day in range(1, 8) if mask & (1 << (day - 1))]
+
+
+def is_open_on(room, day):
+    return bool(room.days & (1 << (weekday(day) - 1)))
+
+
+def parse_time_of_day(value, default):
+    # accepts 'HH:MM', 'HH:MM:SS' or a full timestamp, of which only the time is used
+    if not value:
+        return default
+    value = str(value).strip().split(' ')[-1]
+    if value.startswith('24:'):
+        return DAY_SECONDS
+    time = datetime.time.fromisoformat(value)
+    return time.hour * 3600 + time.minute * 60 + time.second
+
+
+def parse_period(period):
+    # [start, end] or 'YYYY-mm-dd HH:MM:SS-YYYY-mm-dd HH:MM:SS', where the timestamps
+    # contain '-' themselves and are split at their fixed width
+    if isinstance(period, str):
+        period = period.strip()
+        period = (period[:19], period[20:])
+    start, end = (datetime.datetime.strptime(value, TIME_FORMAT) for value in period)
+    if end <= start:
+        raise ValueError(f"Invalid period {start} - {end}")
+    return start, end
+
+
+def expand_weekly(start, end, weekdays=None, interval=1, until=None, count=None, limit=100):
+    # occurrences of [start, end) on the given weekdays of every interval-th week, starting
+    # with the week of start, until the date `until` (inclusive) or `count` occurrences;
+    # returns None when the series would have more than limit occurrences
+    weekdays = sorted(set(weekdays or [weekday(start)]))
+    length = end - start
+    week_start = start - datetime.timedelta(days=weekday(start) - 1)
+    occurrences = []
+    while True:
+        for day in weekdays:
+            occurrence = week_start + datetime.timedelta(days=day - 1)
+            if occurrence < start:
+                continue
+            if (until is not None and occurrence.date() > until) or (count is not None and len(occurrences) >= count):
+                return occurrences
+            if len(occurrences) >= limit:
+                return None
+            occurrences.append((occurrence, occurrence + length))
+        week_start += datetime.timedelta(weeks=interval)
+
+
+def parse_room(row):
+    room_id, name, open_time, close_time, available_days_mask = row
+    return Room(
+        room_id,
+        name,
+        parse_time_of_day(open_time, 0),
+        parse_time_of_day(close_time, DAY_SECONDS),
+        ALL_DAYS if available_days_mask is None else available_days_mask,
+    )
+
+
+# Free/busy view of all active rooms built on interval indexes of their reservations and
+# blackouts (room_blackouts rows).
+# With NumPy, every day that has been queried gets a rooms x slots matrix counting what
+# blocks each slot: closed hours, weekdays the room is unavailable, blackouts and
+# reservations. A slot is counted when a blocker touches any part of it, so
+# - a room whose slots covering the window are all free is free for the window, and
+# - a blocked slot lying completely inside the window is a real conflict;
+# only rooms blocked in the partially covered edge slots are left for is_free().
+# Without NumPy every room goes through is_free().
+class AvailabilityGrid:
+    def __init__(self, rooms, index=None, blackouts=None, slot_minutes=15, max_days=60):
+        self.rooms = {room.id: room for room in rooms}
+        self.room_ids = list(self.rooms)
+        self.rows = {room_id: row for row, room_id in enumerate(self.room_ids)}
+        self.index = index if index is not None else IntervalIndex()
+        self.blackouts = blackouts if blackouts is not None else IntervalIndex()
+        self.slot = slot_minutes * 60
+        self.slots_per_day = -(-DAY_SECONDS // self.slot)
+        self.max_days = max_days
+        self._days = OrderedDict()  # date -> counts matrix
+        self._lock = threading.RLock()
+        self._stats = {
+            'days_built': 0,
+            'days_evicted': 0,
+            'queries': 0,
+            'exact_checks': 0,
+        }
+
+    def _span(self, day_start, start, end):
+        low = max((start - day_start).total_seconds(), 0)
+        high = min((end - day_start).total_seconds(), DAY_SECONDS)
+        if high <= low:
+            return None
+        return int(low // self.slot), int(-(-high // self.slot))
+
+    def _build_day(self, day):
+        day_start = datetime.datetime.combine(day, datetime.time())
+        day_end = day_start + DAY
+        counts = numpy.zeros((len(self.room_ids), self.slots_per_day), dtype=numpy.int32)
+        for row, room_id in enumerate(self.room_ids):
+            room = self.rooms[room_id]
+            # no early exit for closed weekdays: _update() subtracts reservations on removal,
+            # so all of them have to be counted
+            if not is_open_on(room, day):
+                counts[row] += 1
+            if room.open > 0:
+                counts[row, :-(-room.open // self.slot)] += 1
+            if room.close < DAY_SECONDS:
+                counts[row, room.close // self.slot:] += 1
+            blockers = [entry[:2] for entry in self.blackouts.overlapping(room_id, day_start, day_end)]
+            blockers += [entry[:2] for entry in self.index.overlapping(room_id, day_start, day_end)]
+            for start, end in blockers:
+                span = self._span(day_start, start, end)
+                if span:
+                    counts[row, span[0]:span[1]] += 1
+        self._stats['days_built'] += 1
+        return counts
+
+    def _day(self, day):
+        counts = self._days.get(day)
+        if counts is None:
+            counts = self._days[day] = self._build_day(day)
+            if len(self._days) > self.max_days:
+                self._days.popitem(last=False)
+                self._stats['days_evicted'] += 1
+        else:
+            self._days.move_to_end(day)
+        return counts
+
+    def _update(self, room_id, start, end, delta):
+        row = self.rows.get(room_id)
+        if row is None:
+            return
+        day = start.date()
+        while datetime.datetime.combine(day, datetime.time()) < end:
+            counts = self._days.get(day)
+            if counts is not None:
+                span = self._span(datetime.datetime.combine(day, datetime.time()), start, end)
+                if span:
+                    counts[row, span[0]:span[1]] += delta
+            day += DAY
+
+    def add(self, room_id, reservation_id, start, end):
+        with self._lock:
+            previous = self.index.get(reservation_id)
+            if previous is not None:
+                self._update(*previous, -1)
+            self.index.add(room_id, reservation_id, start, end)
+            self._update(room_id, start, end, 1)
+
+    def remove(self, reservation_id):
+        with self._lock:
+            previous = self.index.get(reservation_id)
+            if previous is None:
+                return False
+            self.index.remove(reservation_id)
+            self._update(*previous, -1)
+            return True
+
+    def is_free(self, room_id, start, end):
+        # exact check of one room against its schedule and the reservation index
+        room = self.rooms.get(room_id)
+        if room is None:
+            return False
+        self._stats['exact_checks'] += 1
+        day_start = datetime.datetime.combine(start.date(), datetime.time())
+        while day_start < end:
+            if not is_open_on(room, day_start):
+                return False
+            if (max(start, day_start) - day_start).total_seconds() < room.open:
+                return False
+            if (min(end, day_start + DAY) - day_start).total_seconds() > room.close:
+                return False
+            day_start += DAY
+        if self.blackouts.has_overlap(room_id, start, end):
+            return False
+        return not self.index.has_overlap(room_id, start, end)
+
+    def free_intervals(self, room_id, start, end):
+        # sweep over the opening hours of every day in [start, end), skipping the merged
+        # blackouts and reservations; returns [(start, end)] in order
+        room = self.rooms.get(room_id)
+        if room is None:
+            return []
+        busy = [entry[:2] for entry in self.blackouts.overlapping(room_id, start, end)]
+        busy += [entry[:2] for entry in self.index.overlapping(room_id, start, end)]
+        merged = []
+        for busy_start, busy_end in sorted(busy):
+            if merged and busy_start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], busy_end)
+            else:
+                merged.append([busy_start, busy_end])
+
+        free = []
+        position = 0
+        day_start = datetime.datetime.combine(start.date(), datetime.time())
+        while day_start < end:
+            if is_open_on(room, day_start):
+                cursor = max(start, day_start + datetime.timedelta(seconds=room.open))
+                window_end = min(end, day_start + datetime.timedelta(seconds=room.close))
+                while position < len(merged) and merged[position][1] <= cursor:
+                    position += 1
+                busy_position = position
+                while cursor < window_end:
+                    if busy_position < len(merged) and merged[busy_position][0] < window_end:
+                        busy_start, busy_end = merged[busy_position]
+                        gap_end = busy_start
+                    else:
+                        busy_end = gap_end = window_end
+                    if cursor < gap_end:
+                        # open until midnight and from midnight on the next day is one interval
+                        if free and free[-1][1] == cursor:
+                            free[-1] = (free[-1][0], gap_end)
+                        else:
+                            free.append((cursor, gap_end))
+                    cursor = max(cursor, busy_end)
+                    busy_position += 1
+            day_start += DAY
+        return free
+
+    def candidates(self, start, end):
+        # (rooms known to be free, rooms that need is_free) for [start, end)
+        with self._lock:
+            self._stats['queries'] += 1
+            if numpy is None or not self.room_ids:
+                return [], list(self.room_ids)
+            free = numpy.ones(len(self.room_ids), dtype=bool)
+            conflict = numpy.zeros(len(self.room_ids), dtype=bool)
+            day = start.date()
+            while datetime.datetime.combine(day, datetime.time()) < end:
+                day_start = datetime.datetime.combine(day, datetime.time())
+                span = self._span(day_start, start, end)
+                if span:
+                    busy = self._day(day)[:, span[0]:span[1]] > 0
+                    free &= ~busy.any(axis=1)
+                    # slots completely inside the window
+                    low = max((start - day_start).total_seconds(), 0)
+                    high = min((end - day_start).total_seconds(), DAY_SECONDS)
+                    inner_low, inner_high = int(-(-low // self.slot)), int(high // self.slot)
+                    if inner_high > inner_low:
+                        conflict |= busy[:, inner_low - span[0]:inner_high - span[0]].any(axis=1)
+                day += DAY
+            unsure = ~free & ~conflict
+            return ([self.room_ids[row] for row in numpy.flatnonzero(free)],
+                    [self.room_ids[row] for row in numpy.flatnonzero(unsure)])
+
+    def free_rooms(self, start, end):
+        free, unsure = self.candidates(start, end)
+        with self._lock:
+            free += [room_id for room_id in unsure if self.is_free(room_id, start, end)]
+        return sorted(free, key=self.rows.get)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'vectorized': numpy is not None,
+                'rooms': len(self.room_ids),
+                'reservations': len(self.index),
+                'blackouts': len(self.blackouts),
+                'days_cached': len(self._days),
+                **self._stats,
+            }
@@ -0,0 +1,102 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+# Bounded LRU cache whose entries also expire after ttl seconds.
+# generation() / set(..., generation=...) let a loader drop its result when the key
+# was invalidated while the value was being read from the database.
+class TTLCache:
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._generations = {}
+        self._generation = 0
+        self._floor = 0
+        self._lock = threading.Lock()
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'evictions': 0,
+            'expirations': 0,
+            'invalidations': 0,
+        }
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self._stats['misses'] += 1
+                return default
+            if entry[0] <= now:
+                del self._data[key]
+                self._stats['expirations'] += 1
+                self._stats['misses'] += 1
+                return default
+            self._data.move_to_end(key)
+            self._stats['hits'] += 1
+            return entry[1]
+
+    def generation(self, key):
+        with self._lock:
+            return self._generations.get(key, self._floor)
+
+    def set(self, key, value, generation=None, ttl=None):
+        with self._lock:
+            if generation is not None and self._generations.get(key, self._floor) != generation:
+                return False
+            self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self._stats['evictions'] += 1
+            return True
+
+    def invalidate(self, key):
+        with self._lock:
+            self._generation += 1
+            self._generations[key] = self._generation
+            # markers only matter to loads in flight; when dropping them, raise the floor
+            # so those loads are rejected instead of caching a stale value
+            if len(self._generations) > self.maxsize:
+                self._generations.clear()
+                self._floor = self._generation
+            if self._data.pop(key, None) is not None:
+                self._stats['invalidations'] += 1
+
+    def invalidate_many(self, keys):
+        for key in keys:
+            self.invalidate(key)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._generations.clear()
+            self._floor = self._generation
+            self._stats['invalidations'] += len(self._data)
+            self._data.clear()
+
+    def purge_expired(self):
+        now = time.monotonic()
+        with self._lock:
+            expired = [key for key, (expires_at, _) in self._data.items() if expires_at <= now]
+            for key in expired:
+                del self._data[key]
+            self._stats['expirations'] += len(expired)
+            return len(expired)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+    def stats(self):
+        with self._lock:
+            lookups = self._stats['hits'] + self._stats['misses']
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                **self._stats,
+                'hit_rate': round(self._stats['hits'] / lookups, 4) if lookups else 0.0,
+            }
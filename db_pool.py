@@ -0,0 +1,234 @@
+import asyncio
+import concurrent.futures
+import configparser
+import contextlib
+import re
+import threading
+import time
+from collections import deque
+
+import aiosqlite
+
+config = configparser.ConfigParser()
+config.read('config.conf')
+
+POOL_SIZE = config.getint('database', 'pool_size', fallback=8)
+ACQUIRE_TIMEOUT = config.getfloat('database', 'pool_acquire_timeout', fallback=5.0)
+HEALTH_CHECK_INTERVAL = config.getfloat('database', 'pool_health_check_interval', fallback=30.0)
+
+# per-connection settings for the read-only connections, see [sqlite] in config.conf
+READ_PRAGMAS = [
+    "PRAGMA query_only = ON",
+    f"PRAGMA cache_size = {config.getint('sqlite', 'cache_size', fallback=-16000)}",
+    f"PRAGMA mmap_size = {config.getint('sqlite', 'mmap_size', fallback=0)}",
+]
+
+_WRITE_KEYWORDS = re.compile(r'\b(INSERT|UPDATE|DELETE|REPLACE|CREATE|DROP|ALTER)\b', re.IGNORECASE)
+_LEADING_COMMENTS = re.compile(r'^(\s+|--[^\n]*\n?|/\*.*?\*/)+', re.DOTALL)
+
+
+def is_read_only(exp):
+    # decides whether a statement can run on a read-only connection
+    exp = _LEADING_COMMENTS.sub('', exp).lstrip('(').upper()
+    if exp.startswith(("SELECT", "EXPLAIN", "VALUES")):
+        return True
+    if exp.startswith("WITH"):
+        return not _WRITE_KEYWORDS.search(exp)
+    return False
+
+
+def read_only_uri(path):
+    return f"file:{path}?mode=ro"
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class PoolClosed(Exception):
+    pass
+
+
+# Long-lived aiosqlite connections shared by every model function.
+# Bookkeeping is guarded by a thread lock and waiters are concurrent futures,
+# so the pool keeps working when requests run on different event loops/threads.
+class ConnectionPool:
+    def __init__(self, path, size=POOL_SIZE, acquire_timeout=ACQUIRE_TIMEOUT,
+                 health_check_interval=HEALTH_CHECK_INTERVAL, pragmas=(), **connect_kwargs):
+        self.path = path
+        self.size = size
+        self.acquire_timeout = acquire_timeout
+        self.health_check_interval = health_check_interval
+        self.pragmas = list(pragmas)
+        self.connect_kwargs = connect_kwargs
+        self._lock = threading.Lock()
+        self._idle = deque()  # (conn, last_used)
+        self._connections = set()
+        self._waiters = deque()
+        self._open = 0
+        self._closed = False
+        self._stats = {
+            'acquired': 0,
+            'created': 0,
+            'discarded': 0,
+            'timeouts': 0,
+            'health_check_failures': 0,
+            'wait_time_total': 0.0,
+        }
+
+    async def _connect(self):
+        conn = await aiosqlite.connect(self.path, **self.connect_kwargs)
+        try:
+            for pragma in self.pragmas:
+                await conn.execute(pragma)
+        except Exception:
+            await self._close_quietly(conn)
+            raise
+        with self._lock:
+            self._connections.add(conn)
+            self._stats['created'] += 1
+        return conn
+
+    async def _is_healthy(self, conn):
+        try:
+            async with conn.execute("SELECT 1") as cur:
+                await cur.fetchone()
+            return True
+        except Exception:
+            return False
+
+    async def _close_quietly(self, conn):
+        with self._lock:
+            self._connections.discard(conn)
+        try:
+            await conn.close()
+        except Exception:
+            pass
+
+    async def acquire(self):
+        started = time.monotonic()
+        waiter = None
+        conn = None
+        last_used = None
+        with self._lock:
+            if self._closed:
+                raise PoolClosed("Connection pool is closed")
+            if self._idle:
+                conn, last_used = self._idle.pop()
+            elif self._open < self.size:
+                self._open += 1
+            else:
+                waiter = concurrent.futures.Future()
+                self._waiters.append(waiter)
+
+        if waiter is not None:
+            try:
+                conn, last_used = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(waiter)), self.acquire_timeout)
+            except asyncio.TimeoutError:
+                with self._lock:
+                    cancelled = waiter.cancel()
+                    if cancelled:
+                        self._stats['timeouts'] += 1
+                if cancelled:
+                    raise PoolTimeout(f"Timed out after {self.acquire_timeout}s waiting for a database connection")
+                # the connection was handed over while we were timing out
+                conn, last_used = waiter.result()
+
+        if conn is None:
+            try:
+                conn = await self._connect()
+            except Exception:
+                with self._lock:
+                    self._open -= 1
+                raise
+        elif time.monotonic() - last_used > self.health_check_interval and not await self._is_healthy(conn):
+            with self._lock:
+                self._stats['health_check_failures'] += 1
+                self._stats['discarded'] += 1
+            await self._close_quietly(conn)
+            try:
+                conn = await self._connect()
+            except Exception:
+                with self._lock:
+                    self._open -= 1
+                raise
+
+        with self._lock:
+            self._stats['acquired'] += 1
+            self._stats['wait_time_total'] += time.monotonic() - started
+        return conn
+
+    async def release(self, conn, discard=False):
+        with self._lock:
+            if discard or self._closed:
+                self._open -= 1
+                self._stats['discarded'] += 1
+            else:
+                entry = (conn, time.monotonic())
+                while self._waiters:
+                    waiter = self._waiters.popleft()
+                    if waiter.set_running_or_notify_cancel():
+                        waiter.set_result(entry)
+                        return
+                self._idle.append(entry)
+                return
+        await self._close_quietly(conn)
+
+    @contextlib.asynccontextmanager
+    async def connection(self):
+        conn = await self.acquire()
+        try:
+            yield conn
+        except BaseException:
+            # never hand a connection with a half-finished transaction to the next caller
+            try:
+                await conn.rollback()
+            except Exception:
+                await self.release(conn, discard=True)
+                raise
+            await self.release(conn)
+            raise
+        await self.release(conn)
+
+    async def close(self):
+        with self._lock:
+            self._closed = True
+            idle = [conn for conn, _ in self._idle]
+            self._idle.clear()
+            self._open -= len(idle)
+            waiters = list(self._waiters)
+            self._waiters.clear()
+        for waiter in waiters:
+            waiter.cancel()
+        for conn in idle:
+            await self._close_quietly(conn)
+
+    def terminate(self):
+        # aiosqlite worker threads are not daemonic and would keep the process alive
+        with self._lock:
+            self._closed = True
+            connections = list(self._connections)
+            self._connections.clear()
+            self._idle.clear()
+        for conn in connections:
+            try:
+                conn.stop()
+            except Exception:
+                pass
+
+    def stats(self):
+        with self._lock:
+            acquired = self._stats['acquired']
+            return {
+                'size': self.size,
+                'open': self._open,
+                'idle': len(self._idle),
+                'in_use': self._open - len(self._idle),
+                'waiting': len(self._waiters),
+                'acquired': acquired,
+                'created': self._stats['created'],
+                'discarded': self._stats['discarded'],
+                'timeouts': self._stats['timeouts'],
+                'health_check_failures': self._stats['health_check_failures'],
+                'avg_wait_ms': round(self._stats['wait_time_total'] * 1000 / acquired, 3) if acquired else 0.0,
+            }
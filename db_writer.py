@@ -0,0 +1,214 @@
+import asyncio
+import atexit
+import concurrent.futures
+import configparser
+import queue
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+config = configparser.ConfigParser()
+config.read('config.conf')
+
+BATCH_WINDOW = config.getfloat('database', 'write_batch_window', fallback=0.002)
+MAX_BATCH = config.getint('database', 'write_max_batch', fallback=256)
+BUSY_TIMEOUT = config.getfloat('database', 'write_busy_timeout', fallback=5.0)
+CHECKPOINT_INTERVAL = config.getfloat('sqlite', 'checkpoint_interval', fallback=300.0)
+CHECKPOINT_MODE = config.get('sqlite', 'checkpoint_mode', fallback='PASSIVE').upper()
+
+WRITE_PRAGMAS = [
+    f"PRAGMA synchronous = {config.get('sqlite', 'synchronous', fallback='NORMAL')}",
+    f"PRAGMA cache_size = {config.getint('sqlite', 'cache_size', fallback=-16000)}",
+    f"PRAGMA wal_autocheckpoint = {config.getint('sqlite', 'wal_autocheckpoint', fallback=1000)}",
+]
+
+WriteResult = namedtuple('WriteResult', ['lastrowid', 'rowcount'])
+
+_STOP = object()
+
+
+# One thread owns the only write connection of this worker. Writes queued by any
+# coroutine are drained in batches: every write runs in its own savepoint so a failing
+# statement only rolls back itself, and the whole batch shares a single COMMIT.
+class Writer:
+    def __init__(self, path, batch_window=BATCH_WINDOW, max_batch=MAX_BATCH, busy_timeout=BUSY_TIMEOUT,
+                 checkpoint_interval=CHECKPOINT_INTERVAL, checkpoint_mode=CHECKPOINT_MODE):
+        self.path = path
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.busy_timeout = busy_timeout
+        self.checkpoint_interval = checkpoint_interval
+        self.checkpoint_mode = checkpoint_mode
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'writes': 0,
+            'errors': 0,
+            'batches': 0,
+            'commit_failures': 0,
+            'max_queue_depth': 0,
+            'commit_time_total': 0.0,
+            'checkpoints': 0,
+        }
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None)
+        for pragma in WRITE_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def _checkpoint(self, conn):
+        # runs while the writer is idle so readers are not competing with a batch
+        try:
+            conn.execute(f"PRAGMA wal_checkpoint({self.checkpoint_mode})").fetchall()
+            with self._stats_lock:
+                self._stats['checkpoints'] += 1
+        except sqlite3.Error as e:
+            print(f"An error occurred during checkpoint: {e}")
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='db-writer', daemon=True)
+                self._thread.start()
+
+    def stop(self, timeout=None):
+        with self._start_lock:
+            thread = self._thread
+            self._thread = None
+        if thread is not None and thread.is_alive():
+            self._queue.put(_STOP)
+            thread.join(timeout)
+
+    def _submit(self, work):
+        self.start()
+        future = concurrent.futures.Future()
+        self._queue.put((work, future))
+        depth = self._queue.qsize()
+        with self._stats_lock:
+            if depth > self._stats['max_queue_depth']:
+                self._stats['max_queue_depth'] = depth
+        return future
+
+    def submit(self, exp, params=None):
+        def work(conn):
+            cur = conn.execute(exp, params or ())
+            return WriteResult(cur.lastrowid, cur.rowcount)
+        return self._submit(work)
+
+    def submit_transaction(self, fn):
+        # fn(conn) runs on the writer thread inside its own savepoint and may issue
+        # several statements; its return value is passed back to the caller
+        return self._submit(fn)
+
+    async def execute(self, exp, params=None):
+        return await asyncio.wrap_future(self.submit(exp, params))
+
+    async def transaction(self, fn):
+        return await asyncio.wrap_future(self.submit_transaction(fn))
+
+    def _collect(self, first):
+        batch = [first]
+        deadline = time.monotonic() + self.batch_window
+        stop = False
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                stop = True
+                break
+            batch.append(item)
+        return batch, stop
+
+    def _run_batch(self, conn, batch):
+        outcomes = []
+        started = time.monotonic()
+        conn.execute("BEGIN IMMEDIATE")
+        for work, future in batch:
+            conn.execute("SAVEPOINT write")
+            try:
+                result = work(conn)
+                conn.execute("RELEASE write")
+                outcomes.append((future, result, None))
+            except Exception as e:
+                if not conn.in_transaction:
+                    # sqlite rolled back the whole transaction, earlier writes are gone too
+                    raise
+                conn.execute("ROLLBACK TO write")
+                conn.execute("RELEASE write")
+                outcomes.append((future, None, e))
+        conn.execute("COMMIT")
+        with self._stats_lock:
+            self._stats['commit_time_total'] += time.monotonic() - started
+        return outcomes
+
+    def _run(self):
+        conn = self._connect()
+        try:
+            while True:
+                try:
+                    first = self._queue.get(timeout=self.checkpoint_interval if self.checkpoint_interval > 0 else None)
+                except queue.Empty:
+                    self._checkpoint(conn)
+                    continue
+                if first is _STOP:
+                    break
+                batch, stop = self._collect(first)
+                batch = [(work, future) for work, future in batch if future.set_running_or_notify_cancel()]
+                committed = True
+                if batch:
+                    try:
+                        outcomes = self._run_batch(conn, batch)
+                    except Exception as e:
+                        try:
+                            if conn.in_transaction:
+                                conn.execute("ROLLBACK")
+                        except sqlite3.Error:
+                            pass
+                        # nothing in the batch is durable, so every caller gets the error
+                        outcomes = [(future, None, e) for _, future in batch]
+                        committed = False
+                    errors = 0
+                    for future, result, error in outcomes:
+                        if error is not None:
+                            errors += 1
+                            future.set_exception(error)
+                        else:
+                            future.set_result(result)
+                    with self._stats_lock:
+                        self._stats['writes'] += len(outcomes)
+                        self._stats['errors'] += errors
+                        self._stats['batches'] += 1
+                        if not committed:
+                            self._stats['commit_failures'] += 1
+                if stop:
+                    break
+        finally:
+            conn.close()
+
+    def stats(self):
+        with self._stats_lock:
+            batches = self._stats['batches']
+            return {
+                'queue_depth': self._queue.qsize(),
+                'max_queue_depth': self._stats['max_queue_depth'],
+                'writes': self._stats['writes'],
+                'errors': self._stats['errors'],
+                'batches': batches,
+                'commit_failures': self._stats['commit_failures'],
+                'avg_batch_size': round(self._stats['writes'] / batches, 3) if batches else 0.0,
+                'avg_commit_ms': round(self._stats['commit_time_total'] * 1000 / batches, 3) if batches else 0.0,
+                'checkpoints': self._stats['checkpoints'],
+            }
+
+
+def create_writer(path):
+    writer = Writer(path)
+    atexit.register(writer.stop)
+    return writer
@@ -1,102 +1,424 @@
-import os
+import datetime
+import re
 import sqlite3
+import sys
 import configparser
+from contextlib import closing
 
 config = configparser.ConfigParser()
 config.read('config.conf')
 
 DATABASE_PATH = config['database']['path']
+JOURNAL_MODE = config.get('sqlite', 'journal_mode', fallback='WAL')
 
-def initialize_database():
-    if not os.path.exists(DATABASE_PATH):
-        with sqlite3.connect(DATABASE_PATH) as db:
-            db.execute('''
-                CREATE TABLE users (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    username TEXT NOT NULL UNIQUE,
-                    password TEXT NOT NULL,
-                    email TEXT NOT NULL UNIQUE,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    bio TEXT,
-                    following_posts TEXT,
-                    status INTEGER DEFAULT 1
-                )
-            ''')
-            db.execute('''
-                CREATE TABLE user_groups (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    name TEXT NOT NULL UNIQUE,
-                    admin TEXT NOT NULL,
-                    not_public INTEGER DEFAULT 0,
-                    can_post_announcement TEXT NOT NULL,
-                    can_post_assessment TEXT NOT NULL,
-                    can_post_pull TEXT NOT NULL,
-                    can_post_room_reservation TEXT NOT NULL,
-                    member TEXT NOT NULL
-                )
-            ''')
-            db.execute('''
-                CREATE TABLE unverified_users (
-                    username TEXT NOT NULL UNIQUE,
-                    password TEXT NOT NULL,
-                    email TEXT NOT NULL UNIQUE,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            db.execute('''
-                CREATE TABLE posts (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    title TEXT NOT NULL,
-                    content TEXT NOT NULL,
-                    author INTEGER,
-                    type TEXT NOT NULL,
-                    label TEXT NOT NULL,
-                    permission TEXT,
-                    post_as TEXT NOT NULL,
-                    start_at TIMESTAMP,
-                    end_at TIMESTAMP,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY(author) REFERENCES users(id)
-                )
-            ''')
-            db.execute('''
-                CREATE TABLE pulls (
-                    post_id INTEGER,
-                    agree INTEGER,
-                    disagree INTEGER,
-                    FOREIGN KEY(post_id) REFERENCES posts(id)
-                )
-            ''')
-            db.execute('''
-                CREATE TABLE rooms (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    name TEXT NOT NULL UNIQUE,
-                    open_time TIMESTAMP,
-                    close_time TIMESTAMP,
-                    available_days TEXT,
-                    unavailable_periods TEXT,
-                    status INTEGER DEFAULT 1
-                )
-            ''')
-            db.execute('''
-                CREATE TABLE reservations (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    room_id INTEGER,
-                    username TEXT,
-                    for TEXT,
-                    reason TEXT,
-                    start_time TIMESTAMP,
-                    end_time TIMESTAMP,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    approval_status INTEGER DEFAULT 0,
-                    approved_by TEXT,
-                    FOREIGN KEY(room_id) REFERENCES rooms(id),
-                    FOREIGN KEY(username) REFERENCES users(username),
-                    FOREIGN KEY(approved_by) REFERENCES users(username)
-                )
-            ''')
-            db.commit()
-
-initialize_database()
\ No newline at end of file
+# Each migration runs in its own transaction and is recorded in PRAGMA user_version.
+# Migrations must stay idempotent: databases created before versioning start at 0.
+
+def create_base_schema(db):
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT NOT NULL UNIQUE,
+            password TEXT NOT NULL,
+            email TEXT NOT NULL UNIQUE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            bio TEXT,
+            following_posts TEXT,
+            status INTEGER DEFAULT 1
+        )
+    ''')
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS user_groups (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL UNIQUE,
+            not_public INTEGER DEFAULT 0
+        )
+    ''')
+    create_group_members(db)
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS unverified_users (
+            username TEXT NOT NULL UNIQUE,
+            password TEXT NOT NULL,
+            email TEXT NOT NULL UNIQUE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS posts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT NOT NULL,
+            content TEXT NOT NULL,
+            author INTEGER,
+            type TEXT NOT NULL,
+            label TEXT NOT NULL,
+            permission TEXT,
+            post_as TEXT NOT NULL,
+            start_at TIMESTAMP,
+            end_at TIMESTAMP,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY(author) REFERENCES users(id)
+        )
+    ''')
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS pulls (
+            post_id INTEGER,
+            agree INTEGER,
+            disagree INTEGER,
+            FOREIGN KEY(post_id) REFERENCES posts(id)
+        )
+    ''')
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS rooms (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL UNIQUE,
+            open_time TIMESTAMP,
+            close_time TIMESTAMP,
+            available_days TEXT,
+            unavailable_periods TEXT,
+            status INTEGER DEFAULT 1
+        )
+    ''')
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS reservations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            room_id INTEGER,
+            username TEXT,
+            for TEXT,
+            reason TEXT,
+            start_time TIMESTAMP,
+            end_time TIMESTAMP,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            approval_status INTEGER DEFAULT 0,
+            approved_by TEXT,
+            FOREIGN KEY(room_id) REFERENCES rooms(id),
+            FOREIGN KEY(username) REFERENCES users(username),
+            FOREIGN KEY(approved_by) REFERENCES users(username)
+        )
+    ''')
+
+POST_PERMISSION_COLUMNS = ['can_post_announcement', 'can_post_assessment', 'can_post_pull', 'can_post_room_reservation']
+
+def create_group_members(db):
+    # one row per (group, user); the username index covers every per-user lookup
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS group_members (
+            group_id INTEGER NOT NULL,
+            username TEXT NOT NULL,
+            role TEXT NOT NULL DEFAULT 'member',
+            can_post_announcement INTEGER NOT NULL DEFAULT 0,
+            can_post_assessment INTEGER NOT NULL DEFAULT 0,
+            can_post_pull INTEGER NOT NULL DEFAULT 0,
+            can_post_room_reservation INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (group_id, username),
+            FOREIGN KEY(group_id) REFERENCES user_groups(id)
+        ) WITHOUT ROWID
+    ''')
+    db.execute('''
+        CREATE INDEX IF NOT EXISTS idx_group_members_username
+        ON group_members (username, group_id, role, can_post_announcement, can_post_assessment, can_post_pull, can_post_room_reservation)
+    ''')
+
+def split_csv(value):
+    if not value:
+        return []
+    return [item.strip() for item in str(value).split(',') if item.strip()]
+
+def migrate_group_members(db):
+    # converts the comma-joined admin/member/can_post_* columns of user_groups into group_members
+    columns = [row[1] for row in db.execute("PRAGMA table_info(user_groups)")]
+    create_group_members(db)
+    if 'member' not in columns:
+        return
+    rows = db.execute(f"SELECT id, admin, member, {', '.join(POST_PERMISSION_COLUMNS)} FROM user_groups").fetchall()
+    for group_id, admin, member, *permissions in rows:
+        admins = split_csv(admin)
+        permission_sets = [set(split_csv(users)) for users in permissions]
+        # anyone listed in any column becomes a member, like create_group always added the admin
+        usernames = list(dict.fromkeys(split_csv(member) + admins + [u for users in permissions for u in split_csv(users)]))
+        db.executemany(f'''
+            INSERT OR IGNORE INTO group_members (group_id, username, role, {', '.join(POST_PERMISSION_COLUMNS)})
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', [
+            (group_id, username, 'admin' if username in admins else 'member', *[int(username in users) for users in permission_sets])
+            for username in usernames
+        ])
+    db.execute('''
+        CREATE TABLE user_groups_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL UNIQUE,
+            not_public INTEGER DEFAULT 0
+        )
+    ''')
+    db.execute("INSERT INTO user_groups_new (id, name, not_public) SELECT id, name, not_public FROM user_groups")
+    db.execute("DROP TABLE user_groups")
+    db.execute("ALTER TABLE user_groups_new RENAME TO user_groups")
+
+def create_sessions(db):
+    # server-side sessions shared by all workers; expires_at is a unix timestamp
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS sessions (
+            session_id TEXT PRIMARY KEY,
+            username TEXT NOT NULL,
+            expires_at INTEGER NOT NULL
+        ) WITHOUT ROWID
+    ''')
+    db.execute("CREATE INDEX IF NOT EXISTS idx_sessions_username ON sessions (username)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_sessions_expires_at ON sessions (expires_at)")
+
+def create_email_outbox(db):
+    # status: 0=pending, 1=sent, 2=failed, 3=claimed by a delivery worker
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS email_outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            recipient TEXT NOT NULL,
+            subject TEXT NOT NULL,
+            body TEXT NOT NULL,
+            status INTEGER NOT NULL DEFAULT 0,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at INTEGER NOT NULL,
+            last_error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            sent_at INTEGER
+        )
+    ''')
+    db.execute("CREATE INDEX IF NOT EXISTS idx_email_outbox_status ON email_outbox (status, next_attempt_at)")
+
+def rename_posts_type(db):
+    # the models always queried posts.post_type
+    columns = [row[1] for row in db.execute("PRAGMA table_info(posts)")]
+    if 'type' in columns and 'post_type' not in columns:
+        db.execute("ALTER TABLE posts RENAME COLUMN type TO post_type")
+
+def add_reservation_approval_columns(db):
+    columns = [row[1] for row in db.execute("PRAGMA table_info(reservations)")]
+    if 'approved_at' not in columns:
+        db.execute("ALTER TABLE reservations ADD COLUMN approved_at TIMESTAMP")
+    if 'approved_reason' not in columns:
+        db.execute("ALTER TABLE reservations ADD COLUMN approved_reason TEXT")
+
+def create_indexes(db):
+    # feeds filter on one column and page by (created_at, id), see posts.get_posts
+    db.execute("CREATE INDEX IF NOT EXISTS idx_posts_public ON posts (post_type, created_at, id) WHERE permission IS NULL")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_posts_author ON posts (author, post_type, created_at, id)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_posts_post_as ON posts (post_as, post_type, created_at, id)")
+    db.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_pulls_post_id ON pulls (post_id)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_reservations_room_time ON reservations (room_id, start_time, end_time)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_reservations_username ON reservations (username, start_time)")
+    # users.username, users.email, unverified_users.username and unverified_users.email
+    # are already indexed by their UNIQUE constraints
+
+def create_post_permissions(db):
+    # (post_id, group_id) rows mirroring the comma-joined posts.permission column
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS post_permissions (
+            post_id INTEGER NOT NULL,
+            group_id INTEGER NOT NULL,
+            PRIMARY KEY (post_id, group_id)
+        ) WITHOUT ROWID
+    ''')
+    db.execute("CREATE INDEX IF NOT EXISTS idx_post_permissions_group ON post_permissions (group_id, post_id)")
+    rows = db.execute("SELECT id, permission FROM posts WHERE permission IS NOT NULL").fetchall()
+    db.executemany("INSERT OR IGNORE INTO post_permissions (post_id, group_id) VALUES (?, ?)", [
+        (post_id, int(group_id)) for post_id, permission in rows for group_id in split_csv(permission) if group_id.isdigit()
+    ])
+
+def create_pull_votes(db):
+    # one row per (pull, user) so every user is counted once, and the last vote flush of
+    # each worker process, see models/votes.py
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS pull_votes (
+            post_id INTEGER NOT NULL,
+            username TEXT NOT NULL,
+            opinion TEXT NOT NULL,
+            PRIMARY KEY (post_id, username)
+        ) WITHOUT ROWID
+    ''')
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS vote_flush_marks (
+            worker TEXT PRIMARY KEY,
+            seq INTEGER NOT NULL
+        ) WITHOUT ROWID
+    ''')
+
+def create_post_followers(db):
+    # replaces the comma-joined users.following_posts column, which is no longer written
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS post_followers (
+            username TEXT NOT NULL,
+            post_id INTEGER NOT NULL,
+            PRIMARY KEY (username, post_id)
+        ) WITHOUT ROWID
+    ''')
+    db.execute("CREATE INDEX IF NOT EXISTS idx_post_followers_post ON post_followers (post_id)")
+    # timeline windows filter on start_at/end_at
+    db.execute("CREATE INDEX IF NOT EXISTS idx_posts_schedule ON posts (start_at, end_at)")
+    rows = db.execute("SELECT username, following_posts FROM users WHERE following_posts IS NOT NULL").fetchall()
+    db.executemany("INSERT OR IGNORE INTO post_followers (username, post_id) VALUES (?, ?)", [
+        (username, int(post_id)) for username, following_posts in rows for post_id in split_csv(following_posts) if post_id.isdigit()
+    ])
+
+def add_reservation_series(db):
+    # reservations created together by reserve_room_recurring share the id of the first one
+    columns = [row[1] for row in db.execute("PRAGMA table_info(reservations)")]
+    if 'series_id' not in columns:
+        db.execute("ALTER TABLE reservations ADD COLUMN series_id INTEGER")
+
+def create_room_blackouts(db):
+    # rooms.unavailable_periods becomes room_blackouts rows and rooms.available_days a
+    # weekday bitmask (bit n - 1 = weekday n, 1=Sunday); the old columns are no longer used
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS room_blackouts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            room_id INTEGER NOT NULL,
+            start_time TIMESTAMP NOT NULL,
+            end_time TIMESTAMP NOT NULL,
+            FOREIGN KEY(room_id) REFERENCES rooms(id)
+        )
+    ''')
+    db.execute("CREATE INDEX IF NOT EXISTS idx_room_blackouts_room_start ON room_blackouts (room_id, start_time)")
+    columns = [row[1] for row in db.execute("PRAGMA table_info(rooms)")]
+    if 'available_days_mask' in columns:
+        return
+    db.execute("ALTER TABLE rooms ADD COLUMN available_days_mask INTEGER NOT NULL DEFAULT 127")
+    for room_id, available_days, unavailable_periods in db.execute("SELECT id, available_days, unavailable_periods FROM rooms").fetchall():
+        mask = 0
+        for day in split_csv(available_days):
+            if day.isdigit() and 1 <= int(day) <= 7:
+                mask |= 1 << (int(day) - 1)
+        db.execute("UPDATE rooms SET available_days_mask = ? WHERE id = ?", (mask, room_id))
+        for period in split_csv(unavailable_periods):
+            # both timestamps are 19 characters and contain '-' themselves
+            try:
+                start_time, end_time = (datetime.datetime.strptime(value, '%Y-%m-%d %H:%M:%S') for value in (period[:19], period[20:]))
+            except ValueError:
+                print(f"Skipping malformed unavailable period of room {room_id}: {period}")
+                continue
+            db.execute("INSERT INTO room_blackouts (room_id, start_time, end_time) VALUES (?, ?, ?)", (room_id, str(start_time), str(end_time)))
+
+def index_end_times(db):
+    # the room grid reloads the reservations and blackouts that have not ended yet
+    db.execute("CREATE INDEX IF NOT EXISTS idx_reservations_end_time ON reservations (end_time, approval_status)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_room_blackouts_end_time ON room_blackouts (end_time)")
+
+def index_start_times(db):
+    # reservations listed by time range alone (admin views), together with idx_reservations_end_time
+    db.execute("CREATE INDEX IF NOT EXISTS idx_reservations_start_time ON reservations (start_time)")
+
+MIGRATIONS = [
+    create_base_schema,
+    migrate_group_members,
+    create_sessions,
+    create_email_outbox,
+    rename_posts_type,
+    add_reservation_approval_columns,
+    create_indexes,
+    create_post_permissions,
+    create_pull_votes,
+    create_post_followers,
+    add_reservation_series,
+    create_room_blackouts,
+    index_end_times,
+    index_start_times,
+]
+
+# (name, query, params) for every query on a request path; check_query_plans fails when
+# one of them makes SQLite scan a whole table
+HOT_QUERIES = [
+    ("public posts", "SELECT id, title, author, label, created_at, start_at, end_at, post_as FROM posts WHERE post_type = ? AND permission IS NULL AND (created_at, id) < (?, ?) ORDER BY created_at DESC, id DESC LIMIT ?", ('announcement', '', 0, 31)),
+    ("posts by author", "SELECT id, title, author, label, created_at, start_at, end_at, post_as FROM posts WHERE post_type = ? AND author = ? AND (permission IS NULL OR EXISTS (SELECT 1 FROM post_permissions pp WHERE pp.post_id = posts.id AND pp.group_id IN (?, ?))) ORDER BY created_at DESC, id DESC LIMIT ?", ('announcement', '', 1, 2, 31)),
+    ("posts by group", "SELECT id, title, author, label, created_at, start_at, end_at, post_as FROM posts WHERE post_type = ? AND post_as = ? AND (permission IS NULL OR EXISTS (SELECT 1 FROM post_permissions pp WHERE pp.post_id = posts.id AND pp.group_id IN (?, ?))) ORDER BY created_at DESC, id DESC LIMIT ?", ('announcement', 1, 1, 2, 31)),
+    ("post visibility", "SELECT (permission IS NULL OR EXISTS (SELECT 1 FROM post_permissions pp WHERE pp.post_id = posts.id AND pp.group_id IN (?, ?))) FROM posts WHERE id = ?", (1, 2, 1)),
+    ("pull by post", "SELECT agree, disagree, (SELECT seq FROM vote_flush_marks WHERE worker = ?) FROM pulls WHERE post_id = ?", ('', 1)),
+    ("pull vote", "SELECT EXISTS (SELECT 1 FROM pull_votes WHERE post_id = ? AND username = ?) FROM pulls WHERE post_id = ?", (1, '', 1)),
+    ("timeline", "SELECT posts.id, posts.title, posts.label, posts.start_at, posts.end_at, posts.post_as FROM post_followers f JOIN posts ON posts.id = f.post_id WHERE f.username = ? AND posts.post_type IN ('announcement', 'assessment') AND posts.start_at <= ? AND COALESCE(posts.end_at, posts.start_at) >= ? AND (permission IS NULL OR EXISTS (SELECT 1 FROM post_permissions pp WHERE pp.post_id = posts.id AND pp.group_id IN (?, ?))) ORDER BY posts.start_at, posts.id", ('', '', '', 1, 2)),
+    ("user authz", "SELECT m.group_id, g.name, m.role, m.can_post_announcement, m.can_post_assessment, m.can_post_pull, m.can_post_room_reservation FROM group_members m JOIN user_groups g ON g.id = m.group_id WHERE m.username = ?", ('',)),
+    ("group members", "SELECT username FROM group_members WHERE group_id = ?", (1,)),
+    ("session", "SELECT username, expires_at FROM sessions WHERE session_id = ?", ('',)),
+    ("user by username", "SELECT * FROM users WHERE username = ?", ('',)),
+    ("unverified user by email", "SELECT * FROM unverified_users WHERE email = ?", ('',)),
+    ("room conflicts", "WITH items (n, room_id, start_time, end_time) AS (VALUES (?, ?, ?, ?), (?, ?, ?, ?)) SELECT items.n FROM items JOIN reservations r ON r.room_id = items.room_id AND r.start_time < items.end_time AND r.end_time > items.start_time AND r.approval_status IN (0, 1) AND r.id IS NOT ? UNION SELECT items.n FROM items JOIN room_blackouts b ON b.room_id = items.room_id AND b.start_time < items.end_time AND b.end_time > items.start_time", (0, 1, '', '', 1, 2, '', '', None)),
+    ("reservations by user", "SELECT id, room_id, username, for, reason, start_time, end_time, created_at, approval_status FROM reservations WHERE (start_time BETWEEN ? AND ? OR end_time BETWEEN ? AND ?) AND username = ?", ('', '', '', '', '')),
+    ("reservations by time", "SELECT id, room_id, username, for, reason, start_time, end_time, created_at, approval_status, approved_by, approved_at, approved_reason FROM reservations WHERE (start_time BETWEEN ? AND ? OR end_time BETWEEN ? AND ?)", ('', '', '', '')),
+    ("room holdings", "SELECT id, room_id, start_time, end_time FROM reservations WHERE end_time > ? AND approval_status IN (0, 1)", ('',)),
+    ("room blackouts", "SELECT id, room_id, start_time, end_time FROM room_blackouts WHERE end_time > ?", ('',)),
+    ("email outbox claim", "SELECT id, recipient, subject, body, attempts FROM email_outbox WHERE (status = ? AND next_attempt_at <= ?) OR (status = ? AND next_attempt_at <= ?) ORDER BY next_attempt_at LIMIT ?", (0, 0, 3, 0, 20)),
+]
+
+_FULL_SCAN = re.compile(r'^SCAN (TABLE )?(\w+)$')
+
+def check_query_plans(db):
+    # scans of CTEs and VALUES lists are expected, only tables count
+    tables = {row[0] for row in db.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    failures = []
+    for name, query, params in HOT_QUERIES:
+        for row in db.execute(f"EXPLAIN QUERY PLAN {query}", params):
+            match = _FULL_SCAN.match(row[-1])
+            if match and match.group(2) in tables:
+                failures.append((name, row[-1]))
+    return failures
+
+def get_schema_version(db):
+    return db.execute("PRAGMA user_version").fetchone()[0]
+
+def migrate_database(path=None):
+    db = sqlite3.connect(path or DATABASE_PATH, isolation_level=None)
+    applied = []
+    try:
+        while True:
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                # read under the write lock: workers starting together must not run a
+                # migration twice
+                version = get_schema_version(db)
+                if version >= len(MIGRATIONS):
+                    db.execute("COMMIT")
+                    break
+                migration = MIGRATIONS[version]
+                migration(db)
+                # user_version lives in the database header and commits with the migration
+                db.execute(f"PRAGMA user_version = {version + 1}")
+                db.execute("COMMIT")
+            except Exception:
+                db.execute("ROLLBACK")
+                raise
+            applied.append(migration.__name__)
+    finally:
+        db.close()
+    return applied
+
+def initialize_database(path=None):
+    path = path or DATABASE_PATH
+    # journal_mode is persistent in the database file, so existing databases are switched too
+    with closing(sqlite3.connect(path)) as db:
+        db.execute(f"PRAGMA journal_mode = {JOURNAL_MODE}")
+    return migrate_database(path)
+
+def main(argv):
+    command = argv[1] if len(argv) > 1 else 'migrate'
+    if command == 'migrate':
+        applied = initialize_database()
+        print(f"Applied {len(applied)} migration(s): {', '.join(applied)}" if applied else "Database is up to date")
+    elif command == 'status':
+        with closing(sqlite3.connect(DATABASE_PATH)) as db:
+            version = get_schema_version(db)
+        print(f"Schema version {version} of {len(MIGRATIONS)}")
+        for number, migration in enumerate(MIGRATIONS, start=1):
+            print(f"  {number:3} {'applied' if number <= version else 'pending'}  {migration.__name__}")
+    elif command == 'check':
+        initialize_database()
+        with closing(sqlite3.connect(DATABASE_PATH)) as db:
+            failures = check_query_plans(db)
+        for name, detail in failures:
+            print(f"Full table scan in '{name}': {detail}")
+        if failures:
+            return 1
+        print(f"All {len(HOT_QUERIES)} hot queries use an index")
+    else:
+        print("Usage: python init.py [migrate|status|check]")
+        return 2
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
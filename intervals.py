@@ -0,0 +1,81 @@
+import bisect
+import threading
+
+
+# Half-open [start, end) intervals grouped by key and kept sorted by start.
+# No interval of a key is longer than its recorded max length, so every interval that
+# overlaps [start, end) starts in (start - max_length, end): one bisect finds the
+# candidates and only intervals starting within max_length of the window are skipped.
+class IntervalIndex:
+    def __init__(self):
+        self._starts = {}  # key -> sorted starts
+        self._entries = {}  # key -> [(start, end, item_id)] in the same order
+        self._max_length = {}
+        self._items = {}  # item_id -> (key, start, end)
+        self._lock = threading.Lock()
+
+    def add(self, key, item_id, start, end):
+        with self._lock:
+            if item_id in self._items:
+                self._remove(item_id)
+            starts = self._starts.setdefault(key, [])
+            entries = self._entries.setdefault(key, [])
+            position = bisect.bisect_right(entries, (start, end, item_id))
+            starts.insert(position, start)
+            entries.insert(position, (start, end, item_id))
+            self._items[item_id] = (key, start, end)
+            # never shrinks on removal, which only widens the scanned range
+            if key not in self._max_length or end - start > self._max_length[key]:
+                self._max_length[key] = end - start
+
+    def _remove(self, item_id):
+        key, start, end = self._items.pop(item_id)
+        entries = self._entries[key]
+        position = bisect.bisect_left(entries, (start, end, item_id))
+        del entries[position]
+        del self._starts[key][position]
+
+    def remove(self, item_id):
+        with self._lock:
+            if item_id not in self._items:
+                return False
+            self._remove(item_id)
+            return True
+
+    def get(self, item_id):
+        with self._lock:
+            return self._items.get(item_id)
+
+    def overlapping(self, key, start, end):
+        # [(start, end, item_id)] of key overlapping [start, end), ordered by start
+        with self._lock:
+            if key not in self._max_length:
+                return []
+            starts = self._starts[key]
+            entries = self._entries[key]
+            low = bisect.bisect_right(starts, start - self._max_length[key])
+            high = bisect.bisect_left(starts, end)
+            return [entry for entry in entries[low:high] if entry[1] > start]
+
+    def has_overlap(self, key, start, end):
+        with self._lock:
+            if key not in self._max_length:
+                return False
+            starts = self._starts[key]
+            entries = self._entries[key]
+            low = bisect.bisect_right(starts, start - self._max_length[key])
+            high = bisect.bisect_left(starts, end)
+            return any(entries[i][1] > start for i in range(low, high))
+
+    def items(self):
+        # {item_id: (key, start, end)}
+        with self._lock:
+            return dict(self._items)
+
+    def keys(self):
+        with self._lock:
+            return list(self._entries)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._items)
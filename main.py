@@ -1,19 +1,26 @@
 from functools import wraps
-from flask import Flask, jsonify, request, make_response, session, url_for, sessions, redirect
+from flask import jsonify, request, url_for, redirect
 from flask_cors import CORS
-import asyncio
-import json
-from models import dash, posts, users, auth, groups, room_reservation
-import aiosmtplib
-import aiosqlite
+from models import dash, posts, users, auth, groups, room_reservation, sessions, outbox, votes
 import configparser
-
-app = Flask(__name__)
+import math
+import db_pool
+import db_writer
+import init
+import passwords
+import ratelimit
+import responses
+import schemas
+import serving
+from schemas import body, query
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+# async views run on the worker's long-lived event loop, see serving.py
+app = serving.AsyncFlask(__name__)
 CORS(app)
 
-app.config['JSONIFY_PRETTYPRINT_REGULAR'] = True
-
-loop = asyncio.get_event_loop()
+# compact output through one encoder (orjson when installed), see responses.py
+app.json = responses.JSONProvider(app)
 
 config = configparser.ConfigParser()
 config.read('config.conf')
@@ -25,53 +32,103 @@ SMTP_PASSWORD = config['email']['smtp_password']
 SMTP_SERVER = config['email']['smtp_server']
 SMTP_PORT = config['email']['smtp_port']
 EMAIL_USERNAME = config['email']['smtp_username']
-SMTP_USE_TLS = config['email']['smtp_use_tls']
+SMTP_USE_TLS = config.getboolean('email', 'smtp_use_tls')
 GLOBAL_ADMIN = config['user_groups']['global_admin']
 ROOM_ADMIN = config['user_groups']['room_admin']
 
 app.secret_key = SECRET_KEY
+# larger bodies are refused with 413; under uvicorn asgi.py does it while receiving them
+app.config['MAX_CONTENT_LENGTH'] = config.getint('server', 'max_content_length', fallback=1048576)
+
+# behind that many reverse proxies the client address is taken from X-Forwarded-For
+PROXY_HOPS = config.getint('server', 'proxy_hops', fallback=0)
+if PROXY_HOPS:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=PROXY_HOPS)
+
+# fork the hashing processes while this is still the only thread, see passwords.py
+passwords.start()
+
+# bring the schema up to date before any connection is opened
+init.initialize_database(DATABASE_PATH)
+
+# SELECT paths use read-only connections, which in WAL mode never wait on the writer
+pool = db_pool.ConnectionPool(db_pool.read_only_uri(DATABASE_PATH), pragmas=db_pool.READ_PRAGMAS, uri=True)
+writer = db_writer.create_writer(DATABASE_PATH)
+room_reservation.load_grid()
+
+@serving.on_startup
+def start_services():
+    writer.start()
+    sessions.start()
+    outbox.start()
+    votes.start()
+    ratelimit.start()
+
+@serving.on_shutdown
+async def stop_services():
+    # votes are flushed through the writer and the outbox claims with it, so it stops last
+    votes.stop()
+    outbox.stop(5)
+    sessions.stop()
+    await pool.close()
+    # connections still checked out keep a non-daemon aiosqlite thread alive; stop them too
+    pool.terminate()
+    writer.stop(5)
+    passwords.stop()
+    ratelimit.stop()
 
 async def db(exp, params=None):
+    # writes are serialized through the writer thread and group-committed;
+    # their errors are raised to the caller instead of being swallowed here
+    if not db_pool.is_read_only(exp):
+        return await writer.execute(exp, params)
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as conn:
+        async with pool.connection() as conn:
             async with conn.cursor() as cur:
                 if params:
                     await cur.execute(exp, params)
                 else:
                     await cur.execute(exp)
-                if exp.strip().upper().startswith("SELECT"):
-                    r = await cur.fetchall()
-                    return r
-                else:
-                    await conn.commit()
+                r = await cur.fetchall()
+                return r
     except Exception as e:
         print(f"An error occurred: {e}")
 
+async def db_transaction(fn):
+    # fn(conn) runs several statements atomically on the writer connection
+    return await writer.transaction(fn)
+
 async def send_email(email, subject, message):
-    try:
-        async with aiosmtplib.SMTP(hostname=SMTP_SERVER, port=SMTP_PORT) as smtp:
-            await smtp.connect()
-            await smtp.starttls()
-            await smtp.login(EMAIL_USERNAME, SMTP_PASSWORD)
-            message = f"Subject: {subject}\n\n{message}"
-            await smtp.sendmail(EMAIL_USERNAME, email, message)
-            await smtp.quit()
-    except aiosmtplib.SMTPException as e:
-        raise
+    # only records the message; the outbox worker delivers it over a kept-alive SMTP connection
+    return await outbox.enqueue(email, subject, message)
 
 def login_required(f):
     @wraps(f)
-    def decorated_function(*args, **kwargs):
+    async def decorated_function(*args, **kwargs):
         session_id = request.cookies.get('session_id')
-        if session_id is None or session_id not in session:
+        if session_id is None or not await sessions.get(session_id):
             return redirect(url_for('login'))
-        return f(*args, **kwargs)
+        return await f(*args, **kwargs)
     return decorated_function
 
+def too_many_requests(retry_after):
+    response = jsonify({'message': "Too many attempts, please try again later"})
+    response.headers['Retry-After'] = str(math.ceil(retry_after))
+    return response, 429
+
 @app.route("/")
 async def index():
     return BACKEND_VERSION, 200
 
+@app.route('/stats', methods=['GET'])
+async def get_stats():
+    try:
+        session_id = request.cookies.get('session_id')
+        msg, code = await dash.get_stats(session_id)
+        return jsonify({'message': msg}), code
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/confirm/<token>')
 async def confirm_email(token):
     try:
@@ -81,34 +138,25 @@ async def confirm_email(token):
         return jsonify({'error': str(e)}), 500
 
 @app.route('/signup', methods=['POST'])
-async def signup():
-    try:
-        data = json.loads(request.data)
-        username = data.get('username')
-        password = data.get('password')
-        email = data.get('email')
-    except json.JSONDecodeError:
-        return jsonify({'error': 'Invalid JSON payload'}), 400
-    if not username or not password or not email:
-        return jsonify({'error': 'Missing required fields'}), 400
-    try:
-        msg, code = await users.signup(username, password, email)
+@body(schemas.SIGNUP)
+async def signup(data):
+    retry_after = ratelimit.admit('signup', request.remote_addr, data.username)
+    if retry_after:
+        return too_many_requests(retry_after)
+    try:
+        msg, code = await users.signup(data.username, data.password, data.email)
         return jsonify({'message': msg}), code
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/login', methods=['POST'])
-async def login():
+@body(schemas.LOGIN)
+async def login(data):
+    retry_after = ratelimit.admit('login', request.remote_addr, data.username)
+    if retry_after:
+        return too_many_requests(retry_after)
     try:
-        data = json.loads(request.data)
-        username = data.get('username')
-        password = data.get('password')
-    except json.JSONDecodeError:
-        return jsonify({'error': 'Invalid JSON payload'}), 400
-    if not username or not password:
-        return jsonify({'error': 'Missing required fields'}), 400
-    try:
-        return await users.login(username, password)
+        return await users.login(data.username, data.password)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -123,69 +171,41 @@ async def logout():
 
 
 @app.route('/modify_user', methods=['POST'])
-async def modify_user():
+@body(schemas.MODIFY_USER)
+async def modify_user(data):
     try:
-        data = json.loads(request.data)
         session_id = request.cookies.get('session_id')
-        target_username = data.get('target_username')
-        action = data.get('action')
-        password = data.get('password')
-        bio = data.get('bio')
-        admin = data.get('admin')
-    except json.JSONDecodeError:
-        return jsonify({'error': 'Invalid JSON payload'}), 400
-    try:
-        msg, code = await users.modify_user(session_id, target_username, action, password, bio, admin)
+        msg, code = await users.modify_user(session_id, data.target_username, data.action, data.password, data.bio, data.admin)
         return jsonify({'message': msg}), code
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/get_user_groups', methods=['GET'])
-async def get_user_groups():
+@query(schemas.USER_GROUPS)
+async def get_user_groups(data):
     try:
         session_id = request.cookies.get('session_id')
-        username = request.args.get('username')
-        if not username:
-            username = await users.get_username_from_session(session_id)
-        msg, code = await groups.get_user_groups(session_id, username)
+        msg, code = await groups.get_user_groups(session_id, data.username)
         return jsonify({'message': msg}), code
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/create_group', methods=['POST'])
-async def create_group():
+@body(schemas.CREATE_GROUP)
+async def create_group(data):
     try:
-        data = json.loads(request.data)
         session_id = request.cookies.get('session_id')
-        group_name = data.get('group_name')
-        admin = data.get('admin')
-        not_public = data.get('not_public')
-        can_post_announcements = data.get('can_post_announcements')
-        can_post_assessment = data.get('can_post_assessment')
-        can_post_pull = data.get('can_post_pull')
-        can_post_room_reservation = data.get('can_post_room_reservation')
-        members = data.get('members')
-    except json.JSONDecodeError:
-        return jsonify({'error': 'Invalid JSON payload'}), 400
-    try:
-        msg, code = await groups.create_group(session_id, group_name, admin, not_public, can_post_announcements, can_post_assessment, can_post_pull, can_post_room_reservation, members)
+        msg, code = await groups.create_group(session_id, data.group_name, data.admin, data.not_public, data.can_post_announcements, data.can_post_assessment, data.can_post_pull, data.can_post_room_reservation, data.members)
         return jsonify({'message': msg}), code
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/modify_group', methods=['POST'])
-async def modify_group():
-    try:
-        data = json.loads(request.data)
-    except json.JSONDecodeError:
-        return jsonify({'error': 'Invalid JSON payload'}), 400
+@body(schemas.MODIFY_GROUP)
+async def modify_group(data):
     session_id = request.cookies.get('session_id')
-    group_id = data.get('group_id')
-    action = data.get('action')
-    subject = data.get('subject')
-    #
     try:
-        msg, code = await groups.modify_group(session_id, group_id, action, subject)
+        msg, code = await groups.modify_group(session_id, data.group_id, data.action, data.subject)
         return jsonify({'message': msg}), code
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -200,294 +220,211 @@ async def get_public_groups():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 @app.route('/join_public_group', methods=['POST'])
-async def join_public_group():
+@body(schemas.GROUP)
+async def join_public_group(data):
     try:
-        data = json.loads(request.data)
         session_id = request.cookies.get('session_id')
-        group_id = data.get('group_id')
-    except json.JSONDecodeError:
-        return jsonify({'error': 'Invalid JSON payload'}), 400
-    try:
-        msg, code = await groups.join_public_group(session_id, group_id)
+        msg, code = await groups.join_public_group(session_id, data.group_id)
         return jsonify({'message': msg}), code
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/leave_group', methods=['POST'])
-async def leave_group():
+@body(schemas.GROUP)
+async def leave_group(data):
     try:
-        data = json.loads(request.data)
         session_id = request.cookies.get('session_id')
-        group_id = data.get('group_id')
-    except json.JSONDecodeError:
-        return jsonify({'error': 'Invalid JSON payload'}), 400
-    try:
-        msg, code = await groups.leave_group(session_id, group_id)
+        msg, code = await groups.leave_group(session_id, data.group_id)
         return jsonify({'message': msg}), code
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 @app.route('/create_post', methods=['POST'])
-async def create_post():
+@body(schemas.CREATE_POST)
+async def create_post(data):
     try:
-        data = json.loads(request.data)
         session_id = request.cookies.get('session_id')
-        title = data.get('title')
-        content = data.get('content')
-        post_type = data.get('post_type')
-        permission = data.get('permission')
-        post_as = data.get('post_as')
-        start_at = data.get('start_at')
-        end_at = data.get('end_at')
-        label = data.get('label')
-    except json.JSONDecodeError:
-        return jsonify({'error': 'Invalid JSON payload'}), 400
-    try:
-        msg, code = await posts.create_post(session_id, title, content, post_type, permission, post_as, start_at, end_at, label)
+        msg, code = await posts.create_post(session_id, data.title, data.content, data.post_type, data.permission, data.post_as, data.start_at, data.end_at, data.label)
         return jsonify({'message': msg}), code
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/get_posts', methods=['GET'])
-async def get_posts():
+@query(schemas.GET_POSTS)
+async def get_posts(data):
     try:
-        data = json.loads(request.data)
         session_id = request.cookies.get('session_id')
-        post_type = data.get('post_type')
-        start_from = int(data.get('start_from'))
-        view_type = data.get('view_type')
-        id = data.get('id')
-        admin = data.get('admin')
-    except json.JSONDecodeError:
-        return jsonify({'error': 'Invalid JSON payload'}), 400
-    try:
-        return await posts.get_posts(session_id, post_type, start_from, view_type, id, admin)
+        return await posts.get_posts(session_id, data.post_type, data.cursor, data.view_type, data.id, data.admin, data.page_size)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/get_details', methods=['GET'])
-async def get_details():
+@query(schemas.POST)
+async def get_details(data):
     try:
-        data = json.loads(request.data)
         session_id = request.cookies.get('session_id')
-        post_id = data.get('post_id')
-    except json.JSONDecodeError:
-        return jsonify({'error': 'Invalid JSON payload'}), 400
-    try:
-        return await posts.get_details(session_id, post_id)
+        return await posts.get_details(session_id, data.post_id)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/get_pull_details', methods=['GET'])
-async def get_pull_details():
+@query(schemas.POST)
+async def get_pull_details(data):
     try:
-        data = json.loads(request.data)
         session_id = request.cookies.get('session_id')
-        post_id = data.get('post_id')
-    except json.JSONDecodeError:
-        return jsonify({'error': 'Invalid JSON payload'}), 400
-    try:
-        return await posts.get_pull_details(session_id, post_id)
+        return await posts.get_pull_details(session_id, data.post_id)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/vote', methods=['POST'])
-async def vote():
+@body(schemas.VOTE)
+async def vote(data):
     try:
-        data = json.loads(request.data)
         session_id = request.cookies.get('session_id')
-        post_id = data.get('post_id')
-        vote = data.get('vote')
-    except json.JSONDecodeError:
-        return jsonify({'error': 'Invalid JSON payload'}), 400
-    try:
-        msg, code = await posts.vote(session_id, post_id, vote)
+        msg, code = await posts.vote(session_id, data.post_id, data.vote)
         return jsonify({'message': msg}), code
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/modify_post', methods=['POST'])
-async def modify_post():
+@body(schemas.MODIFY_POST)
+async def modify_post(data):
     try:
-        data = json.loads(request.data)
         session_id = request.cookies.get('session_id')
-        post_id = data.get('post_id')
-        action = data.get('action')
-        title = data.get('title')
-        content = data.get('content')
-        label = data.get('label')
-        permission = data.get('permission')
-    except json.JSONDecodeError:
-        return jsonify({'error': 'Invalid JSON payload'}), 400
-    try:
-        msg, code = await posts.modify_post(session_id, post_id, action, title, content, label, permission)
+        msg, code = await posts.modify_post(session_id, data.post_id, data.action, data.title, data.content, data.label, data.permission)
         return jsonify({'message': msg}), code
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/follow_post', methods=['POST'])
-async def follow_post():
+@body(schemas.POST)
+async def follow_post(data):
     try:
-        data = json.loads(request.data)
         session_id = request.cookies.get('session_id')
-        post_id = data.get('post_id')
-    except json.JSONDecodeError:
-        return jsonify({'error': 'Invalid JSON payload'}), 400
-    try:
-        msg, code = await posts.follow_post(session_id, post_id, "follow")
+        msg, code = await posts.follow_post(session_id, data.post_id, "follow")
         return jsonify({'message': msg}), code
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/unfollow_post', methods=['POST'])
-async def unfollow_post():
+@body(schemas.POST)
+async def unfollow_post(data):
     try:
-        data = json.loads(request.data)
         session_id = request.cookies.get('session_id')
-        post_id = data.get('post_id')
-    except json.JSONDecodeError:
-        return jsonify({'error': 'Invalid JSON payload'}), 400
-    try:
-        msg, code = await posts.follow_post(session_id, post_id, "unfollow")
+        msg, code = await posts.follow_post(session_id, data.post_id, "unfollow")
         return jsonify({'message': msg}), code
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/get_timeline', methods=['GET'])
-async def get_timeline():
+@query(schemas.TIMELINE)
+async def get_timeline(data):
     try:
         session_id = request.cookies.get('session_id')
-        return await posts.get_timeline(session_id)
+        return await posts.get_timeline(session_id, data.start, data.end)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/create_room', methods=['POST'])
-async def create_room():
+@body(schemas.CREATE_ROOM)
+async def create_room(data):
     try:
-        data = json.loads(request.data)
         session_id = request.cookies.get('session_id')
-        name = data.get('name')
-        open_time = data.get('open_time')
-        close_time = data.get('close_time')
-        available_days = data.get('available_days')
-        unavailable_periods = data.get('unavailable_periods')
-    except json.JSONDecodeError:
-        return jsonify({'error': 'Invalid JSON payload'}), 400
-    try:
-        msg, code = await room_reservation.create_room(session_id, data, name, open_time, close_time, available_days, unavailable_periods)
+        msg, code = await room_reservation.create_room(session_id, data.name, data.open_time, data.close_time, data.available_days, data.unavailable_periods)
         return jsonify({'message': msg}), code
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/modify_room', methods=['POST'])
-async def modify_room():
+@body(schemas.MODIFY_ROOM)
+async def modify_room(data):
     try:
-        data = json.loads(request.data)
         session_id = request.cookies.get('session_id')
-        room_id = data.get('room_id')
-        action = data.get('action')
-        name = data.get('name')
-        open_time = data.get('open_time')
-        close_time = data.get('close_time')
-        available_days = data.get('available_days')
-        unavailable_periods = data.get('unavailable_periods')
-    except json.JSONDecodeError:
-        return jsonify({'error': 'Invalid JSON payload'}), 400
-    try:
-        msg, code = await room_reservation.modify_room(session_id, room_id, name, action, open_time, close_time, available_days, unavailable_periods)
+        msg, code = await room_reservation.modify_room(session_id, data.room_id, data.action, data.name, data.open_time, data.close_time, data.available_days, data.unavailable_periods)
         return jsonify({'message': msg}), code
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 @app.route('/get_rooms', methods=['GET'])
-async def get_rooms():
+@query(schemas.GET_ROOMS)
+async def get_rooms(data):
     try:
         session_id = request.cookies.get('session_id')
-        data = json.loads(request.data)
-        admin = data.get('admin')
-        return await room_reservation.get_rooms(session_id, admin)
+        return responses.result(*await room_reservation.get_rooms(session_id, data.admin))
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/get_available_rooms_by_time', methods=['GET'])
-async def get_available_rooms_by_time():
+@query(schemas.ROOMS_BY_TIME)
+async def get_available_rooms_by_time(data):
     try:
-        data = json.loads(request.data)
         session_id = request.cookies.get('session_id')
-        start_time = data.get('start_time')
-        end_time = data.get('end_time')
-        return await room_reservation.get_available_rooms_by_time(session_id, start_time, end_time)
+        return responses.result(*await room_reservation.get_available_rooms_by_time(session_id, data.start_time, data.end_time))
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/get_available_times_by_room', methods=['GET'])
-async def get_available_times_by_room():
+@query(schemas.TIMES_BY_ROOM)
+async def get_available_times_by_room(data):
     try:
-        data = json.loads(request.data)
         session_id = request.cookies.get('session_id')
-        room_id = data.get('room_id')
-        start_time = data.get('start_time')
-        end_time = data.get('end_time')
-        return await room_reservation.get_available_times_by_room(session_id, room_id, start_time, end_time)
+        return responses.result(*await room_reservation.get_available_times_by_room(session_id, data.room_id, data.start_time, data.end_time))
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/get_reservations', methods=['GET'])
-async def get_reservations():
+@query(schemas.GET_RESERVATIONS)
+async def get_reservations(data):
     try:
-        data = json.loads(request.data)
         session_id = request.cookies.get('session_id')
-        start_time = data.get('start_time')
-        end_time = data.get('end_time')
-        room_id = data.get('room_id')
-        user =  data.get('user')
-        admin = data.get('admin')
-        return await room_reservation.get_reservations(session_id, room_id, start_time, end_time, user, admin)
+        return responses.result(*await room_reservation.get_reservations(session_id, data.start_time, data.end_time, room_id=data.room_id, user=data.user, admin=data.admin))
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/reserve_room', methods=['POST'])
-async def reserve_room():
+@body(schemas.RESERVE_ROOM)
+async def reserve_room(data):
     try:
-        data = json.loads(request.data)
         session_id = request.cookies.get('session_id')
-        room_id = data.get('room_id')
-        for_group = data.get('for_group')
-        reason = data.get('reason')
-        start_time = data.get('start_time')
-        end_time = data.get('end_time')
-    except json.JSONDecodeError:
-        return jsonify({'error': 'Invalid JSON payload'}), 400
-    try:
-        msg, code = await room_reservation.reserve_room(session_id, room_id, for_group, reason, start_time, end_time)
-        return jsonify({'message': msg}), code
+        result, code = await room_reservation.reserve_room(session_id, data.room_id, data.for_group, data.reason, data.start_time, data.end_time)
+        return responses.result(result, code)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/cancel_reservation', methods=['POST'])
-async def cancel_reservation():
+@app.route('/reserve_rooms', methods=['POST'])
+@body(schemas.RESERVE_ROOMS)
+async def reserve_rooms(data):
+    try:
+        session_id = request.cookies.get('session_id')
+        result, code = await room_reservation.reserve_rooms(session_id, data.for_group, data.reason, data.items)
+        return responses.result(result, code)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/reserve_room_recurring', methods=['POST'])
+@body(schemas.RESERVE_ROOM_RECURRING)
+async def reserve_room_recurring(data):
     try:
-        data = json.loads(request.data)
         session_id = request.cookies.get('session_id')
-        reservation_id = data.get('reservation_id')
-    except json.JSONDecodeError:
-        return jsonify({'error': 'Invalid JSON payload'}), 400
+        result, code = await room_reservation.reserve_room_recurring(session_id, data.room_id, data.for_group, data.reason, data.start_time, data.end_time, data.frequency, data.weekdays, data.until, data.count)
+        return responses.result(result, code)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/cancel_reservation', methods=['POST'])
+@body(schemas.RESERVATION)
+async def cancel_reservation(data):
     try:
-        msg, code = await room_reservation.cancel_reservation(session_id, reservation_id)
+        session_id = request.cookies.get('session_id')
+        msg, code = await room_reservation.cancel_reservation(session_id, data.reservation_id)
         return jsonify({'message': msg}), code
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/approve_reservation', methods=['POST'])
-async def approve_reservation():
+@body(schemas.APPROVE_RESERVATION)
+async def approve_reservation(data):
     try:
-        data = json.loads(request.data)
         session_id = request.cookies.get('session_id')
-        reservation_id = data.get('reservation_id')
-        action = data.get
-        reason = data.get('reason')
-    except json.JSONDecodeError:
-        return jsonify({'error': 'Invalid JSON payload'}), 400
-    try:
-        msg, code = await room_reservation.approve_reservation(session_id, reservation_id, action, reason)
+        msg, code = await room_reservation.approve_reservation(session_id, data.reservation_id, data.action, data.reason)
         return jsonify({'message': msg}), code
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -495,6 +432,8 @@ async def approve_reservation():
 
 
 if __name__ == "__main__":
-    loop = asyncio.get_event_loop()
-    app.run()
-    loop.run_until_complete(db(loop))
\ No newline at end of file
+    serving.run(serving.startup())
+    try:
+        app.run(threaded=True)
+    finally:
+        serving.run(serving.shutdown())
\ No newline at end of file
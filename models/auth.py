@@ -1,7 +1,7 @@
 import configparser
 from itsdangerous import URLSafeTimedSerializer
-from werkzeug.security import generate_password_hash
 import main
+import passwords
 
 config = configparser.ConfigParser()
 config.read('config.conf')
@@ -40,13 +40,13 @@ async def confirm_email(token):
         return 'The confirmation link is invalid or has expired.', 400
 
     try:
-        info = await main.db("SELECT * FROM unverified_users WHERE email = %s", (email,))
+        info = await main.db("SELECT * FROM unverified_users WHERE email = ?", (email,))
         if not info:
             return 'User not found', 404
 
-        await main.db("INSERT INTO users (username, password, email) VALUES (%s, %s, %s)", (info[0][0], info[0][1], info[0][2]))
-        await main.db("DELETE FROM unverified_users WHERE email = %s", (email,))
-    except Exception as e:
+        await main.db("INSERT INTO users (username, password, email) VALUES (?, ?, ?)", (info[0][0], info[0][1], info[0][2]))
+        await main.db("DELETE FROM unverified_users WHERE email = ?", (email,))
+    except Exception:
         return 'Internal Server Error', 500
 
     return 'You have confirmed your account. You can now login.', 200
@@ -73,9 +73,11 @@ async def reset_password(token, password):
         email = await confirm_token(token)
         if not email:
             return 'The reset link is invalid or has expired.', 400
-        password_hash = generate_password_hash(password)
-        await main.db("UPDATE users SET password = %s WHERE email = %s", (password_hash, email))
+        password_hash = await passwords.hash_password(password)
+        await main.db("UPDATE users SET password = ? WHERE email = ?", (password_hash, email))
         return 'Password reset successfully', 200
+    except passwords.Busy:
+        return "Too many password changes, please try again shortly", 503
     except Exception as e:
         print(f"An error occurred during password reset: {e}")
         return "Internal Server Error", 500
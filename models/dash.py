@@ -0,0 +1,25 @@
+import main
+
+async def get_stats(session_id):
+    try:
+        username = await main.users.get_username_from_session(session_id, fresh=True)
+        if not username:
+            return "Unauthorized", 401
+        is_admin = await main.users.check_if_user_is_admin(username, 'global')
+        if not is_admin:
+            return "Unauthorized", 401
+        return {
+            'db_pool': main.pool.stats(),
+            'db_writer': main.writer.stats(),
+            'authz_cache': main.groups.authz_cache.stats(),
+            'sessions': main.sessions.stats(),
+            'votes': main.votes.stats(),
+            'room_availability': main.room_reservation.grid.stats(),
+            'free_slot_cache': main.room_reservation.free_slot_stats(),
+            'passwords': main.passwords.stats(),
+            'rate_limits': main.ratelimit.stats(),
+            'email_outbox': await main.outbox.stats()
+        }, 200
+    except Exception as e:
+        print(f"An error occurred while fetching stats: {e}")
+        return "Internal Server Error", 500
@@ -1,28 +1,78 @@
-from idlelib.mainmenu import menudefs
-
+import configparser
 import main
-
-# group_admin, can_post_announcement is a list of usernames
+from cache import TTLCache
+
+config = configparser.ConfigParser()
+config.read('config.conf')
+
+# membership, admin role and can_post_* flags live in group_members, one row per (group, user)
+
+POST_TYPES = ['announcement', 'assessment', 'pull', 'room_reservation']
+
+# action -> (statement taking (group_id, username), invalid subject message, success message)
+MEMBER_ACTIONS = {
+    'add_admin': ("INSERT INTO group_members (group_id, username, role) VALUES (?, ?, 'admin') ON CONFLICT(group_id, username) DO UPDATE SET role = 'admin'", "Invalid admin", "Admin added successfully"),
+    'remove_admin': ("UPDATE group_members SET role = 'member' WHERE group_id = ? AND username = ? AND role = 'admin'", "Invalid admin", "Admin removed successfully"),
+    'add_member': ("INSERT OR IGNORE INTO group_members (group_id, username) VALUES (?, ?)", "Invalid member", "Member added successfully"),
+    'remove_member': ("DELETE FROM group_members WHERE group_id = ? AND username = ?", "Invalid member", "Member removed successfully"),
+}
+for post_type in POST_TYPES:
+    MEMBER_ACTIONS[f'add_can_post_{post_type}'] = (f"INSERT INTO group_members (group_id, username, can_post_{post_type}) VALUES (?, ?, 1) ON CONFLICT(group_id, username) DO UPDATE SET can_post_{post_type} = 1", "Invalid user", "Member added successfully")
+    MEMBER_ACTIONS[f'remove_can_post_{post_type}'] = (f"UPDATE group_members SET can_post_{post_type} = 0 WHERE group_id = ? AND username = ?", "Invalid user", "Member removed successfully")
+
+# per-user view of group_members: {group_id: (group name, role, {post_type: allowed})}
+# invalidated by every write below; the ttl bounds staleness from writes in other workers
+authz_cache = TTLCache(
+    maxsize=config.getint('cache', 'authz_size', fallback=10000),
+    ttl=config.getfloat('cache', 'authz_ttl', fallback=30),
+)
+
+async def get_user_authz(username):
+    authz = authz_cache.get(username)
+    if authz is not None:
+        return authz
+    generation = authz_cache.generation(username)
+    rows = await main.db(f'''
+        SELECT m.group_id, g.name, m.role, {', '.join(f'm.can_post_{post_type}' for post_type in POST_TYPES)}
+        FROM group_members m JOIN user_groups g ON g.id = m.group_id
+        WHERE m.username = ?
+    ''', (username,))
+    if rows is None:
+        raise Exception("Failed to load group memberships")
+    authz = {row[0]: (row[1], row[2], dict(zip(POST_TYPES, map(bool, row[3:])))) for row in rows}
+    authz_cache.set(username, authz, generation)
+    return authz
+
+async def get_user_group_ids(session_id):
+    username = await main.users.get_username_from_session(session_id)
+    if not username:
+        return []
+    return list(await get_user_authz(username))
+
+async def get_group_members(group_id):
+    rows = await main.db("SELECT username FROM group_members WHERE group_id = ?", (group_id,))
+    return [row[0] for row in rows or []]
 
 async def get_user_groups(session_id, username = None):
-    # only admin can specify username
+    # only admin can ask for another user's groups
     try:
         current_user = await main.users.get_username_from_session(session_id)
+        if not current_user:
+            return "Unauthorized", 401
         if not username:
             username = current_user
-        # Check if the user is in the member list of the group with id = 1
-        else:
-            is_admin = await main.users.check_if_user_is_admin(username, 'global')
+        elif username != current_user:
+            is_admin = await main.users.check_if_user_is_admin(current_user, 'global')
             if not is_admin:
                 return "Unauthorized", 401
         # return group id and group name in json format
-        groups = await main.db("SELECT id, name FROM user_groups WHERE member LIKE ?", ('%' + username + '%',))
+        groups = await get_user_authz(username)
         # Convert the result to JSON format
         res = []
-        for group in groups:
+        for group_id, (name, role, permissions) in groups.items():
             res.append({
-                'id': group[0],
-                'name': group[1]
+                'id': group_id,
+                'name': name
             })
         return res,200
     except Exception as e:
@@ -33,10 +83,8 @@ async def create_group(session_id, group_name, admin, not_public = 0, can_post_a
     try:
         if not group_name:
             return "Group name is required", 400
-        else:
-            group_name = group_name.encode('utf-8')
-            if len(group_name) > 50:
-                return "Group name is too long", 400
+        elif len(group_name.encode('utf-8')) > 50:
+            return "Group name is too long", 400
         if not admin:
             return "Admin is required", 400
         if not not_public:
@@ -51,22 +99,32 @@ async def create_group(session_id, group_name, admin, not_public = 0, can_post_a
             can_post_room_reservation = []
         if not members:
             members = []
-        for permission in [can_post_announcement, can_post_assessment, can_post_pull, can_post_room_reservation, members]:
+        permissions = [can_post_announcement, can_post_assessment, can_post_pull, can_post_room_reservation]
+        for permission in permissions + [members]:
             if not isinstance(permission, list):
                 return "Invalid permission list", 400
-        current_user = await main.users.get_username_from_session(session_id)
+        current_user = await main.users.get_username_from_session(session_id, fresh=True)
         is_admin = await main.users.check_if_user_is_admin(current_user, 'global')
         if not is_admin:
             return "Unauthorized", 401
-        # Check if admin is in the member list
-        if admin not in members:
-            members.append(admin)
-
-        # Insert the new group into the database
-        await main.db('''
-            INSERT INTO user_groups (name, admin, not_public, can_post_announcement, can_post_assessment, can_post_pull, can_post_room_reservation, member)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (group_name, admin, not_public, ','.join(can_post_announcement), ','.join(can_post_assessment), ','.join(can_post_pull), ','.join(can_post_room_reservation), ','.join(members)))
+        admins = [admin]
+        # admins and users with post permissions are always members
+        usernames = list(dict.fromkeys(members + admins + [user for users in permissions for user in users]))
+        rows = [
+            (username, 'admin' if username in admins else 'member', *[int(username in users) for users in permissions])
+            for username in usernames
+        ]
+
+        # Insert the new group and its members in one transaction
+        def insert_group(conn):
+            group_id = conn.execute("INSERT INTO user_groups (name, not_public) VALUES (?, ?)", (group_name, not_public)).lastrowid
+            conn.executemany('''
+                INSERT INTO group_members (group_id, username, role, can_post_announcement, can_post_assessment, can_post_pull, can_post_room_reservation)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', [(group_id, *row) for row in rows])
+            return group_id
+        await main.db_transaction(insert_group)
+        authz_cache.invalidate_many(usernames)
 
         return "Group created successfully", 201
     except Exception as e:
@@ -79,152 +137,45 @@ async def modify_group(session_id, group_id, action, subject):
             return "Group id is required", 400
         if not action:
             return "Action is required", 400
-        current_user = await main.users.get_username_from_session(session_id)
+        current_user = await main.users.get_username_from_session(session_id, fresh=True)
         # Check if the user is in the member list of the group with id = 1 or is admin in the current group
         is_admin = await main.users.check_if_user_is_admin(current_user, 'global')
         if not is_admin:
-            is_admin = await main.db("SELECT 1 FROM user_groups WHERE id = ? AND admin LIKE ?", (group_id, '%' + current_user + '%',))
-            if not is_admin:
+            group = (await get_user_authz(current_user)).get(int(group_id))
+            if not group or group[1] != 'admin':
                 return "Unauthorized", 401
+        group = await main.db("SELECT 1 FROM user_groups WHERE id = ?", (group_id,))
+        if not group:
+            return "Group not found", 404
         if action == 'delete':
-            # Delete the group from the database
-            await main.db("DELETE FROM user_groups WHERE id = ?", (group_id,))
+            # Delete the group and its memberships from the database
+            def delete_group(conn):
+                members = [row[0] for row in conn.execute("SELECT username FROM group_members WHERE group_id = ?", (group_id,))]
+                conn.execute("DELETE FROM group_members WHERE group_id = ?", (group_id,))
+                conn.execute("DELETE FROM user_groups WHERE id = ?", (group_id,))
+                return members
+            authz_cache.invalidate_many(await main.db_transaction(delete_group))
             return "Group deleted successfully", 200
         elif action == 'visibility':
             # Reverse the visibility of the group
-            current_visibility = await main.db("SELECT not_public FROM user_groups WHERE id = ?", (group_id,))
-            current_visibility = current_visibility[0][0]
-            await main.db("UPDATE user_groups SET not_public = ? WHERE id = ?", (1 - current_visibility, group_id))
+            await main.db("UPDATE user_groups SET not_public = 1 - not_public WHERE id = ?", (group_id,))
             return "Visibility changed successfully", 200
         elif action == 'change_name':
             if not subject or not isinstance(subject, str):
                 return "Invalid group name", 400
-            # encode the group name
-            subject = subject.encode('utf-8')
-            if len(subject) > 50:
+            if len(subject.encode('utf-8')) > 50:
                 return "Group name is too long", 400
             await main.db("UPDATE user_groups SET name = ? WHERE id = ?", (subject, group_id))
+            # the cached entries carry the group name
+            authz_cache.invalidate_many(await get_group_members(group_id))
             return "Group name changed successfully", 200
-        elif action == 'add_admin':
-            if not subject or not isinstance(subject, list):
-                return "Invalid admin", 400
-            current_admin = await main.db("SELECT admin FROM user_groups WHERE id = ?", (group_id,))
-            current_admin = current_admin[0][0].split(',')
-            for admin in subject:
-                if admin not in current_admin:
-                    current_admin.append(admin)
-            await main.db("UPDATE user_groups SET admin = ? WHERE id = ?", (','.join(current_admin), group_id))
-            return "Admin added successfully", 200
-        elif action == 'remove_admin':
-            if not subject or not isinstance(subject, list):
-                return "Invalid admin", 400
-            current_admin = await main.db("SELECT admin FROM user_groups WHERE id = ?", (group_id,))
-            current_admin = current_admin[0][0].split(',')
-            for admin in subject:
-                if admin in current_admin:
-                    current_admin.remove(admin)
-            await main.db("UPDATE user_groups SET admin = ? WHERE id = ?", (','.join(current_admin), group_id))
-            return "Admin removed successfully", 200
-        elif action == 'add_member':
-            if not subject or not isinstance(subject, list):
-                return "Invalid member", 400
-            current_members = await main.db("SELECT member FROM user_groups WHERE id = ?", (group_id,))
-            current_members = current_members[0][0].split(',')
-            for member in subject:
-                if member not in current_members:
-                    current_members.append(member)
-            await main.db("UPDATE user_groups SET member = ? WHERE id = ?", (','.join(current_members), group_id))
-            return "Member added successfully", 200
-        elif action == 'remove_member':
-            if not subject or not isinstance(subject, list):
-                return "Invalid member", 400
-            current_members = await main.db("SELECT member FROM user_groups WHERE id = ?", (group_id,))
-            current_members = current_members[0][0].split(',')
-            for member in subject:
-                if member in current_members:
-                    current_members.remove(member)
-            await main.db("UPDATE user_groups SET member = ? WHERE id = ?", (','.join(current_members), group_id))
-            return "Member removed successfully", 200
-        elif action == 'add_can_post_announcement':
-            if not subject or not isinstance(subject, list):
-                return "Invalid user", 400
-            current_members = await main.db("SELECT can_post_announcement FROM user_groups WHERE id = ?", (group_id,))
-            current_members = current_members[0][0].split(',')
-            for member in subject:
-                if member not in current_members:
-                    current_members.append(member)
-            await main.db("UPDATE user_groups SET can_post_announcement = ? WHERE id = ?", (','.join(current_members), group_id))
-            return "Member added successfully", 200
-        elif action == 'remove_can_post_announcement':
+        elif action in MEMBER_ACTIONS:
+            statement, invalid_message, success_message = MEMBER_ACTIONS[action]
             if not subject or not isinstance(subject, list):
-                return "Invalid user", 400
-            current_members = await main.db("SELECT can_post_announcement FROM user_groups WHERE id = ?", (group_id,))
-            current_members = current_members[0][0].split(',')
-            for member in subject:
-                if member in current_members:
-                    current_members.remove(member)
-            await main.db("UPDATE user_groups SET can_post_announcement = ? WHERE id = ?", (','.join(current_members), group_id))
-            return "Member removed successfully", 200
-        elif action == 'add_can_post_assessment':
-            if not subject or not isinstance(subject, list):
-                return "Invalid user", 400
-            current_members = await main.db("SELECT can_post_assessment FROM user_groups WHERE id = ?", (group_id,))
-            current_members = current_members[0][0].split(',')
-            for member in subject:
-                if member not in current_members:
-                    current_members.append(member)
-            await main.db("UPDATE user_groups SET can_post_assessment = ? WHERE id = ?", (','.join(current_members), group_id))
-            return "Member added successfully", 200
-        elif action == 'remove_can_post_assessment':
-            if not subject or not isinstance(subject, list):
-                return "Invalid user", 400
-            current_members = await main.db("SELECT can_post_assessment FROM user_groups WHERE id = ?", (group_id,))
-            current_members = current_members[0][0].split(',')
-            for member in subject:
-                if member in current_members:
-                    current_members.remove(member)
-            await main.db("UPDATE user_groups SET can_post_assessment = ? WHERE id = ?", (','.join(current_members), group_id))
-            return "Member removed successfully", 200
-        elif action == 'add_can_post_pull':
-            if not subject or not isinstance(subject, list):
-                return "Invalid user", 400
-            current_members = await main.db("SELECT can_post_pull FROM user_groups WHERE id = ?", (group_id,))
-            current_members = current_members[0][0].split(',')
-            for member in subject:
-                if member not in current_members:
-                    current_members.append(member)
-            await main.db("UPDATE user_groups SET can_post_pull = ? WHERE id = ?", (','.join(current_members), group_id))
-            return "Member added successfully", 200
-        elif action == 'remove_can_post_pull':
-            if not subject or not isinstance(subject, list):
-                return "Invalid user", 400
-            current_members = await main.db("SELECT can_post_pull FROM user_groups WHERE id = ?", (group_id,))
-            current_members = current_members[0][0].split(',')
-            for member in subject:
-                if member in current_members:
-                    current_members.remove(member)
-            await main.db("UPDATE user_groups SET can_post_pull = ? WHERE id = ?", (','.join(current_members), group_id))
-            return "Member removed successfully", 200
-        elif action == 'add_can_post_room_reservation':
-            if not subject or not isinstance(subject, list):
-                return "Invalid user", 400
-            current_members = await main.db("SELECT can_post_room_reservation FROM user_groups WHERE id = ?", (group_id,))
-            current_members = current_members[0][0].split(',')
-            for member in subject:
-                if member not in current_members:
-                    current_members.append(member)
-            await main.db("UPDATE user_groups SET can_post_room_reservation = ? WHERE id = ?", (','.join(current_members), group_id))
-            return "Member added successfully", 200
-        elif action == 'remove_can_post_room_reservation':
-            if not subject or not isinstance(subject, list):
-                return "Invalid user", 400
-            current_members = await main.db("SELECT can_post_room_reservation FROM user_groups WHERE id = ?", (group_id,))
-            current_members = current_members[0][0].split(',')
-            for member in subject:
-                if member in current_members:
-                    current_members.remove(member)
-            await main.db("UPDATE user_groups SET can_post_room_reservation = ? WHERE id = ?", (','.join(current_members), group_id))
-            return "Member removed successfully", 200
+                return invalid_message, 400
+            await main.db_transaction(lambda conn: conn.executemany(statement, [(group_id, username) for username in subject]))
+            authz_cache.invalidate_many(subject)
+            return success_message, 200
         else:
             return "Invalid action", 400
     except Exception as e:
@@ -245,7 +196,7 @@ async def get_public_group_list(session_id):
 
 async def join_public_group(session_id, group_id):
     try:
-        current_user = await main.users.get_username_from_session(session_id)
+        current_user = await main.users.get_username_from_session(session_id, fresh=True)
 
         # Check if the group is public
         not_public = await main.db("SELECT not_public FROM user_groups WHERE id = ?", (group_id,))
@@ -254,14 +205,10 @@ async def join_public_group(session_id, group_id):
         elif not_public[0][0] != 0:
             return "Group is not public", 403
 
-        # Get the current member list
-        current_members = await main.db("SELECT member FROM user_groups WHERE id = ?", (group_id,))
-        current_members = current_members[0]['member'].split(',')
-
-        # Add the user to the member list if not already a member
-        if current_user not in current_members:
-            current_members.append(current_user)
-            await main.db("UPDATE user_groups SET member = ? WHERE id = ?", (','.join(current_members), group_id))
+        # Add the user to the group if not already a member
+        res = await main.db("INSERT OR IGNORE INTO group_members (group_id, username) VALUES (?, ?)", (group_id, current_user))
+        authz_cache.invalidate(current_user)
+        if res.rowcount > 0:
             return "Joined group successfully", 200
         else:
             return "User is already a member of the group", 400
@@ -271,38 +218,17 @@ async def join_public_group(session_id, group_id):
 
 async def leave_group(session_id, group_id):
     try:
-        current_user = await main.users.get_username_from_session(session_id)
+        current_user = await main.users.get_username_from_session(session_id, fresh=True)
 
-        # Get the current lists from the database
-        group_data = await main.db("SELECT admin, can_post_announcement, can_post_assessment, can_post_pull, member FROM user_groups WHERE id = ?", (group_id,))
-        if not group_data:
+        group = await main.db("SELECT 1 FROM user_groups WHERE id = ?", (group_id,))
+        if not group:
             return "Group not found", 404
 
-        group_data = group_data[0]
-        # return 403 if user is not in the group
-        if current_user not in group_data[4].split(','):
-            return "User is not a member of the group", 403
-
-        # Remove the user from each list
-        query = 'UPDATE user_groups SET'
-        params = []
-        columns = ["admin", "can_post_announcement", "can_post_assessment", "can_post_pull", "member"]
-        for i in range(5):
-            try:
-                lst = group_data[i].split(',')
-                if current_user in lst:
-                    lst.remove(current_user)
-                    query += f' {columns[i]} = ?,'
-                    params.append(','.join(lst))
-            except:
-                pass
-
-        query = query.rstrip(',') + ' WHERE id = ?'
-        params.append(group_id)
-
-        if len(params) == 1:
+        # Removing the membership row also drops the user's admin role and post permissions
+        res = await main.db("DELETE FROM group_members WHERE group_id = ? AND username = ?", (group_id, current_user))
+        authz_cache.invalidate(current_user)
+        if res.rowcount == 0:
             return "User is not a member of the group", 403
-        await main.db(query, tuple(params))
         return "Exited group successfully", 200
     except Exception as e:
         print(f"An error occurred while exiting the group: {e}")
@@ -311,15 +237,10 @@ async def leave_group(session_id, group_id):
 async def get_post_permissions(session_id, group_id, post_type):
     try:
         username = await main.users.get_username_from_session(session_id)
-        post_type = f'can_post_{post_type}'
-        permission_list = await main.db("SELECT ? FROM user_groups WHERE id = ?", (post_type, group_id))
-        permission_list = permission_list[0][0].split(',')
-        if username in permission_list:
-            return True
-        else:
+        if not username or post_type not in POST_TYPES:
             return False
-
-
+        group = (await get_user_authz(username)).get(int(group_id))
+        return bool(group and group[2][post_type])
     except Exception as e:
         print(f"An error occurred while fetching the post permissions: {e}")
-        return "Internal Server Error", 500
\ No newline at end of file
+        return False
@@ -0,0 +1,162 @@
+import asyncio
+import configparser
+import threading
+import time
+import aiosmtplib
+import main
+
+config = configparser.ConfigParser()
+config.read('config.conf')
+
+BATCH_SIZE = config.getint('email', 'outbox_batch_size', fallback=20)
+POLL_INTERVAL = config.getfloat('email', 'outbox_poll_interval', fallback=5)
+MAX_ATTEMPTS = config.getint('email', 'outbox_max_attempts', fallback=6)
+BACKOFF_BASE = config.getfloat('email', 'outbox_backoff_base', fallback=30)
+BACKOFF_MAX = config.getfloat('email', 'outbox_backoff_max', fallback=3600)
+CLAIM_TIMEOUT = config.getint('email', 'outbox_claim_timeout', fallback=300)
+
+# status: 0=pending, 1=sent, 2=failed, 3=claimed by a delivery worker
+PENDING, SENT, FAILED, SENDING = 0, 1, 2, 3
+
+_worker = None
+_worker_lock = threading.Lock()
+_wake = threading.Event()
+_stop = threading.Event()
+_stats_lock = threading.Lock()
+_stats = {
+    'enqueued': 0,
+    'sent': 0,
+    'retried': 0,
+    'failed': 0,
+    'batches': 0,
+    'smtp_connects': 0,
+    'send_time_total': 0.0,
+}
+
+def _count(key, value=1):
+    with _stats_lock:
+        _stats[key] += value
+
+async def enqueue(email, subject, message):
+    start()
+    res = await main.db(
+        "INSERT INTO email_outbox (recipient, subject, body, next_attempt_at) VALUES (?, ?, ?, ?)",
+        (email, subject, message, int(time.time())))
+    _count('enqueued')
+    _wake.set()
+    return res.lastrowid
+
+def _claim(conn):
+    # claimed rows are invisible to the other workers; claims of a crashed worker expire
+    now = int(time.time())
+    rows = conn.execute("""
+        SELECT id, recipient, subject, body, attempts FROM email_outbox
+        WHERE (status = ? AND next_attempt_at <= ?) OR (status = ? AND next_attempt_at <= ?)
+        ORDER BY next_attempt_at LIMIT ?
+    """, (PENDING, now, SENDING, now - CLAIM_TIMEOUT, BATCH_SIZE)).fetchall()
+    conn.executemany("UPDATE email_outbox SET status = ?, next_attempt_at = ? WHERE id = ?", [(SENDING, now, row[0]) for row in rows])
+    return rows
+
+def _backoff(attempts):
+    return min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempts - 1))
+
+class _Connection:
+    def __init__(self):
+        self.smtp = None
+
+    async def open(self):
+        self.smtp = aiosmtplib.SMTP(hostname=main.SMTP_SERVER, port=int(main.SMTP_PORT), start_tls=main.SMTP_USE_TLS)
+        await self.smtp.connect()
+        await self.smtp.login(main.EMAIL_USERNAME, main.SMTP_PASSWORD)
+        _count('smtp_connects')
+
+    async def close(self):
+        if self.smtp is not None:
+            try:
+                await self.smtp.quit()
+            except Exception:
+                self.smtp.close()
+            self.smtp = None
+
+    async def send(self, recipient, subject, body):
+        message = f"Subject: {subject}\n\n{body}"
+        if self.smtp is None or not self.smtp.is_connected:
+            await self.open()
+        try:
+            await self.smtp.sendmail(main.EMAIL_USERNAME, recipient, message)
+        except aiosmtplib.SMTPServerDisconnected:
+            # the kept-alive connection was dropped by the server, reconnect once
+            await self.open()
+            await self.smtp.sendmail(main.EMAIL_USERNAME, recipient, message)
+
+async def _deliver(connection, rows):
+    sent, retries, failed = [], [], []
+    for outbox_id, recipient, subject, body, attempts in rows:
+        started = time.monotonic()
+        try:
+            await connection.send(recipient, subject, body)
+            sent.append((SENT, int(time.time()), outbox_id))
+            _count('send_time_total', time.monotonic() - started)
+        except Exception as e:
+            attempts += 1
+            if attempts >= MAX_ATTEMPTS:
+                failed.append((FAILED, attempts, str(e), outbox_id))
+            else:
+                retries.append((PENDING, attempts, int(time.time() + _backoff(attempts)), str(e), outbox_id))
+            if isinstance(e, aiosmtplib.SMTPException):
+                await connection.close()
+
+    def record(conn):
+        conn.executemany("UPDATE email_outbox SET status = ?, sent_at = ? WHERE id = ?", sent)
+        conn.executemany("UPDATE email_outbox SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ? WHERE id = ?", retries)
+        conn.executemany("UPDATE email_outbox SET status = ?, attempts = ?, last_error = ? WHERE id = ?", failed)
+    await main.db_transaction(record)
+    _count('sent', len(sent))
+    _count('retried', len(retries))
+    _count('failed', len(failed))
+    _count('batches')
+
+async def _run():
+    connection = _Connection()
+    try:
+        while not _stop.is_set():
+            # cleared before claiming, so a message enqueued during the claim still wakes us
+            _wake.clear()
+            try:
+                rows = await main.db_transaction(_claim)
+                if rows:
+                    await _deliver(connection, rows)
+                    continue
+            except Exception as e:
+                print(f"An error occurred while delivering email: {e}")
+            if not _stop.is_set():
+                await asyncio.to_thread(_wake.wait, POLL_INTERVAL)
+    finally:
+        await connection.close()
+
+def start():
+    global _worker
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _stop.clear()
+            _worker = threading.Thread(target=asyncio.run, args=(_run(),), name='email-outbox', daemon=True)
+            _worker.start()
+
+def stop(timeout=None):
+    _stop.set()
+    _wake.set()
+    if _worker is not None:
+        _worker.join(timeout)
+
+async def stats():
+    counts = await main.db("SELECT status, COUNT(*) FROM email_outbox GROUP BY status")
+    counts = dict(counts or [])
+    with _stats_lock:
+        sent = _stats['sent']
+        return {
+            'pending': counts.get(PENDING, 0),
+            'sending': counts.get(SENDING, 0),
+            'failed_total': counts.get(FAILED, 0),
+            **{key: value for key, value in _stats.items() if key != 'send_time_total'},
+            'avg_send_ms': round(_stats['send_time_total'] * 1000 / sent, 3) if sent else 0.0,
+        }
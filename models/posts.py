@@ -1,6 +1,17 @@
+import base64
+import configparser
+import json
 import main
+from responses import Rows
+
+config = configparser.ConfigParser()
+config.read('config.conf')
+
+PAGE_SIZE = config.getint('posts', 'page_size', fallback=30)
+MAX_PAGE_SIZE = config.getint('posts', 'max_page_size', fallback=100)
 
 # permission in database is a list of group ids that can view the post (e.g. 1, 2, 3)
+# post_permissions holds the same list as (post_id, group_id) rows and is what queries use
 # permission = None means everyone can view the post
 # every post must have a post_as group id
 # post_as group id must be in the permission list
@@ -14,99 +25,131 @@ import main
 async def create_post(session_id, title, content, post_type, permission, post_as, start_at = None, end_at = None, label = None):
     try:
         # Retrieve the user's group from the session
-        user = await main.users.get_username_from_session(session_id)
-        user_groups = await main.groups.get_user_groups(session_id)
-        # Converting user_groups to a list of group ids
-        group_ids = [group[0] for group in user_groups]
+        user = await main.users.get_username_from_session(session_id, fresh=True)
+        group_ids = await main.groups.get_user_group_ids(session_id)
 
         # Check if post_as group id is in the user's group list
         if post_as not in group_ids:
             return "Unauthorized", 401
-        if not main.groups.get_post_permissions(session_id, post_as, post_type):
+        if not await main.groups.get_post_permissions(session_id, post_as, post_type):
             return "Unauthorized", 401
         # If permission is not None, check if post_as group id is in the permission list
+        permission_list = None
         if permission is not None:
             permission_list = [int(group_id.strip()) for group_id in permission.split(',')]
             if post_as not in permission_list:
                 permission_list.append(post_as)
             # encode into list
             permission = ",".join([str(group_id) for group_id in permission_list])
-        # Insert the post into the database
-        await main.db("""
-            INSERT INTO posts (title, content, post_type, permission, post_as, label, author, start_at, end_at)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (title, content, post_type, permission, post_as, label, user, start_at, end_at))
-        if post_type == "pull":
-            post_id = await main.db("SELECT id FROM posts WHERE author = ? AND created_at = (SELECT MAX(created_at) FROM posts WHERE author = ?)", (user, user))
-            await main.db("INSERT INTO pulls (post_id) VALUES (?)", (post_id[0][0],))
+        # Insert the post, its visibility rows and its pull counters in one transaction
+        def insert_post(conn):
+            post_id = conn.execute("""
+                INSERT INTO posts (title, content, post_type, permission, post_as, label, author, start_at, end_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (title, content, post_type, permission, post_as, label, user, start_at, end_at)).lastrowid
+            if permission_list is not None:
+                conn.executemany("INSERT OR IGNORE INTO post_permissions (post_id, group_id) VALUES (?, ?)", [(post_id, group_id) for group_id in permission_list])
+            if post_type == "pull":
+                conn.execute("INSERT INTO pulls (post_id, agree, disagree) VALUES (?, 0, 0)", (post_id,))
+            return post_id
+        await main.db_transaction(insert_post)
         return "Post created successfully", 201
     except Exception as e:
         print(f"An error occurred while creating the post: {e}")
         return "Internal Server Error", 500
 
-async def get_posts(session_id, post_type, start_from=0, view_type='public', id=None, admin=False):
+def visible_condition(group_ids):
+    # indexed semi-join: one primary key probe into post_permissions per candidate post
+    return f"(permission IS NULL OR EXISTS (SELECT 1 FROM post_permissions pp WHERE pp.post_id = posts.id AND pp.group_id IN ({', '.join('?' * len(group_ids))})))"
+
+async def check_post_access(session_id, post_id):
+    # returns (found, allowed); members of the global admin group can view all posts
+    group_ids = await main.groups.get_user_group_ids(session_id)
+    if int(main.GLOBAL_ADMIN) in group_ids:
+        res = await main.db("SELECT 1 FROM posts WHERE id = ?", (post_id,))
+    else:
+        res = await main.db(f"SELECT {visible_condition(group_ids)} FROM posts WHERE id = ?", (*group_ids, post_id))
+    if not res:
+        return False, False
+    return True, bool(res[0][0])
+
+def encode_cursor(created_at, post_id):
+    return base64.urlsafe_b64encode(json.dumps([created_at, post_id]).encode()).decode()
+
+def decode_cursor(cursor):
+    created_at, post_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    if not isinstance(post_id, int):
+        raise ValueError("Invalid cursor")
+    return created_at, post_id
+
+async def get_posts(session_id, post_type, cursor=None, view_type='public', id=None, admin=False, page_size=None):
+    # keyset pagination: pages are ordered by (created_at, id), newest first, and the
+    # cursor is the position of the last row of the previous page
     try:
         if admin:
-            username = await main.users.get_username_from_session(session_id)
+            username = await main.users.get_username_from_session(session_id, fresh=True)
             is_admin = await main.users.check_if_user_is_admin(username, 'global')
             if not is_admin:
                 return "Unauthorized", 401
+        try:
+            page_size = min(int(page_size or PAGE_SIZE), MAX_PAGE_SIZE)
+            if page_size < 1:
+                raise ValueError("Invalid page size")
+        except (TypeError, ValueError):
+            return "Invalid page size", 400
+        conditions = ["post_type = ?"]
+        params = [post_type]
         if view_type == 'public':
-            res = await main.db("SELECT id, title, author, label, created_at, start_at, end_at, post_as FROM posts WHERE post_type = ? AND permission IS NULL LIMIT 30 OFFSET ?", (post_type, start_from))
+            conditions.append("permission IS NULL")
         elif view_type == 'my':
             user = await main.users.get_username_from_session(session_id)
-            res = await main.db("SELECT id, title, author, label, created_at, start_at, end_at, post_as FROM posts WHERE author = ? AND post_type = ? LIMIT 30 OFFSET ?", (user, post_type, start_from))
+            conditions.append("author = ?")
+            params.append(user)
         elif view_type == 'user' and id:
-            if admin:
-                res = await main.db("SELECT id, title, author, label, created_at, start_at, end_at, post_as FROM posts WHERE author = ? AND post_type = ? LIMIT 30 OFFSET ?", (id, post_type, start_from))
-            else:
-                user_groups = await main.groups.get_user_groups(session_id)
-                # Converting user_groups to a list of group ids
-                group_ids = [group[0] for group in user_groups]
-                res = await main.db("SELECT id, title, author, label, created_at, start_at, end_at, post_as FROM posts WHERE author = ? AND post_type = ? AND (permission IS NULL OR EXISTS (SELECT 1 FROM json_each(permission) WHERE value IN (?))) LIMIT 30 OFFSET ?", (id, post_type, ','.join(map(str, group_ids)), start_from))
+            conditions.append("author = ?")
+            params.append(id)
+            if not admin:
+                group_ids = await main.groups.get_user_group_ids(session_id)
+                conditions.append(visible_condition(group_ids))
+                params.extend(group_ids)
         elif view_type == 'group' and id:
-            if admin:
-                res = await main.db("SELECT id, title, author, label, created_at, start_at, end_at, post_as FROM posts WHERE post_as = ? AND post_type = ? LIMIT 30 OFFSET ?", (id, post_type, start_from))
-            else:
-                user_groups = await main.groups.get_user_groups(session_id)
-                group_ids = [group[0] for group in user_groups]
-                res = await main.db("SELECT id, title, author, label, created_at, start_at, end_at, post_as FROM posts WHERE post_as = ? AND post_type = ? AND (permission IS NULL OR EXISTS (SELECT 1 FROM json_each(permission) WHERE value IN (?))) LIMIT 30 OFFSET ?", (id, post_type, ','.join(map(str, group_ids)), start_from))
+            conditions.append("post_as = ?")
+            params.append(id)
+            if not admin:
+                group_ids = await main.groups.get_user_group_ids(session_id)
+                conditions.append(visible_condition(group_ids))
+                params.extend(group_ids)
         else:
             return "Invalid view type or missing id", 400
+        if cursor:
+            try:
+                params.extend(decode_cursor(cursor))
+            except (ValueError, TypeError):
+                return "Invalid cursor", 400
+            conditions.append("(created_at, id) < (?, ?)")
 
-        posts = [{
-            "id": row[0],
-            "title": row[1],
-            "author": row[2],
-            "label": row[3],
-            "created_at": row[4],
-            "start_at": row[5],
-            "end_at": row[6],
-            "post_as": row[7]
-        } for row in res]
+        # one extra row tells whether there is a next page
+        res = await main.db(f"SELECT id, title, author, label, created_at, start_at, end_at, post_as FROM posts WHERE {' AND '.join(conditions)} ORDER BY created_at DESC, id DESC LIMIT ?", (*params, page_size + 1))
 
-        return {"posts": posts}, 200
+        posts = Rows(("id", "title", "author", "label", "created_at", "start_at", "end_at", "post_as"), res[:page_size])
+        next_cursor = encode_cursor(res[page_size - 1][4], res[page_size - 1][0]) if len(res) > page_size else None
+
+        return {"posts": posts, "next_cursor": next_cursor}, 200
     except Exception as e:
         print(f"An error occurred while fetching posts: {e}")
         return "Internal Server Error", 500
 
 async def get_details(session_id, post_id):
     try:
-        # Query the database to get the post's permission
-        res = await main.db("SELECT permission FROM posts WHERE id = ?", (post_id,))
-        if not res:
+        # Check if the user's group is in the post's permission or if the user is an admin
+        found, allowed = await check_post_access(session_id, post_id)
+        if not found:
             return "Post not found", 404
-        if not res[0][0] is None:
-            user_groups = await main.groups.get_user_groups(session_id)
-            # Converting user_groups to a list of group ids
-            group_ids = [group[0] for group in user_groups]
-            post_permission = list(map(int, res[0][0].split(',')))
-            # Check if the user's group is in the post's permission or if the user is an admin
-            if not any(group in post_permission for group in group_ids) and not not main.GLOBAL_ADMIN in group_ids:
-                return "Unauthorized", 401
+        if not allowed:
+            return "Unauthorized", 401
 
         # Query the database to get all post details
-        res = await main.db("SELECT * FROM posts WHERE id = ?", (post_id,))
+        res = await main.db("SELECT id, title, author, label, created_at, start_at, end_at, post_as, content, permission FROM posts WHERE id = ?", (post_id,))
         if not res:
             return "Post not found", 404
 
@@ -133,25 +176,23 @@ async def get_details(session_id, post_id):
 
 async def get_pull_details(session_id, post_id):
     try:
-        # Query the database to get the pull's permission, agree, and disagree counts
-        res = await main.db("SELECT permission, agree, disagree FROM pulls WHERE post_id = ?", (post_id,))
+        # Check if the user's group is in the pull's permission or if the user is an admin
+        found, allowed = await check_post_access(session_id, post_id)
+        if not allowed:
+            return ("Unauthorized", 401) if found else ("Post not found", 404)
+        # Counters and this worker's flush mark come from one snapshot, see models/votes.py
+        res = await main.db("""
+            SELECT agree, disagree, (SELECT seq FROM vote_flush_marks WHERE worker = ?)
+            FROM pulls WHERE post_id = ?
+        """, (main.votes.WORKER_ID, post_id))
         if not res:
             return "Post not found", 404
-
-        # Check if the pull has specific permissions
-        if res[0][0] is not None:
-            user_groups = await main.groups.get_user_groups(session_id)
-            # Converting user_groups to a list of group ids
-            group_ids = [group[0] for group in user_groups]
-            post_permission = list(map(int, res[0][0].split(',')))
-
-            # Check if the user's group is in the pull's permission or if the user is an admin
-            if not any(group in post_permission for group in group_ids) and not main.GLOBAL_ADMIN in group_ids:
-                return "Unauthorized", 401
+        agree, disagree, flushed_seq = res[0]
+        unflushed_agree, unflushed_disagree = main.votes.unflushed(post_id, flushed_seq)
 
         pull_details = {
-            "agree": res[0][1],
-            "disagree": res[0][2]
+            "agree": agree + unflushed_agree,
+            "disagree": disagree + unflushed_disagree
         }
 
         return pull_details, 200
@@ -161,28 +202,29 @@ async def get_pull_details(session_id, post_id):
 
 async def vote(session_id, post_id, opinion):
     try:
-        # Query the database to get the pull's permission
-        res = await main.db("SELECT permission FROM pulls WHERE post_id = ?", (post_id,))
+        # Check if the user's group is in the pull's permission or if the user is an admin
+        found, allowed = await check_post_access(session_id, post_id)
+        if not allowed:
+            return ("Unauthorized", 401) if found else ("Post not found", 404)
+        if opinion not in main.votes.OPINIONS:
+            return "Invalid opinion", 400
+        username = await main.users.get_username_from_session(session_id, fresh=True)
+        if not username:
+            return "Unauthorized", 401
+        if main.votes.has_pending_vote(post_id, username):
+            return "Already voted", 400
+        res = await main.db("""
+            SELECT EXISTS (SELECT 1 FROM pull_votes WHERE post_id = ? AND username = ?)
+            FROM pulls WHERE post_id = ?
+        """, (post_id, username, post_id))
         if not res:
             return "Post not found", 404
+        if res[0][0]:
+            return "Already voted", 400
 
-        # Check if the pull has specific permissions
-        if res[0][0] is not None:
-            user_groups = await main.groups.get_user_groups(session_id)
-            # Converting user_groups to a list of group ids
-            group_ids = [group[0] for group in user_groups]
-            post_permission = list(map(int, res[0][0].split(',')))
-            # Check if the user's group is in the pull's permission or if the user is an admin
-            if not any(group in post_permission for group in group_ids) and not main.GLOBAL_ADMIN in group_ids:
-                return "Unauthorized", 401
-
-        # Update the vote count based on the opinion
-        if opinion == "agree":
-            await main.db("UPDATE pulls SET agree = agree + 1 WHERE post_id = ?", (post_id,))
-        elif opinion == "disagree":
-            await main.db("UPDATE pulls SET disagree = disagree + 1 WHERE post_id = ?", (post_id,))
-        else:
-            return "Invalid opinion", 400
+        # The vote is counted in memory and written to pulls by the next flush
+        if not main.votes.add(post_id, username, opinion):
+            return "Already voted", 400
 
         return "Vote submitted successfully", 200
 
@@ -192,33 +234,37 @@ async def vote(session_id, post_id, opinion):
 
 async def modify_post(session_id, post_id, action, title=None, content=None, label=None, permission=None):
     try:
-        # Query the database to get the post's permission
-        res = await main.db("SELECT permission FROM posts WHERE id = ?", (post_id,))
-        if not res:
+        # Check if the user's group is in the post's permission or if the user is an admin
+        found, allowed = await check_post_access(session_id, post_id)
+        if not found:
             return "Post not found", 404
-        if not res[0][0] is None:
-            user_groups = await main.groups.get_user_groups(session_id)
-            # Converting user_groups to a list of group ids
-            group_ids = [group[0] for group in user_groups]
-            post_permission = list(map(int, res[0][0].split(',')))
-            # Check if the user's group is in the post's permission or if the user is an admin
-            if not any(group in post_permission for group in group_ids) and not main.GLOBAL_ADMIN in group_ids:
-                return "Unauthorized", 401
+        if not allowed:
+            return "Unauthorized", 401
 
         # Perform the requested action
         if action == "edit":
-            if title:
-                await main.db("UPDATE posts SET title = ? WHERE id = ?", (title, post_id))
-            if content:
-                await main.db("UPDATE posts SET content = ? WHERE id = ?", (content, post_id))
-            if label:
-                await main.db("UPDATE posts SET label = ? WHERE id = ?", (label, post_id))
-            if permission:
-                permission_str = ",".join(map(str, sorted(permission)))
-                await main.db("UPDATE posts SET permission = ? WHERE id = ?", (permission_str, post_id))
+            def edit_post(conn):
+                if title:
+                    conn.execute("UPDATE posts SET title = ? WHERE id = ?", (title, post_id))
+                if content:
+                    conn.execute("UPDATE posts SET content = ? WHERE id = ?", (content, post_id))
+                if label:
+                    conn.execute("UPDATE posts SET label = ? WHERE id = ?", (label, post_id))
+                if permission:
+                    permission_str = ",".join(map(str, sorted(permission)))
+                    conn.execute("UPDATE posts SET permission = ? WHERE id = ?", (permission_str, post_id))
+                    conn.execute("DELETE FROM post_permissions WHERE post_id = ?", (post_id,))
+                    conn.executemany("INSERT OR IGNORE INTO post_permissions (post_id, group_id) VALUES (?, ?)", [(post_id, int(group_id)) for group_id in permission])
+            await main.db_transaction(edit_post)
             return "Post updated successfully", 200
         elif action == "delete":
-            await main.db("DELETE FROM posts WHERE id = ?", (post_id))
+            def delete_post(conn):
+                conn.execute("DELETE FROM post_permissions WHERE post_id = ?", (post_id,))
+                conn.execute("DELETE FROM post_followers WHERE post_id = ?", (post_id,))
+                conn.execute("DELETE FROM pull_votes WHERE post_id = ?", (post_id,))
+                conn.execute("DELETE FROM pulls WHERE post_id = ?", (post_id,))
+                conn.execute("DELETE FROM posts WHERE id = ?", (post_id,))
+            await main.db_transaction(delete_post)
             return "Post deleted successfully", 200
         else:
             return "Invalid action", 400
@@ -229,61 +275,57 @@ async def modify_post(session_id, post_id, action, title=None, content=None, lab
 
 async def follow_post(session_id, post_id, action):
     try:
-        # Query the database to get the post's permission
-        res = await main.db("SELECT permission FROM posts WHERE id = ?", (post_id,))
-        if not res:
+        # Check if the user's group is in the post's permission or if the user is an admin
+        found, allowed = await check_post_access(session_id, post_id)
+        if not found:
             return "Post not found", 404
-        if not res[0][0] is None:
-            user_groups = await main.groups.get_user_groups(session_id)
-            # Converting user_groups to a list of group ids
-            group_ids = [group[0] for group in user_groups]
-            post_permission = list(map(int, res[0][0].split(',')))
-            # Check if the user's group is in the post's permission or if the user is an admin
-            if not any(group in post_permission for group in group_ids) and not main.GLOBAL_ADMIN in group_ids:
-                return "Unauthorized", 401
-        # add post_id to user's following_posts(a list of post ids)
-        user = await main.users.get_username_from_session(session_id)
-        # check if post_id is already in following_posts
-        following_posts = await main.db("SELECT following_posts FROM users WHERE username = ?", (user,))
-        following_posts = following_posts[0][0]
-        if action =="follow":
-            if post_id in following_posts:
+        if not allowed:
+            return "Unauthorized", 401
+        user = await main.users.get_username_from_session(session_id, fresh=True)
+        if action == "follow":
+            res = await main.db("INSERT OR IGNORE INTO post_followers (username, post_id) VALUES (?, ?)", (user, post_id))
+            if not res.rowcount:
                 return "Post already followed", 200
-            following_posts.append(post_id)
-            following_posts = ",".join([str(post_id) for post_id in following_posts])
+            return "Post followed successfully", 200
         elif action == "unfollow":
-            if post_id not in following_posts:
+            res = await main.db("DELETE FROM post_followers WHERE username = ? AND post_id = ?", (user, post_id))
+            if not res.rowcount:
                 return "Post not followed", 200
-            following_posts.remove(post_id)
-            following_posts = ",".join([str(post_id) for post_id in following_posts])
+            return "Post unfollowed successfully", 200
         else:
             return "Invalid action", 400
-        await main.db("UPDATE users SET following_posts = ? WHERE username = ?", (following_posts, user))
-        return "Post followed successfully", 200
     except Exception as e:
-        print(f"An error occurred while fetching post details: {e}")
+        print(f"An error occurred while following the post: {e}")
         return "Internal Server Error", 500
 
-async def get_timeline(session_id):
-    # return all start and stop time that in user's following_posts (announcements and assessments)
+async def get_timeline(session_id, start=None, end=None):
+    # followed announcements and assessments overlapping [start, end], ordered by start_at;
+    # a post without end_at is treated as ending when it starts
     try:
         user = await main.users.get_username_from_session(session_id)
-        following_posts = await main.db("SELECT following_posts FROM users WHERE username = ?", (user,))
-        following_posts = following_posts[0][0]
-        if not following_posts:
-            return "No posts found", 404
-        res = await main.db("SELECT id, title, label, start_at, end_at, post_as FROM posts WHERE id IN (?)", (following_posts,))
-        if not res:
-            return "No posts found", 404
-        posts = [{
-            "id": row[0],
-            "title": row[1],
-            "created_at": row[2],
-            "start_at": row[3],
-            "end_at": row[4],
-            "post_as": row[5]
-        } for row in res]
+        if not user:
+            return "Unauthorized", 401
+        conditions = ["f.username = ?", "posts.post_type IN ('announcement', 'assessment')"]
+        params = [user]
+        if end:
+            conditions.append("posts.start_at <= ?")
+            params.append(end)
+        if start:
+            conditions.append("COALESCE(posts.end_at, posts.start_at) >= ?")
+            params.append(start)
+        # a follow does not survive losing access to the post
+        group_ids = await main.groups.get_user_group_ids(session_id)
+        if int(main.GLOBAL_ADMIN) not in group_ids:
+            conditions.append(visible_condition(group_ids))
+            params.extend(group_ids)
+        res = await main.db(f"""
+            SELECT posts.id, posts.title, posts.label, posts.start_at, posts.end_at, posts.post_as
+            FROM post_followers f JOIN posts ON posts.id = f.post_id
+            WHERE {' AND '.join(conditions)}
+            ORDER BY posts.start_at, posts.id
+        """, params)
+        posts = Rows(("id", "title", "label", "start_at", "end_at", "post_as"), res)
         return {"posts": posts}, 200
     except Exception as e:
         print(f"An error occurred while fetching posts: {e}")
-        return "Internal Server Error", 500
\ No newline at end of file
+        return "Internal Server Error", 500
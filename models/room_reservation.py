@@ -1,19 +1,267 @@
-import main
+import asyncio
+import concurrent.futures
+import configparser
+import contextlib
 import datetime
+import threading
+import time
+import weakref
+import main
+from availability import ALL_DAYS, DAY, TIME_FORMAT, AvailabilityGrid, days_mask, expand_weekly, mask_days, parse_period, parse_room
+from cache import TTLCache
+from intervals import IntervalIndex
+from responses import Rows
+
+config = configparser.ConfigParser()
+config.read('config.conf')
+
+INDEX_REFRESH_INTERVAL = config.getfloat('rooms', 'index_refresh_interval', fallback=5)
+SLOT_MINUTES = config.getint('rooms', 'slot_minutes', fallback=15)
+GRID_DAYS = config.getint('rooms', 'grid_days', fallback=60)
+MAX_RANGE_DAYS = config.getint('rooms', 'max_range_days', fallback=31)
+MAX_OCCURRENCES = config.getint('rooms', 'max_occurrences', fallback=100)
+FREE_SLOT_CACHE_SIZE = config.getint('rooms', 'free_slot_cache_size', fallback=20000)
+FREE_SLOT_CACHE_TTL = config.getfloat('rooms', 'free_slot_cache_ttl', fallback=300)
+
+# approval_status: 0=pending, 1=approved, 2=rejected; pending and approved ones hold the room
+PENDING, APPROVED, REJECTED = 0, 1, 2
+
+# Active rooms, their blackouts (grid.blackouts) and the reservations holding them
+# (grid.index), per room id, from the start of today on. Reservation changes made by this
+# worker are applied directly. Every index_refresh_interval seconds (0 = never) a
+# background task reloads everything to pick up the changes of other workers while
+# requests keep using the current grid; only after room changes do callers wait for it.
+grid = AvailabilityGrid([], slot_minutes=SLOT_MINUTES, max_days=GRID_DAYS)
+_grid_lock = threading.Lock()
+_loaded_at = None
+_generation = 0  # bumped by invalidate_grid()
+_journal = None  # changes made while a reload is reading the tables
+# the reload in progress: a concurrent future, so callers on any event loop can wait for it
+_reload = None
+_reload_task = None
+
+# Free intervals of one room on one day, keyed (room_id, room version, date). Reservation
+# changes invalidate the days they touch; a change of the room's schedule or blackouts
+# bumps its version, which orphans all of its days at once.
+free_slots = TTLCache(maxsize=FREE_SLOT_CACHE_SIZE, ttl=FREE_SLOT_CACHE_TTL)
+_room_versions = {}
+_rebuild_lock = threading.Lock()
+_rebuilds = {'rebuilds': 0, 'rebuild_time_total': 0.0, 'rebuild_time_max': 0.0}
+
+RESERVATION_COLUMNS = ('id', 'room_id', 'username', 'for', 'reason', 'start_time', 'end_time', 'created_at', 'approval_status')
+ADMIN_RESERVATION_COLUMNS = ('approved_by', 'approved_at', 'approved_reason')
+
+ROOMS_QUERY = "SELECT id, name, open_time, close_time, available_days_mask FROM rooms WHERE status = 1"
+# what ended before the cutoff (the start of today) no longer matters to availability
+HOLDING_QUERY = f"SELECT id, room_id, start_time, end_time FROM reservations WHERE end_time > ? AND approval_status IN ({PENDING}, {APPROVED})"
+BLACKOUTS_QUERY = "SELECT id, room_id, start_time, end_time FROM room_blackouts WHERE end_time > ?"
+
+def parse_time(value):
+    return datetime.datetime.strptime(value, TIME_FORMAT)
+
+def _grid_cutoff():
+    return datetime.datetime.combine(datetime.date.today(), datetime.time()).strftime(TIME_FORMAT)
+
+def _build_grid(rooms, reservations, blackouts):
+    # stored timestamps are always TIME_FORMAT, which fromisoformat parses far faster
+    parse = datetime.datetime.fromisoformat
+    index = IntervalIndex()
+    for reservation_id, room_id, start_time, end_time in reservations:
+        index.add(room_id, reservation_id, parse(start_time), parse(end_time))
+    blackout_index = IntervalIndex()
+    for blackout_id, room_id, start_time, end_time in blackouts:
+        blackout_index.add(room_id, blackout_id, parse(start_time), parse(end_time))
+    parsed = []
+    for row in rooms:
+        try:
+            parsed.append(parse_room(row))
+        except ValueError as e:
+            # a room with a malformed schedule is never offered
+            print(f"An error occurred while loading room {row[0]}: {e}")
+    return AvailabilityGrid(parsed, index, blackout_index, slot_minutes=SLOT_MINUTES, max_days=GRID_DAYS)
+
+def _select_schedule(conn, cutoff):
+    return conn.execute(ROOMS_QUERY).fetchall(), conn.execute(HOLDING_QUERY, (cutoff,)).fetchall(), conn.execute(BLACKOUTS_QUERY, (cutoff,)).fetchall()
+
+def load_grid():
+    # called once at startup, before requests are served
+    global grid, _loaded_at
+    cutoff = _grid_cutoff()
+    grid = _build_grid(*main.writer.submit_transaction(lambda conn: _select_schedule(conn, cutoff)).result())
+    _loaded_at = time.monotonic()
+
+def invalidate_grid():
+    global _loaded_at, _generation
+    with _grid_lock:
+        _loaded_at = None
+        _generation += 1
+
+async def get_grid():
+    while True:
+        with _grid_lock:
+            if _loaded_at is not None:
+                if INDEX_REFRESH_INTERVAL and time.monotonic() - _loaded_at > INDEX_REFRESH_INTERVAL:
+                    _start_reload()
+                return grid
+            reload = _start_reload()
+        # the rooms changed: wait for a grid loaded after the change
+        await asyncio.shield(asyncio.wrap_future(reload))
+
+def _start_reload():
+    # called with _grid_lock held
+    global _reload, _reload_task, _journal
+    if _reload is None:
+        _journal = []
+        _reload = concurrent.futures.Future()
+        _reload_task = asyncio.get_running_loop().create_task(_reload_grid(_reload, _generation))
+    return _reload
+
+async def _reload_grid(done, generation):
+    global grid, _loaded_at, _reload, _reload_task, _journal
+    try:
+        cutoff = _grid_cutoff()
+        rooms = await main.db(ROOMS_QUERY)
+        reservations = await main.db(HOLDING_QUERY, (cutoff,))
+        blackouts = await main.db(BLACKOUTS_QUERY, (cutoff,))
+        # parsing takes a while on large tables, keep the loop serving meanwhile
+        new_grid = await asyncio.to_thread(_build_grid, rooms, reservations, blackouts)
+    except BaseException as e:
+        with _grid_lock:
+            _reload = _reload_task = _journal = None
+        if isinstance(e, asyncio.CancelledError):
+            done.cancel()
+            raise
+        print(f"An error occurred while reloading rooms: {e}")
+        done.set_exception(e)
+        return
+    with _grid_lock:
+        # replay local changes that may have committed after the snapshot was read
+        for change in _journal:
+            _apply(new_grid, *change)
+        _invalidate_changes(grid, new_grid)
+        grid = new_grid
+        # rooms changed while loading: load again on the next call
+        _loaded_at = time.monotonic() if generation == _generation else None
+        _reload = _reload_task = _journal = None
+    done.set_result(None)
+
+def _apply(target, reservation_id, room_id=None, start_time=None, end_time=None):
+    if room_id is None:
+        target.remove(reservation_id)
+    else:
+        target.add(room_id, reservation_id, start_time, end_time)
+
+def track(reservation_id, room_id=None, start_time=None, end_time=None):
+    # records a committed change; room_id=None means the reservation no longer holds its room
+    with _grid_lock:
+        previous = grid.index.get(reservation_id)
+        if previous is not None:
+            _invalidate_days(*previous)
+        if room_id is not None:
+            _invalidate_days(room_id, start_time, end_time)
+        _apply(grid, reservation_id, room_id, start_time, end_time)
+        if _journal is not None:
+            _journal.append((reservation_id, room_id, start_time, end_time))
+
+def _days(start, end):
+    day = start.date()
+    while datetime.datetime.combine(day, datetime.time()) < end:
+        yield day
+        day += DAY
+
+def _invalidate_days(room_id, start, end):
+    version = _room_versions.get(room_id, 0)
+    free_slots.invalidate_many([(room_id, version, day) for day in _days(start, end)])
+
+def _invalidate_room(room_id):
+    _room_versions[room_id] = _room_versions.get(room_id, 0) + 1
+
+def _invalidate_changes(old_grid, new_grid):
+    # a reload brings in what other workers changed; only the affected days are dropped
+    old_items, new_items = old_grid.index.items(), new_grid.index.items()
+    for item_id in old_items.keys() | new_items.keys():
+        old, new = old_items.get(item_id), new_items.get(item_id)
+        if old != new:
+            for entry in (old, new):
+                if entry is not None:
+                    _invalidate_days(*entry)
+    old_blackouts, new_blackouts = {}, {}
+    for blackouts, items in ((old_blackouts, old_grid.blackouts.items()), (new_blackouts, new_grid.blackouts.items())):
+        for blackout_id, (room_id, start, end) in items.items():
+            blackouts.setdefault(room_id, set()).add((blackout_id, start, end))
+    for room_id in old_grid.rooms.keys() | new_grid.rooms.keys():
+        if old_grid.rooms.get(room_id) != new_grid.rooms.get(room_id) or old_blackouts.get(room_id) != new_blackouts.get(room_id):
+            _invalidate_room(room_id)
+
+def day_free_intervals(rooms, room_id, day):
+    key = (room_id, _room_versions.get(room_id, 0), day)
+    intervals = free_slots.get(key)
+    if intervals is None:
+        generation = free_slots.generation(key)
+        started = time.monotonic()
+        day_start = datetime.datetime.combine(day, datetime.time())
+        intervals = rooms.free_intervals(room_id, day_start, day_start + DAY)
+        elapsed = time.monotonic() - started
+        free_slots.set(key, intervals, generation)
+        with _rebuild_lock:
+            _rebuilds['rebuilds'] += 1
+            _rebuilds['rebuild_time_total'] += elapsed
+            _rebuilds['rebuild_time_max'] = max(_rebuilds['rebuild_time_max'], elapsed)
+    return intervals
+
+def cached_free_intervals(rooms, room_id, start, end):
+    # free intervals of [start, end) assembled from the cached days
+    free = []
+    for day in _days(start, end):
+        for free_start, free_end in day_free_intervals(rooms, room_id, day):
+            free_start, free_end = max(free_start, start), min(free_end, end)
+            if free_start >= free_end:
+                continue
+            if free and free[-1][1] == free_start:
+                free[-1] = (free[-1][0], free_end)
+            else:
+                free.append((free_start, free_end))
+    return free
+
+def free_slot_stats():
+    with _rebuild_lock:
+        rebuilds = _rebuilds['rebuilds']
+        return {
+            **free_slots.stats(),
+            'rebuilds': rebuilds,
+            'avg_rebuild_ms': round(_rebuilds['rebuild_time_total'] * 1000 / rebuilds, 3) if rebuilds else 0.0,
+            'max_rebuild_ms': round(_rebuilds['rebuild_time_max'] * 1000, 3),
+        }
+
+def _insert_blackouts(conn, room_id, periods):
+    conn.executemany("INSERT INTO room_blackouts (room_id, start_time, end_time) VALUES (?, ?, ?)", [
+        (room_id, start.strftime(TIME_FORMAT), end.strftime(TIME_FORMAT)) for start, end in periods
+    ])
 
 async def create_room(session_id, name, open_time, close_time, available_days, unavailable_periods):
+    # available_days: weekday numbers (1=Sunday, 7=Saturday); unavailable_periods: [start, end]
+    # pairs, stored as room_blackouts rows
     try:
-        username = await main.users.get_username_from_session(session_id)
+        username = await main.users.get_username_from_session(session_id, fresh=True)
         is_admin = await main.users.check_if_user_is_admin(username, 'global')
         if not is_admin:
             is_admin = await main.users.check_if_user_is_admin(username, 'room')
         if not is_admin:
             return 'Unauthorized', 401
-
-        await main.db(
-            "INSERT INTO rooms (name, open_time, close_time, available_days, unavailable_periods) VALUES (?, ?, ?, ?, ?)",
-            (name, open_time, close_time, ','.join(map(str, available_days)), ','.join(map(str, unavailable_periods)))
-        )
+        try:
+            # rooms are open every day unless the days are given, as with the column default
+            mask = ALL_DAYS if available_days is None else days_mask(available_days)
+            periods = [parse_period(period) for period in unavailable_periods or []]
+        except (TypeError, ValueError):
+            return 'Invalid available days or unavailable periods', 400
+
+        def insert_room(conn):
+            room_id = conn.execute(
+                "INSERT INTO rooms (name, open_time, close_time, available_days_mask) VALUES (?, ?, ?, ?)",
+                (name, open_time, close_time, mask)).lastrowid
+            _insert_blackouts(conn, room_id, periods)
+        await main.db_transaction(insert_room)
+        invalidate_grid()
         return 'Room created', 200
     except Exception as e:
         print(f"An error occurred while creating room: {e}")
@@ -21,7 +269,7 @@ async def create_room(session_id, name, open_time, close_time, available_days, u
 
 async def modify_room(session_id, room_id, action, name=None, open_time=None, close_time=None, available_days=None, unavailable_periods=None):
     try:
-        username = await main.users.get_username_from_session(session_id)
+        username = await main.users.get_username_from_session(session_id, fresh=True)
         is_admin = await main.users.check_if_user_is_admin(username, 'global')
         if not is_admin:
             is_admin = await main.users.check_if_user_is_admin(username, 'room')
@@ -39,24 +287,38 @@ async def modify_room(session_id, room_id, action, name=None, open_time=None, cl
             if close_time:
                 query += "close_time = ?, "
                 params.append(close_time)
-            if available_days:
-                query += "available_days = ?, "
-                params.append(','.join(map(str, available_days)))
-            if unavailable_periods:
-                query += "unavailable_periods = ?, "
-                params.append(','.join(map(str, unavailable_periods)))
+            try:
+                if available_days is not None:
+                    query += "available_days_mask = ?, "
+                    params.append(days_mask(available_days))
+                # the given periods replace all blackouts of the room
+                periods = None if unavailable_periods is None else [parse_period(period) for period in unavailable_periods]
+            except (TypeError, ValueError):
+                return 'Invalid available days or unavailable periods', 400
             query = query.rstrip(', ')
             query += " WHERE id = ?"
             params.append(room_id)
-            await main.db(query, params)
+
+            def update_room(conn):
+                if params[:-1]:
+                    conn.execute(query, params)
+                if periods is not None:
+                    conn.execute("DELETE FROM room_blackouts WHERE room_id = ?", (room_id,))
+                    _insert_blackouts(conn, room_id, periods)
+            await main.db_transaction(update_room)
         elif action == 'delete':
-            await main.db("DELETE FROM rooms WHERE id = ?", (room_id,))
+            def delete_room(conn):
+                conn.execute("DELETE FROM room_blackouts WHERE room_id = ?", (room_id,))
+                conn.execute("DELETE FROM rooms WHERE id = ?", (room_id,))
+            await main.db_transaction(delete_room)
         elif action == 'deactivate':
             await main.db("UPDATE rooms SET status = 0 WHERE id = ?", (room_id,))
         elif action == 'activate':
             await main.db("UPDATE rooms SET status = 1 WHERE id = ?", (room_id,))
         else:
             return 'Invalid action', 400
+        _invalidate_room(int(room_id))
+        invalidate_grid()
         return 'Room modified', 200
     except Exception as e:
         print(f"An error occurred while modifying room: {e}")
@@ -66,20 +328,24 @@ async def modify_room(session_id, room_id, action, name=None, open_time=None, cl
 async def get_rooms(session_id, admin = False):
     try:
         if admin:
-            username = await main.users.get_username_from_session(session_id)
+            username = await main.users.get_username_from_session(session_id, fresh=True)
             is_admin = await main.users.check_if_user_is_admin(username, 'global')
             if not is_admin:
                 is_admin = await main.users.check_if_user_is_admin(username, 'room')
             if not is_admin:
                 return 'Unauthorized', 401
-            rooms = await main.db("SELECT * FROM rooms")
+            rooms = await main.db("SELECT id, name, open_time, close_time, available_days_mask, status FROM rooms")
+            blackouts = {}
+            for room_id, start_time, end_time in await main.db("SELECT room_id, start_time, end_time FROM room_blackouts ORDER BY room_id, start_time"):
+                blackouts.setdefault(room_id, []).append([start_time, end_time])
+            rooms = Rows(('id', 'name', 'open_time', 'close_time', 'available_days', 'unavailable_periods', 'status'),
+                         [(*room[:4], mask_days(room[4]), blackouts.get(room[0], []), room[5]) for room in rooms])
 
         else:
             username = await main.users.get_username_from_session(session_id)
             if not username:
                 return 'Unauthorized', 401
-            rooms = await main.db("SELECT id, name FROM rooms WHERE status = 1")
-        rooms = main.json.dumps(rooms)
+            rooms = Rows(('id', 'name'), await main.db("SELECT id, name FROM rooms WHERE status = 1"))
         return rooms, 200
     except Exception as e:
         print(f"An error occurred while fetching rooms: {e}")
@@ -91,39 +357,18 @@ async def get_available_rooms_by_time(session_id, start_time, end_time):
         if not username:
             return 'Unauthorized', 401
 
-        # Get the day of the week for the start_time (1=Sunday, 7=Saturday)
-        start_day = datetime.datetime.strptime(start_time, '%Y-%m-%d %H:%M:%S').isoweekday() % 7 + 1
-        end_day = datetime.datetime.strptime(end_time, '%Y-%m-%d %H:%M:%S').isoweekday() % 7 + 1
-
-        # Query to get active and open rooms available on the specified days
-        query = """
-        SELECT r.id, r.name, r.unavailable_periods
-        FROM rooms r
-        LEFT JOIN reservations res ON r.id = res.room_id
-        WHERE r.status = 1
-        AND ? IN (r.available_days)
-        AND ? IN (r.available_days)
-        AND (res.start_time IS NULL OR res.end_time IS NULL OR
-             (res.start_time NOT BETWEEN ? AND ?) AND
-             (res.end_time NOT BETWEEN ? AND ?))
-        """
-        rooms = await main.db(query, (start_day, end_day, start_time, end_time, start_time, end_time))
-
-        available_rooms = []
-        for room in rooms:
-            room_id, room_name, unavailable_periods_str = room
-            unavailable_periods = unavailable_periods_str.split(',') if unavailable_periods_str else []
-            is_available = True
-            for period in unavailable_periods:
-                period_start, period_end = period.split('-')
-                if (start_time < period_end and end_time > period_start):
-                    is_available = False
-                    break
-            if is_available:
-                available_rooms.append((room_id, room_name))
-
-        available_rooms = main.json.dumps(available_rooms)
-        return available_rooms, 200
+        # Active rooms that are open for the whole window and not held by a pending or
+        # approved reservation, see availability.AvailabilityGrid
+        start, end = parse_time(start_time), parse_time(end_time)
+        if end <= start:
+            return 'Invalid time range', 400
+        if end - start > datetime.timedelta(days=MAX_RANGE_DAYS):
+            return f'Ranges should not be longer than {MAX_RANGE_DAYS} days', 400
+        rooms = await get_grid()
+        free, unsure = rooms.candidates(start, end)
+        free += [room_id for room_id in unsure if cached_free_intervals(rooms, room_id, start, end) == [(start, end)]]
+        available_rooms = [(room_id, rooms.rooms[room_id].name) for room_id in sorted(free, key=rooms.rows.get)]
+        return Rows(('id', 'name'), available_rooms), 200
     except Exception as e:
         print(f"An error occurred while fetching available rooms: {e}")
         return 'Internal Server Error', 500
@@ -134,68 +379,30 @@ async def get_available_times_by_room(session_id, room_id, start_time, end_time)
         if not username:
             return 'Unauthorized', 401
 
-        # Intervals should not longer than 3 hours
-        if (datetime.datetime.strptime(end_time, '%Y-%m-%d %H:%M:%S') - datetime.datetime.strptime(start_time, '%Y-%m-%d %H:%M:%S')).seconds > 10800:
-            return 'Intervals should not longer than 3 hours', 400
+        start, end = parse_time(start_time), parse_time(end_time)
+        if end <= start:
+            return 'Invalid time range', 400
+        if end - start > datetime.timedelta(days=MAX_RANGE_DAYS):
+            return f'Ranges should not be longer than {MAX_RANGE_DAYS} days', 400
 
-        # Get room details
-        room_query = "SELECT open_time, close_time, available_days, unavailable_periods FROM rooms WHERE id = ? AND status = 1"
-        room = await main.db(room_query, (room_id,))
-        if not room:
+        rooms = await get_grid()
+        if int(room_id) not in rooms.rooms:
             return 'Room not found or inactive', 404
 
-        open_time, close_time, available_days, unavailable_periods_str = room[0]
-        available_days = list(map(int, available_days.split(',')))
-        unavailable_periods = unavailable_periods_str.split(',') if unavailable_periods_str else []
-
-        # Get the day of the week for the start_time (1=Sunday, 7=Saturday)
-        start_day = datetime.datetime.strptime(start_time, '%Y-%m-%d %H:%M:%S').isoweekday() % 7 + 1
-        end_day = datetime.datetime.strptime(end_time, '%Y-%m-%d %H:%M:%S').isoweekday() % 7 + 1
-
-        if start_day not in available_days or end_day not in available_days:
-            return 'Room not available on the specified days', 400
-
-        # Get reservations for the room within the specified time period
-        reservations_query = """
-        SELECT start_time, end_time
-        FROM reservations
-        WHERE room_id = ?
-        AND approval_status IN (1, 2)  -- Approved or pending reservations
-        AND ((start_time BETWEEN ? AND ?) OR (end_time BETWEEN ? AND ?))
-        """
-        reservations = await main.db(reservations_query, (room_id, start_time, end_time, start_time, end_time))
-
-        # Calculate available times
-        available_times = []
-        current_time = datetime.datetime.strptime(start_time, '%Y-%m-%d %H:%M:%S')
-
-        while current_time < datetime.datetime.strptime(end_time, '%Y-%m-%d %H:%M:%S'):
-            next_time = min(datetime.datetime.strptime(close_time, '%Y-%m-%d %H:%M:%S'), datetime.datetime.strptime(end_time, '%Y-%m-%d %H:%M:%S'))
-            for reservation in reservations:
-                res_start = datetime.datetime.strptime(reservation[0], '%Y-%m-%d %H:%M:%S')
-                res_end = datetime.datetime.strptime(reservation[1], '%Y-%m-%d %H:%M:%S')
-                if res_start <= current_time < res_end:
-                    next_time = min(next_time, res_start)
-                    break
-            for period in unavailable_periods:
-                period_start, period_end = period.split('-')
-                period_start = datetime.datetime.strptime(period_start, '%Y-%m-%d %H:%M:%S')
-                period_end = datetime.datetime.strptime(period_end, '%Y-%m-%d %H:%M:%S')
-                if period_start <= current_time < period_end:
-                    next_time = min(next_time, period_start)
-                    break
-            if current_time < next_time:
-                available_times.append((current_time.strftime('%Y-%m-%d %H:%M:%S'), next_time.strftime('%Y-%m-%d %H:%M:%S')))
-            current_time = next_time
-
-        return main.json.dumps(available_times), 200
+        # Free intervals within each day's opening hours, served from the per-day cache
+        available_times = [
+            (free_start.strftime(TIME_FORMAT), free_end.strftime(TIME_FORMAT))
+            for free_start, free_end in cached_free_intervals(rooms, int(room_id), start, end)
+        ]
+
+        return Rows(('start_time', 'end_time'), available_times), 200
     except Exception as e:
         print(f"An error occurred while fetching available times: {e}")
         return 'Internal Server Error', 500
 
 async def get_reservations(session_id, start_time, end_time, room_id=None, user=None, id = None, admin = False):
     try:
-        username = await main.users.get_username_from_session(session_id)
+        username = await main.users.get_username_from_session(session_id, fresh=admin)
         if not username:
             return 'Unauthorized', 401
         if admin:
@@ -205,8 +412,9 @@ async def get_reservations(session_id, start_time, end_time, room_id=None, user=
             if not is_admin:
                 return 'Unauthorized', 401
 
-            query = """
-            SELECT id, room_id, username, for, reason, start_time, end_time, created_at, approval_status, approved_by, approved_at, approved_reason
+            columns = RESERVATION_COLUMNS + ADMIN_RESERVATION_COLUMNS
+            query = f"""
+            SELECT {', '.join(columns)}
             FROM reservations
             WHERE (start_time BETWEEN ? AND ? OR end_time BETWEEN ? AND ?)
             """
@@ -223,8 +431,9 @@ async def get_reservations(session_id, start_time, end_time, room_id=None, user=
 
             reservations = await main.db(query, params)
         else:
-            query = """
-            SELECT id, room_id, username, for, reason, start_time, end_time, created_at, approval_status
+            columns = RESERVATION_COLUMNS
+            query = f"""
+            SELECT {', '.join(columns)}
             FROM reservations
             WHERE (start_time BETWEEN ? AND ? OR end_time BETWEEN ? AND ?)
             """
@@ -240,61 +449,98 @@ async def get_reservations(session_id, start_time, end_time, room_id=None, user=
                 params.append(id)
 
             reservations = await main.db(query, params)
-        reservations = main.json.dumps(reservations)
-        return reservations, 200
+        return Rows(columns, reservations), 200
     except Exception as e:
         print(f"An error occurred while fetching reservations: {e}")
         return 'Internal Server Error', 500
 
+# Bookings of one room are serialized per event loop so concurrent attempts queue up
+# instead of piling doomed transactions on the writer; other rooms are not affected.
+# Across threads and workers, the conflict check and the insert run in one writer
+# transaction (BEGIN IMMEDIATE), which is what makes double-booking impossible.
+_room_locks = weakref.WeakKeyDictionary()  # event loop -> {room_id: [lock, users]}
+_room_locks_lock = threading.Lock()
+
+@contextlib.asynccontextmanager
+async def room_lock(room_id):
+    with _room_locks_lock:
+        locks = _room_locks.setdefault(asyncio.get_running_loop(), {})
+    entry = locks.setdefault(room_id, [asyncio.Lock(), 0])
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            yield
+    finally:
+        entry[1] -= 1
+        if not entry[1]:
+            del locks[room_id]
+
+@contextlib.asynccontextmanager
+async def room_locks(room_ids):
+    # always taken in the same order, so two bulk bookings cannot deadlock
+    async with contextlib.AsyncExitStack() as stack:
+        for room_id in sorted(set(room_ids)):
+            await stack.enter_async_context(room_lock(room_id))
+        yield
+
+def conflicting_items(conn, items, exclude=None):
+    # indexes of the (room_id, start, end) items overlapping a pending or approved
+    # reservation (other than the one with id exclude) or a blackout, found with one query; runs on
+    # the writer connection so the answer holds until the transaction commits
+    if not items:
+        return set()
+    values = ', '.join(['(?, ?, ?, ?)'] * len(items))
+    params = [value for n, (room_id, start, end) in enumerate(items) for value in (n, room_id, start.strftime(TIME_FORMAT), end.strftime(TIME_FORMAT))]
+    params.append(exclude)
+    rows = conn.execute(f"""
+        WITH items (n, room_id, start_time, end_time) AS (VALUES {values})
+        SELECT items.n FROM items JOIN reservations r
+        ON r.room_id = items.room_id AND r.start_time < items.end_time AND r.end_time > items.start_time
+        AND r.approval_status IN ({PENDING}, {APPROVED}) AND r.id IS NOT ?
+        UNION
+        SELECT items.n FROM items JOIN room_blackouts b
+        ON b.room_id = items.room_id AND b.start_time < items.end_time AND b.end_time > items.start_time
+    """, params).fetchall()
+    return {row[0] for row in rows}
+
 async def reserve_room(session_id, room_id, for_group, reason, start_time, end_time):
     try:
-        username = await main.users.get_username_from_session(session_id)
+        username = await main.users.get_username_from_session(session_id, fresh=True)
         if not username:
             return 'Unauthorized', 401
         if not (await main.groups.get_post_permissions(session_id, for_group, 'room_reservation')):
             return 'Unauthorized', 401
 
         # Check if the interval is longer than 3 hours
-        if (datetime.datetime.strptime(end_time, '%Y-%m-%d %H:%M:%S') - datetime.datetime.strptime(start_time, '%Y-%m-%d %H:%M:%S')).seconds > 10800:
+        start, end = parse_time(start_time), parse_time(end_time)
+        if end <= start:
+            return 'Invalid time range', 400
+        if end - start > datetime.timedelta(hours=3):
             return 'Intervals should not be longer than 3 hours', 400
 
-        # Check if the room is available between start_time and end_time
-        availability_query = """
-        SELECT COUNT(*)
-        FROM reservations
-        WHERE room_id = ?
-        AND approval_status IN (1, 2)  -- Approved or pending reservations
-        AND ((start_time BETWEEN ? AND ?) OR (end_time BETWEEN ? AND ?))
-        """
-        count = await main.db(availability_query, (room_id, start_time, end_time, start_time, end_time))
-        if count[0][0] > 0:
-            return 'Room is not available during the specified time', 400
-
-        # Get room details
-        room_query = "SELECT open_time, close_time, available_days, unavailable_periods FROM rooms WHERE id = ? AND status = 1"
-        room = await main.db(room_query, (room_id,))
-        if not room:
-            return 'Room not found or inactive', 404
-
-        open_time, close_time, available_days, unavailable_periods_str = room[0]
-        available_days = list(map(int, available_days.split(',')))
-        unavailable_periods = unavailable_periods_str.split(',') if unavailable_periods_str else []
-        start_day = datetime.datetime.strptime(start_time, '%Y-%m-%d %H:%M:%S').isoweekday() % 7 + 1
-        end_day = datetime.datetime.strptime(end_time, '%Y-%m-%d %H:%M:%S').isoweekday() % 7 + 1
-
-        if start_day not in available_days or end_day not in available_days:
-            return 'Room not available on the specified days', 400
-        for period in unavailable_periods:
-            period_start, period_end = period.split('-')
-            if start_time < period_end and end_time > period_start:
+        room_id = int(room_id)
+        async with room_lock(room_id):
+            # Check the room's opening hours and unavailable periods and the reservations holding it
+            rooms = await get_grid()
+            if room_id not in rooms.rooms:
+                return 'Room not found or inactive', 404
+            if not rooms.is_free(room_id, start, end):
                 return 'Room is not available during the specified time', 400
 
-        # Insert the reservation into the database and get the reservation_id
-        insert_query = """
-        INSERT INTO reservations (room_id, username, for, reason, start_time, end_time, approval_status)
-        VALUES (?, ?, ?, ?, ?, ?, 0)  -- 0 means pending approval
-        """
-        reservation_id = await main.db(insert_query, (room_id, username, for_group, reason, start_time, end_time), return_last_id=True)
+            # Check again and insert in one transaction; the index may miss reservations
+            # other workers made since its last reload
+            def insert_reservation(conn):
+                if conflicting_items(conn, [(room_id, start, end)]):
+                    return None
+                return conn.execute("""
+                    INSERT INTO reservations (room_id, username, for, reason, start_time, end_time, approval_status)
+                    VALUES (?, ?, ?, ?, ?, ?, 0)  -- 0 means pending approval
+                """, (room_id, username, for_group, reason, start.strftime(TIME_FORMAT), end.strftime(TIME_FORMAT))).lastrowid
+            reservation_id = await main.db_transaction(insert_reservation)
+            if reservation_id is None:
+                invalidate_grid()
+                return 'Room is not available during the specified time', 400
+            track(reservation_id, room_id, start, end)
 
         # Send email to user
         user_email = await main.users.get_user_email_from_session(session_id)
@@ -302,14 +548,185 @@ async def reserve_room(session_id, room_id, for_group, reason, start_time, end_t
         email_body = f"Your reservation (ID: {reservation_id}) for room {room_id} from {start_time} to {end_time} is pending approval."
         await main.send_email(user_email, email_subject, email_body)
 
-        return 'Reservation created and pending approval', 200
+        return {'message': 'Reservation created and pending approval', 'reservation_id': reservation_id}, 200
+    except Exception as e:
+        print(f"An error occurred while reserving the room: {e}")
+        return 'Internal Server Error', 500
+
+async def reserve_rooms(session_id, for_group, reason, items):
+    # items: [{'room_id', 'start_time', 'end_time'}]; all of them are reserved or none
+    try:
+        username = await main.users.get_username_from_session(session_id, fresh=True)
+        if not username:
+            return 'Unauthorized', 401
+        if not (await main.groups.get_post_permissions(session_id, for_group, 'room_reservation')):
+            return 'Unauthorized', 401
+        if not items:
+            return 'Missing items', 400
+        if len(items) > MAX_OCCURRENCES:
+            return f'Should not reserve more than {MAX_OCCURRENCES} items at once', 400
+
+        parsed = []
+        conflicts = []
+        for n, item in enumerate(items):
+            try:
+                room_id, start, end = int(item['room_id']), parse_time(item['start_time']), parse_time(item['end_time'])
+            except (KeyError, TypeError, ValueError):
+                conflicts.append({'item': n, 'error': 'Invalid item'})
+                continue
+            if end <= start:
+                conflicts.append({'item': n, 'error': 'Invalid time range'})
+            elif end - start > datetime.timedelta(hours=3):
+                conflicts.append({'item': n, 'error': 'Intervals should not be longer than 3 hours'})
+            parsed.append((n, room_id, start, end))
+
+        # items of the same request must not overlap each other either: in start order, an
+        # item overlaps an earlier one of its room when it starts before the latest end so far
+        parsed.sort(key=lambda item: (item[1], item[2]))
+        latest = {}  # room_id -> (end, item)
+        for n, room_id, start, end in parsed:
+            if room_id in latest and start < latest[room_id][0]:
+                conflicts.append({'item': n, 'error': f'Overlaps item {latest[room_id][1]}'})
+            if room_id not in latest or end > latest[room_id][0]:
+                latest[room_id] = (end, n)
+        parsed.sort()
+
+        async with room_locks(item[1] for item in parsed):
+            rooms = await get_grid()
+            for n, room_id, start, end in parsed:
+                if room_id not in rooms.rooms:
+                    conflicts.append({'item': n, 'error': 'Room not found or inactive'})
+                elif not rooms.is_free(room_id, start, end):
+                    conflicts.append({'item': n, 'error': 'Room is not available during the specified time'})
+            if conflicts:
+                return {'message': 'No rooms were reserved', 'conflicts': sorted(conflicts, key=lambda conflict: conflict['item'])}, 400
+
+            def insert_items(conn):
+                # the index may miss reservations other workers made since its last reload
+                taken = conflicting_items(conn, [item[1:] for item in parsed])
+                if taken:
+                    return [parsed[n][0] for n in sorted(taken)], []
+                return [], [conn.execute("""
+                    INSERT INTO reservations (room_id, username, for, reason, start_time, end_time, approval_status)
+                    VALUES (?, ?, ?, ?, ?, ?, 0)
+                """, (room_id, username, for_group, reason, start.strftime(TIME_FORMAT), end.strftime(TIME_FORMAT))).lastrowid
+                    for _, room_id, start, end in parsed]
+            taken, reservation_ids = await main.db_transaction(insert_items)
+            if taken:
+                invalidate_grid()
+                return {'message': 'No rooms were reserved', 'conflicts': [
+                    {'item': n, 'error': 'Room is not available during the specified time'} for n in taken
+                ]}, 400
+            for reservation_id, (_, room_id, start, end) in zip(reservation_ids, parsed):
+                track(reservation_id, room_id, start, end)
+
+        # Send one email for all of them
+        user_email = await main.users.get_user_email_from_session(session_id)
+        email_subject = "Room Reservations Created"
+        email_body = "\n".join(
+            ["Your reservations are pending approval:"] +
+            [f"  (ID: {reservation_id}) room {room_id} from {start.strftime(TIME_FORMAT)} to {end.strftime(TIME_FORMAT)}"
+             for reservation_id, (_, room_id, start, end) in zip(reservation_ids, parsed)])
+        await main.send_email(user_email, email_subject, email_body)
+
+        return {'message': 'Reservations created and pending approval', 'reservation_ids': reservation_ids}, 200
+    except Exception as e:
+        print(f"An error occurred while reserving rooms: {e}")
+        return 'Internal Server Error', 500
+
+FREQUENCIES = {'weekly': 1, 'biweekly': 2}
+
+async def reserve_room_recurring(session_id, room_id, for_group, reason, start_time, end_time, frequency='weekly', weekdays=None, until=None, count=None):
+    # start_time/end_time are the first occurrence; weekdays are 1=Sunday ... 7=Saturday
+    try:
+        username = await main.users.get_username_from_session(session_id, fresh=True)
+        if not username:
+            return 'Unauthorized', 401
+        if not (await main.groups.get_post_permissions(session_id, for_group, 'room_reservation')):
+            return 'Unauthorized', 401
+
+        start, end = parse_time(start_time), parse_time(end_time)
+        if end <= start:
+            return 'Invalid time range', 400
+        if end - start > datetime.timedelta(hours=3):
+            return 'Intervals should not be longer than 3 hours', 400
+        if frequency not in FREQUENCIES:
+            return 'Invalid frequency', 400
+        if weekdays and not all(day in range(1, 8) for day in weekdays):
+            return 'Invalid weekdays', 400
+        if until is None and count is None:
+            return 'Missing until or count', 400
+        if until is not None:
+            until = datetime.date.fromisoformat(str(until)[:10])
+        if count is not None:
+            count = int(count)
+        occurrences = expand_weekly(start, end, weekdays, FREQUENCIES[frequency], until, count, MAX_OCCURRENCES)
+        if occurrences is None:
+            return f'Series should not have more than {MAX_OCCURRENCES} occurrences', 400
+        if not occurrences:
+            return 'No occurrences in the specified range', 400
+
+        room_id = int(room_id)
+        async with room_lock(room_id):
+            # Check every occurrence against the room's schedule in one pass; nothing is
+            # reserved unless all of them are free
+            rooms = await get_grid()
+            if room_id not in rooms.rooms:
+                return 'Room not found or inactive', 404
+            conflicts = [
+                (occurrence_start.strftime(TIME_FORMAT), occurrence_end.strftime(TIME_FORMAT))
+                for occurrence_start, occurrence_end in occurrences
+                if not rooms.is_free(room_id, occurrence_start, occurrence_end)
+            ]
+            if conflicts:
+                return {'message': 'Room is not available during the specified time', 'conflicts': conflicts}, 400
+
+            # Check again and insert the whole series in one transaction; series_id is the
+            # id of the first occurrence
+            def insert_series(conn):
+                taken = conflicting_items(conn, [(room_id, occurrence_start, occurrence_end) for occurrence_start, occurrence_end in occurrences])
+                if taken:
+                    return [occurrences[n] for n in sorted(taken)], []
+                reservation_ids = []
+                for occurrence_start, occurrence_end in occurrences:
+                    reservation_id = conn.execute("""
+                        INSERT INTO reservations (room_id, username, for, reason, start_time, end_time, approval_status, series_id)
+                        VALUES (?, ?, ?, ?, ?, ?, 0, ?)
+                    """, (room_id, username, for_group, reason, occurrence_start.strftime(TIME_FORMAT), occurrence_end.strftime(TIME_FORMAT), reservation_ids[0] if reservation_ids else None)).lastrowid
+                    reservation_ids.append(reservation_id)
+                conn.execute("UPDATE reservations SET series_id = ? WHERE id = ?", (reservation_ids[0], reservation_ids[0]))
+                return [], reservation_ids
+            taken, reservation_ids = await main.db_transaction(insert_series)
+            if taken:
+                invalidate_grid()
+                return {'message': 'Room is not available during the specified time', 'conflicts': [
+                    (occurrence_start.strftime(TIME_FORMAT), occurrence_end.strftime(TIME_FORMAT)) for occurrence_start, occurrence_end in taken
+                ]}, 400
+            for reservation_id, (occurrence_start, occurrence_end) in zip(reservation_ids, occurrences):
+                track(reservation_id, room_id, occurrence_start, occurrence_end)
+
+        # Send one email for the whole series
+        user_email = await main.users.get_user_email_from_session(session_id)
+        email_subject = "Recurring Room Reservation Created"
+        email_body = "\n".join(
+            [f"Your recurring reservation (series ID: {reservation_ids[0]}) for room {room_id} is pending approval:"] +
+            [f"  {occurrence_start.strftime(TIME_FORMAT)} to {occurrence_end.strftime(TIME_FORMAT)}" for occurrence_start, occurrence_end in occurrences])
+        await main.send_email(user_email, email_subject, email_body)
+
+        return {
+            'message': 'Reservations created and pending approval',
+            'series_id': reservation_ids[0],
+            'reservation_ids': reservation_ids
+        }, 200
+    except ValueError:
+        return 'Invalid parameters', 400
     except Exception as e:
         print(f"An error occurred while reserving the room: {e}")
         return 'Internal Server Error', 500
 
 async def cancel_reservation(session_id, reservation_id):
     try:
-        username = await main.users.get_username_from_session(session_id)
+        username = await main.users.get_username_from_session(session_id, fresh=True)
         if not username:
             return 'Unauthorized', 401
 
@@ -321,6 +738,7 @@ async def cancel_reservation(session_id, reservation_id):
             return 'Unauthorized', 401
         # Delete the reservation
         await main.db("DELETE FROM reservations WHERE id = ?", (reservation_id,))
+        track(int(reservation_id))
         return 'Reservation canceled', 200
     except Exception as e:
         print(f"An error occurred while canceling the reservation: {e}")
@@ -329,7 +747,7 @@ async def cancel_reservation(session_id, reservation_id):
 
 async def approve_reservation(session_id, reservation_id, action, reason):
     try:
-        username = await main.users.get_username_from_session(session_id)
+        username = await main.users.get_username_from_session(session_id, fresh=True)
         is_admin = await main.users.check_if_user_is_admin(username, 'global')
         if not is_admin:
             is_admin = await main.users.check_if_user_is_admin(username, 'room')
@@ -337,27 +755,40 @@ async def approve_reservation(session_id, reservation_id, action, reason):
             return 'Unauthorized', 401
 
         if action == 'approve':
-            approval_status = 1
+            approval_status = APPROVED
             email_subject = "Room Reservation Approved"
         elif action == 'reject':
-            approval_status = 2
+            approval_status = REJECTED
             email_subject = "Room Reservation Rejected"
         else:
             return 'Invalid action', 400
 
         # Retrieve reservation details
         reservation = await main.db(
-            "SELECT name, start_time, end_time FROM reservations WHERE id = ?",
+            "SELECT r.name, res.start_time, res.end_time, res.room_id FROM reservations res JOIN rooms r ON r.id = res.room_id WHERE res.id = ?",
             (reservation_id,))
         if not reservation:
             return 'Reservation not found', 404
 
-        # Update the reservation
-        await main.db(
-            "UPDATE reservations SET approval_status = ?, approved_by = ?, approved_at = NOW(), approved_reason = ? WHERE id = ?",
-            (approval_status, username, reason, reservation_id))
-
-        room_name, start_time, end_time = reservation[0]
+        room_name, start_time, end_time, room_id = reservation[0]
+        start, end = parse_time(start_time), parse_time(end_time)
+
+        # Update the reservation; a rejected reservation gave up its slot, so approving checks
+        # again that nothing else holds the room
+        def update_reservation(conn):
+            if approval_status == APPROVED and conflicting_items(conn, [(room_id, start, end)], exclude=int(reservation_id)):
+                return False
+            conn.execute(
+                "UPDATE reservations SET approval_status = ?, approved_by = ?, approved_at = CURRENT_TIMESTAMP, approved_reason = ? WHERE id = ?",
+                (approval_status, username, reason, reservation_id))
+            return True
+        async with room_lock(room_id):
+            if not await main.db_transaction(update_reservation):
+                return 'Room is not available during the specified time', 400
+            if approval_status == APPROVED:
+                track(int(reservation_id), room_id, start, end)
+            else:
+                track(int(reservation_id))
 
         # Send email to user
         user_email = await main.users.get_user_email_from_session(session_id)
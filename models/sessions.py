@@ -0,0 +1,94 @@
+import configparser
+import secrets
+import threading
+import time
+import main
+from cache import TTLCache
+
+config = configparser.ConfigParser()
+config.read('config.conf')
+
+SESSION_TTL = config.getint('session', 'ttl', fallback=3600)
+HOT_TTL = config.getfloat('session', 'hot_ttl', fallback=30)
+HOT_SIZE = config.getint('session', 'hot_size', fallback=50000)
+EVICT_INTERVAL = config.getfloat('session', 'evict_interval', fallback=60)
+
+# The sessions table is the source of truth shared by every worker; the hot tier answers
+# repeated lookups without touching SQLite. hot_ttl bounds how long another worker can keep
+# serving a session that was revoked elsewhere to reads; writes and admin actions pass
+# fresh=True and always see revocations, whichever worker made them.
+hot = TTLCache(maxsize=HOT_SIZE, ttl=HOT_TTL)
+
+_evictor = None
+_evictor_lock = threading.Lock()
+_stop = threading.Event()
+
+def _evict_expired():
+    while not _stop.wait(EVICT_INTERVAL):
+        try:
+            main.writer.submit("DELETE FROM sessions WHERE expires_at <= ?", (int(time.time()),))
+            hot.purge_expired()
+        except Exception as e:
+            print(f"An error occurred while evicting sessions: {e}")
+
+def start():
+    global _evictor
+    with _evictor_lock:
+        if _evictor is None or not _evictor.is_alive():
+            _stop.clear()
+            _evictor = threading.Thread(target=_evict_expired, name='session-evictor', daemon=True)
+            _evictor.start()
+
+def stop():
+    _stop.set()
+
+def _remember(session_id, username, expires_at, generation=None):
+    hot.set(session_id, (username, expires_at), generation, ttl=min(HOT_TTL, expires_at - time.time()))
+
+async def create(username):
+    start()
+    session_id = secrets.token_hex(16)
+    expires_at = int(time.time()) + SESSION_TTL
+    await main.db("INSERT INTO sessions (session_id, username, expires_at) VALUES (?, ?, ?)", (session_id, username, expires_at))
+    _remember(session_id, username, expires_at)
+    return session_id
+
+async def get(session_id, fresh=False):
+    if not session_id:
+        return None
+    entry = None if fresh else hot.get(session_id)
+    if entry is None:
+        start()
+        generation = hot.generation(session_id)
+        res = await main.db("SELECT username, expires_at FROM sessions WHERE session_id = ?", (session_id,))
+        if not res:
+            if fresh:
+                # possibly revoked by another worker: stop serving it to reads here as well
+                hot.invalidate(session_id)
+            return None
+        entry = res[0]
+        if entry[1] > time.time():
+            _remember(session_id, *entry, generation)
+    username, expires_at = entry
+    if expires_at <= time.time():
+        return None
+    return username
+
+async def revoke(session_id):
+    if not session_id:
+        return False
+    res = await main.db("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+    hot.invalidate(session_id)
+    return res.rowcount > 0
+
+async def revoke_user(username):
+    def delete_sessions(conn):
+        session_ids = [row[0] for row in conn.execute("SELECT session_id FROM sessions WHERE username = ?", (username,))]
+        conn.execute("DELETE FROM sessions WHERE username = ?", (username,))
+        return session_ids
+    session_ids = await main.db_transaction(delete_sessions)
+    hot.invalidate_many(session_ids)
+    return len(session_ids)
+
+def stats():
+    return hot.stats()
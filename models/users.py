@@ -1,14 +1,15 @@
-import secrets
-import re
 import main
-from werkzeug.security import generate_password_hash, check_password_hash
+import passwords
+from flask import make_response
 
 #ststus: 0=inactive, 1=active
 
-async def get_username_from_session(session_id):
+async def get_username_from_session(session_id, fresh=False):
+    # fresh: check the sessions table, for writes and admin actions
     try:
-        return main.session[session_id]
-    except:
+        return await main.sessions.get(session_id, fresh)
+    except Exception as e:
+        print(f"An error occurred while reading the session: {e}")
         return None
 async def get_user_id_from_username(username):
     res = await main.db("SELECT id FROM users WHERE username = ?", (username,))
@@ -22,20 +23,18 @@ async def get_user_email_from_session(session_id):
     return res[0][0]
 async def check_if_user_is_admin(username, type):
     if type == 'global':
-        res = await main.db("SELECT 1 FROM user_groups WHERE id = ? AND admin LIKE ?", (main.GLOBAL_ADMIN, '%' + username + '%',))
-        return len(res) > 0
+        group_id = main.GLOBAL_ADMIN
     elif type == 'room':
-        res = await main.db("SELECT 1 FROM user_groups WHERE id = ? AND admin LIKE ?", (main.ROOM_ADMIN, '%' + username + '%',))
-        return len(res) > 0
-    return False
+        group_id = main.ROOM_ADMIN
+    else:
+        return False
+    if not username:
+        return False
+    group = (await main.groups.get_user_authz(username)).get(int(group_id))
+    return bool(group and group[1] == 'admin')
 
 async def signup(username, password, email):
-    if not re.match(r"^[a-zA-Z0-9_]+$", username):
-        return "Invalid username format", 400
-    if len(username) < 4 or len(username) > 20:
-        return "Username must be between 4 and 20 characters", 400
-    if not re.match(r"[^@]+@[^@]+\.[^@]+", email):
-        return "Invalid email format", 400
+    # username and email formats are checked by schemas.SIGNUP before this runs
     try:
         # Check if the username is already taken
         res = await main.db("SELECT * FROM users WHERE username = ?", (username,))
@@ -44,11 +43,12 @@ async def signup(username, password, email):
         res = await main.db("SELECT * FROM unverified_users WHERE username = ?", (username,))
         if len(res) > 0:
             return "Check email", 400
-        password_hash = generate_password_hash(password)
+        password_hash = await passwords.hash_password(password)
         await main.db("INSERT INTO unverified_users (username, password, email) VALUES (?, ?, ?)", (username, password_hash, email))
         await main.auth.send_confirmation_email(email)
         return "User registered successfully. Please check your email to verify your account", 201
-
+    except passwords.Busy:
+        return "Too many signups, please try again shortly", 503
     except Exception as e:
         print(f"An error occurred during signup: {e}")
         return "Internal Server Error", 500
@@ -70,23 +70,27 @@ async def login(username, password):
             if res[0][8] == 0:
                 return "User is inactive", 401
             # Check if the password is correct
-            if check_password_hash(res[0][2], password):
-                session_id = secrets.token_hex(16)
-                main.session[session_id] = username
-                resp = main.make_response(main.jsonify("Login successful"))
-                resp.set_cookie('session_id', session_id, max_age=3600, httponly=True, secure=True, samesite='Strict')
+            valid, new_hash = await passwords.verify_password(res[0][2], password)
+            if valid:
+                if new_hash:
+                    # hashed with older cost parameters; skipped if the password changed meanwhile
+                    await main.db("UPDATE users SET password = ? WHERE username = ? AND password = ?", (new_hash, username, res[0][2]))
+                session_id = await main.sessions.create(username)
+                resp = make_response(main.jsonify("Login successful"))
+                resp.set_cookie('session_id', session_id, max_age=main.sessions.SESSION_TTL, httponly=True, secure=True, samesite='Strict')
                 return resp
             else:
                 return "Incorrect password", 401
+    except passwords.Busy:
+        return "Too many login attempts, please try again shortly", 503
     except Exception as e:
         print(f"An error occurred during login: {e}")
         return "Internal Server Error", 500
 
 async def logout(session_id):
     try:
-        if session_id in main.session:
-            del main.session[session_id]
-            resp = main.make_response(main.jsonify("Logout successful"))
+        if await main.sessions.revoke(session_id):
+            resp = make_response(main.jsonify("Logout successful"))
             resp.delete_cookie('session_id')
             return resp
         else:
@@ -99,7 +103,7 @@ async def logout(session_id):
 async def modify_user(session_id, target_username, action, password=None, bio=None, admin=False):
     try:
         # Verify session and get the username
-        username = await get_username_from_session(session_id)
+        username = await get_username_from_session(session_id, fresh=True)
         if not username:
             return 'Unauthorized', 401
         if admin:
@@ -112,7 +116,7 @@ async def modify_user(session_id, target_username, action, password=None, bio=No
         # Perform the requested action
         if action == 'update':
             if password:
-                password_hash = generate_password_hash(password)
+                password_hash = await passwords.hash_password(password)
                 await main.db("UPDATE users SET password = ? WHERE username = ?", (password_hash, target_username))
             elif bio:
                 await main.db("UPDATE users SET bio = ? WHERE username = ?", (bio, target_username))
@@ -121,11 +125,14 @@ async def modify_user(session_id, target_username, action, password=None, bio=No
         elif action == 'delete':
             if admin:
                 await main.db("DELETE FROM users WHERE username = ?", (target_username,))
+                await main.db("DELETE FROM post_followers WHERE username = ?", (target_username,))
+                await main.sessions.revoke_user(target_username)
             else:
                 return 'Forbidden', 403
         elif action == 'deactivate':
             if admin:
                 await main.db("UPDATE users SET status = 0 WHERE username = ?", (target_username,))
+                await main.sessions.revoke_user(target_username)
             else:
                 return 'Forbidden', 403
         elif action == 'activate':
@@ -135,7 +142,8 @@ async def modify_user(session_id, target_username, action, password=None, bio=No
                 return 'Forbidden', 403
 
         return "User modified successfully", 200
-
+    except passwords.Busy:
+        return "Too many password changes, please try again shortly", 503
     except Exception as e:
         print(f"An error occurred while modifying the user: {e}")
         return "Internal Server Error", 500
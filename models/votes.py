@@ -0,0 +1,171 @@
+import atexit
+import configparser
+import os
+import secrets
+import threading
+import time
+from collections import deque
+import main
+
+config = configparser.ConfigParser()
+config.read('config.conf')
+
+FLUSH_INTERVAL = config.getfloat('posts', 'vote_flush_interval', fallback=1.0)
+FLUSH_THRESHOLD = config.getint('posts', 'vote_flush_threshold', fallback=500)
+
+# Votes are acknowledged from memory and written to pull_votes/pulls in batches.
+# Every flush also records (WORKER_ID, seq) in vote_flush_marks inside the same
+# transaction, so a reader that gets the counters and the mark from one snapshot knows
+# exactly which of this worker's in-flight and recently committed votes are already
+# included.
+# Votes still buffered in another worker become visible after its next flush.
+WORKER_ID = f"{os.getpid()}-{secrets.token_hex(4)}"
+OPINIONS = ('agree', 'disagree')
+
+_lock = threading.Lock()
+_flush_lock = threading.Lock()
+_pending = {}  # (post_id, username) -> opinion
+_pending_counts = {}  # post_id -> [agree, disagree]
+_inflight = {}
+_inflight_counts = {}
+_inflight_seq = 0
+# (seq, counts) of the last committed flushes, for readers whose snapshot predates them
+_flushed = deque(maxlen=16)
+_seq = 0
+_flusher = None
+_wake = threading.Event()
+_stop = threading.Event()
+_stats = {
+    'accepted': 0,
+    'flushes': 0,
+    'flushed': 0,
+    'duplicates_dropped': 0,
+    'flush_failures': 0,
+    'flush_time_total': 0.0,
+}
+
+def _run():
+    while not _stop.is_set():
+        _wake.wait(FLUSH_INTERVAL)
+        _wake.clear()
+        try:
+            flush()
+        except Exception as e:
+            print(f"An error occurred while flushing votes: {e}")
+
+def start():
+    global _flusher
+    with _lock:
+        if _flusher is None or not _flusher.is_alive():
+            _stop.clear()
+            _flusher = threading.Thread(target=_run, name='vote-flusher', daemon=True)
+            _flusher.start()
+
+def stop():
+    _stop.set()
+    _wake.set()
+    flush()
+
+atexit.register(stop)
+
+def has_pending_vote(post_id, username):
+    key = (int(post_id), username)
+    with _lock:
+        return key in _pending or key in _inflight
+
+def add(post_id, username, opinion):
+    # returns False when this worker already holds a vote of the user for the pull
+    if not username:
+        raise ValueError("A vote needs a username")
+    start()
+    key = (int(post_id), username)
+    with _lock:
+        if key in _pending or key in _inflight:
+            return False
+        _pending[key] = opinion
+        _pending_counts.setdefault(key[0], [0, 0])[OPINIONS.index(opinion)] += 1
+        _stats['accepted'] += 1
+        full = len(_pending) >= FLUSH_THRESHOLD
+    if full:
+        _wake.set()
+    return True
+
+def unflushed(post_id, flushed_seq):
+    # deltas of this worker that the snapshot marked with flushed_seq does not contain yet
+    post_id = int(post_id)
+    with _lock:
+        flushed_seq = flushed_seq or 0
+        agree, disagree = _pending_counts.get(post_id, (0, 0))
+        if _inflight and _inflight_seq > flushed_seq:
+            inflight_agree, inflight_disagree = _inflight_counts.get(post_id, (0, 0))
+            agree, disagree = agree + inflight_agree, disagree + inflight_disagree
+        for seq, counts in _flushed:
+            if seq > flushed_seq:
+                flushed_agree, flushed_disagree = counts.get(post_id, (0, 0))
+                agree, disagree = agree + flushed_agree, disagree + flushed_disagree
+        return agree, disagree
+
+def flush():
+    global _pending, _pending_counts, _inflight, _inflight_counts, _inflight_seq, _seq
+    with _flush_lock:
+        with _lock:
+            if not _pending:
+                return 0
+            _seq += 1
+            _inflight, _inflight_counts, _inflight_seq = _pending, _pending_counts, _seq
+            _pending, _pending_counts = {}, {}
+            batch = list(_inflight.items())
+            seq = _seq
+
+        def apply(conn):
+            counts = {}
+            dropped = 0
+            for (post_id, username), opinion in batch:
+                # the ledger keeps one vote per user even across workers; votes for pulls
+                # deleted in the meantime are dropped
+                inserted = conn.execute("""
+                    INSERT OR IGNORE INTO pull_votes (post_id, username, opinion)
+                    SELECT ?, ?, ? WHERE EXISTS (SELECT 1 FROM pulls WHERE post_id = ?)
+                """, (post_id, username, opinion, post_id)).rowcount
+                if inserted:
+                    counts.setdefault(post_id, [0, 0])[OPINIONS.index(opinion)] += 1
+                else:
+                    dropped += 1
+            conn.executemany("UPDATE pulls SET agree = agree + ?, disagree = disagree + ? WHERE post_id = ?", [
+                (agree, disagree, post_id) for post_id, (agree, disagree) in counts.items()
+            ])
+            conn.execute("INSERT INTO vote_flush_marks (worker, seq) VALUES (?, ?) ON CONFLICT(worker) DO UPDATE SET seq = excluded.seq", (WORKER_ID, seq))
+            return counts, dropped
+
+        started = time.monotonic()
+        try:
+            counts, dropped = main.writer.submit_transaction(apply).result()
+        except Exception:
+            # keep the votes for the next flush
+            with _lock:
+                for key, opinion in _inflight.items():
+                    if key not in _pending:
+                        _pending[key] = opinion
+                        _pending_counts.setdefault(key[0], [0, 0])[OPINIONS.index(opinion)] += 1
+                _inflight, _inflight_counts = {}, {}
+                _stats['flush_failures'] += 1
+            raise
+        with _lock:
+            # what the batch actually added, until readers' snapshots include it
+            _flushed.append((seq, counts))
+            _inflight, _inflight_counts = {}, {}
+            _stats['flushes'] += 1
+            _stats['flushed'] += len(batch)
+            _stats['duplicates_dropped'] += dropped
+            _stats['flush_time_total'] += time.monotonic() - started
+        return len(batch)
+
+def stats():
+    with _lock:
+        flushes = _stats['flushes']
+        return {
+            'pending': len(_pending),
+            'inflight': len(_inflight),
+            **{key: value for key, value in _stats.items() if key != 'flush_time_total'},
+            'avg_flush_ms': round(_stats['flush_time_total'] * 1000 / flushes, 3) if flushes else 0.0,
+        }
@@ -0,0 +1,167 @@
+import asyncio
+import concurrent.futures
+import configparser
+import multiprocessing
+import threading
+import time
+
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash
+
+config = configparser.ConfigParser()
+config.read('config.conf')
+
+# werkzeug method string: scrypt:N:r:p or pbkdf2:hash:iterations
+METHOD = config.get('passwords', 'method', fallback='scrypt:32768:8:1')
+SALT_LENGTH = config.getint('passwords', 'salt_length', fallback=16)
+WORKERS = config.getint('passwords', 'workers', fallback=2)
+MAX_PENDING = config.getint('passwords', 'max_pending', fallback=64)
+
+
+class Busy(Exception):
+    pass
+
+
+def normalize_method(method):
+    # the method prefix werkzeug stores in front of a hash made with `method`
+    name, *args = method.split(':')
+    if name == 'scrypt' and not args:
+        return 'scrypt:32768:8:1'
+    if name == 'pbkdf2':
+        hash_name = args[0] if args else 'sha256'
+        iterations = args[1] if len(args) > 1 else DEFAULT_PBKDF2_ITERATIONS
+        return f"pbkdf2:{hash_name}:{iterations}"
+    return method
+
+
+def needs_rehash(stored, method=METHOD):
+    return stored.split('$', 1)[0] != normalize_method(method)
+
+
+# run in the worker processes; they return their own run time so the caller can tell
+# queueing from hashing
+def _hash(password, method, salt_length):
+    started = time.perf_counter()
+    password_hash = generate_password_hash(password, method, salt_length)
+    return password_hash, time.perf_counter() - started
+
+
+def _verify(stored, password, method, salt_length):
+    started = time.perf_counter()
+    valid = check_password_hash(stored, password)
+    new_hash = generate_password_hash(password, method, salt_length) if valid and needs_rehash(stored, method) else None
+    return (valid, new_hash), time.perf_counter() - started
+
+
+def _warm_up():
+    return None, 0.0
+
+
+# Key derivation is CPU-bound for tens of milliseconds, so it runs in a fixed set of
+# processes: the event loop only awaits the result, and a login burst queues here (up to
+# MAX_PENDING, then Busy) instead of stalling every other request of the worker.
+# The processes are forked, which is only safe while this is the only thread; a pool
+# started later (or replacing one whose worker died) uses threads instead, as hashlib
+# releases the GIL while deriving a key.
+_executor = None
+_kind = None
+_lock = threading.Lock()
+_pending = 0
+_stats = {
+    'hashes': 0,
+    'verifications': 0,
+    'rehashes': 0,
+    'rejected': 0,
+    'queue_time_total': 0.0,
+    'queue_time_max': 0.0,
+    'run_time_total': 0.0,
+}
+
+
+def start():
+    # main calls this before any other thread exists, as a fork only copies the calling
+    # thread and locks held by the others would stay locked in the children
+    global _executor, _kind
+    with _lock:
+        if _executor is None:
+            if threading.active_count() == 1:
+                _executor = concurrent.futures.ProcessPoolExecutor(max_workers=WORKERS, mp_context=multiprocessing.get_context('fork'))
+                _executor.submit(_warm_up)
+                _kind = 'processes'
+            else:
+                if _kind == 'processes':
+                    print("Password hashing continues on threads: the process pool broke after other threads started")
+                _executor = concurrent.futures.ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix='password')
+                _kind = 'threads'
+        return _executor
+
+
+def stop():
+    global _executor
+    with _lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+async def _run(fn, *args):
+    global _pending, _executor
+    with _lock:
+        if _pending >= MAX_PENDING:
+            _stats['rejected'] += 1
+            raise Busy("Too many password operations in progress")
+        _pending += 1
+    try:
+        executor = start()
+        submitted = time.perf_counter()
+        try:
+            result, run_time = await asyncio.wrap_future(executor.submit(fn, *args))
+        except concurrent.futures.process.BrokenProcessPool:
+            # a worker died: the next caller starts a thread pool, see start()
+            with _lock:
+                if _executor is executor:
+                    _executor = None
+            raise
+        queue_time = max(time.perf_counter() - submitted - run_time, 0.0)
+        with _lock:
+            _stats['queue_time_total'] += queue_time
+            _stats['queue_time_max'] = max(_stats['queue_time_max'], queue_time)
+            _stats['run_time_total'] += run_time
+        return result
+    finally:
+        with _lock:
+            _pending -= 1
+
+
+async def hash_password(password):
+    password_hash = await _run(_hash, password, METHOD, SALT_LENGTH)
+    with _lock:
+        _stats['hashes'] += 1
+    return password_hash
+
+
+async def verify_password(stored, password):
+    # (valid, new hash when the stored one was made with other parameters, else None)
+    valid, new_hash = await _run(_verify, stored, password, METHOD, SALT_LENGTH)
+    with _lock:
+        _stats['verifications'] += 1
+        if new_hash:
+            _stats['rehashes'] += 1
+    return valid, new_hash
+
+
+def stats():
+    with _lock:
+        operations = _stats['hashes'] + _stats['verifications']
+        return {
+            'method': normalize_method(METHOD),
+            'pool': _kind,
+            'workers': WORKERS,
+            'pending': _pending,
+            'hashes': _stats['hashes'],
+            'verifications': _stats['verifications'],
+            'rehashes': _stats['rehashes'],
+            'rejected': _stats['rejected'],
+            'avg_queue_ms': round(_stats['queue_time_total'] * 1000 / operations, 3) if operations else 0.0,
+            'max_queue_ms': round(_stats['queue_time_max'] * 1000, 3),
+            'avg_hash_ms': round(_stats['run_time_total'] * 1000 / operations, 3) if operations else 0.0,
+        }
@@ -0,0 +1,129 @@
+import configparser
+import threading
+import time
+from collections import OrderedDict
+
+config = configparser.ConfigParser()
+config.read('config.conf')
+
+ENABLED = config.getboolean('ratelimit', 'enabled', fallback=True)
+MAX_KEYS = config.getint('ratelimit', 'max_keys', fallback=100000)
+EVICT_INTERVAL = config.getfloat('ratelimit', 'evict_interval', fallback=60)
+
+
+# One token bucket per key, refilled at per_minute tokens a minute up to burst.
+# Each key is a single (tokens, updated) tuple in an OrderedDict kept in order of last use,
+# so the buckets that have refilled completely (and behave like a missing key) are always at
+# the front and eviction stops at the first one still in use.
+class TokenBuckets:
+    def __init__(self, per_minute, burst, max_keys=MAX_KEYS):
+        self.rate = per_minute / 60
+        self.burst = max(burst, 1)
+        self.max_keys = max_keys
+        self.refill_time = self.burst / self.rate if self.rate > 0 else float('inf')
+        self._buckets = OrderedDict()  # key -> (tokens, updated)
+        self._lock = threading.Lock()
+        self._stats = {
+            'allowed': 0,
+            'limited': 0,
+            'evictions': 0,
+        }
+
+    def take(self, key):
+        # 0 when a token was taken, else the seconds until one is available
+        now = time.monotonic()
+        with self._lock:
+            entry = self._buckets.get(key)
+            if entry is None:
+                tokens = self.burst
+            else:
+                tokens = min(self.burst, entry[0] + (now - entry[1]) * self.rate)
+            if tokens < 1:
+                self._stats['limited'] += 1
+                return (1 - tokens) / self.rate if self.rate > 0 else self.refill_time
+            self._buckets[key] = (tokens - 1, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                # dropping a bucket refills it, so only the least recently used go
+                self._buckets.popitem(last=False)
+                self._stats['evictions'] += 1
+            self._stats['allowed'] += 1
+            return 0.0
+
+    def evict(self):
+        cutoff = time.monotonic() - self.refill_time
+        with self._lock:
+            while self._buckets:
+                key, (tokens, updated) = next(iter(self._buckets.items()))
+                if updated > cutoff:
+                    break
+                del self._buckets[key]
+                self._stats['evictions'] += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'per_minute': round(self.rate * 60, 3),
+                'burst': self.burst,
+                'keys': len(self._buckets),
+                **self._stats,
+            }
+
+
+def _buckets(name, per_minute, burst):
+    return TokenBuckets(config.getfloat('ratelimit', f'{name}_per_minute', fallback=per_minute),
+                        config.getint('ratelimit', f'{name}_burst', fallback=burst))
+
+
+# every login and signup attempt costs a password hash, so each is admitted by both the
+# client address and the username it is for
+limiters = {
+    'login': (_buckets('login_ip', 30, 20), _buckets('login_user', 10, 5)),
+    'signup': (_buckets('signup_ip', 5, 5), _buckets('signup_user', 2, 2)),
+}
+
+_evictor = None
+_evictor_lock = threading.Lock()
+_stop = threading.Event()
+
+
+def admit(action, address, username):
+    # 0 when the attempt may proceed, else the seconds the client should wait
+    if not ENABLED:
+        return 0.0
+    by_address, by_username = limiters[action]
+    retry_after = by_address.take(address or '')
+    if retry_after:
+        return retry_after
+    return by_username.take(username)
+
+
+def _evict_idle():
+    while not _stop.wait(EVICT_INTERVAL):
+        try:
+            for by_address, by_username in limiters.values():
+                by_address.evict()
+                by_username.evict()
+        except Exception as e:
+            print(f"An error occurred while evicting rate limit buckets: {e}")
+
+
+def start():
+    global _evictor
+    with _evictor_lock:
+        if _evictor is None or not _evictor.is_alive():
+            _stop.clear()
+            _evictor = threading.Thread(target=_evict_idle, name='ratelimit-evictor', daemon=True)
+            _evictor.start()
+
+
+def stop():
+    _stop.set()
+
+
+def stats():
+    return {
+        f'{action}_{kind}': limiter.stats()
+        for action, pair in limiters.items()
+        for kind, limiter in zip(('ip', 'user'), pair)
+    }
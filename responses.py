@@ -0,0 +1,77 @@
+import json
+
+from flask import jsonify
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# orjson.Fragment (orjson 3.9+) embeds the pre-encoded rows; older versions get the dicts
+FRAGMENTS = hasattr(orjson, 'Fragment')
+
+
+# Rows of a query, serialized as a list of objects keyed by columns.
+# With orjson 3.9+ the keys are encoded once per result and every row is filled into a byte
+# template, so no dict is built per row.
+class Rows:
+    __slots__ = ('columns', 'rows')
+
+    def __init__(self, columns, rows):
+        self.columns = tuple(columns)
+        self.rows = rows or []
+
+    def __len__(self):
+        return len(self.rows)
+
+    def encode(self):
+        template = b'{' + b','.join(orjson.dumps(column) + b':%b' for column in self.columns) + b'}'
+        encode = orjson.dumps
+        return b'[' + b','.join([template % tuple(map(encode, row)) for row in self.rows]) + b']'
+
+    def to_list(self):
+        return [dict(zip(self.columns, row)) for row in self.rows]
+
+
+def _default(obj):
+    if isinstance(obj, Rows):
+        return orjson.Fragment(obj.encode()) if FRAGMENTS else obj.to_list()
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(obj):
+    # compact UTF-8 JSON as bytes
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, default=_default, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+def loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def result(payload, code):
+    # (payload, code) of a model function: data is sent as is, messages as {'message': ...}
+    if isinstance(payload, str):
+        payload = {'message': payload}
+    return jsonify(payload), code
+
+
+# Every jsonify() and every dict or list returned by a view goes through here.
+class JSONProvider(DefaultJSONProvider):
+    compact = True
+
+    def dumps(self, obj, **kwargs):
+        return dumps(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps(obj), mimetype=self.mimetype)
@@ -0,0 +1,421 @@
+import datetime
+import re
+from collections import namedtuple
+from functools import wraps
+
+from flask import jsonify, request
+
+import responses
+from availability import TIME_FORMAT, parse_time_of_day
+from models.groups import POST_TYPES
+from models.room_reservation import FREQUENCIES
+from models.votes import OPINIONS
+
+ANY = object
+
+
+class ValidationError(ValueError):
+    pass
+
+
+# One request parameter. kind is str, int, bool, list (of `items`), ANY, 'timestamp'
+# (TIME_FORMAT), 'date' (YYYY-mm-dd), 'time' (HH:MM or HH:MM:SS), a nested Schema, which
+# decodes to a dict, or a tuple of str and list, picked by the type of the value.
+# key is the name in the request when it differs from the attribute name.
+class Field:
+    def __init__(self, kind=str, required=False, default=None, min_length=None, max_length=None,
+                 pattern=None, choices=None, minimum=None, maximum=None, items=None, key=None):
+        self.kind = kind
+        self.required = required
+        self.default = default
+        self.min_length = min_length
+        self.max_length = max_length
+        self.pattern = re.compile(pattern) if pattern else None
+        self.choices = frozenset(choices) if choices is not None else None
+        self.minimum = minimum
+        self.maximum = maximum
+        self.items = items
+        self.key = key
+
+
+_INTEGER = re.compile(r'-?\d+')
+_TIME_OF_DAY = re.compile(r'\d{2}:\d{2}(:\d{2})?')
+_ALTERNATIVES = {str: 'a string', list: 'a list'}
+_TRUE = frozenset(('1', 'true', 'yes', 'on'))
+_FALSE = frozenset(('0', 'false', 'no', 'off'))
+
+
+def _fail(name, reason):
+    raise ValidationError(f"Invalid {name}: {reason}")
+
+
+def _to_str(name, value, query):
+    if not isinstance(value, str):
+        _fail(name, "expected a string")
+    return value
+
+
+def _to_int(name, value, query):
+    # numeric strings are accepted from JSON bodies too, ids have always been sent both ways
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    if isinstance(value, str) and _INTEGER.fullmatch(value.strip()):
+        return int(value)
+    _fail(name, "expected an integer")
+
+
+def _to_bool(name, value, query):
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, int) and value in (0, 1):
+        return bool(value)
+    if isinstance(value, str) and value.lower() in _TRUE:
+        return True
+    if isinstance(value, str) and value.lower() in _FALSE:
+        return False
+    _fail(name, "expected a boolean")
+
+
+def _to_timestamp(name, value, query):
+    try:
+        datetime.datetime.strptime(value, TIME_FORMAT)
+    except (TypeError, ValueError):
+        _fail(name, "expected YYYY-mm-dd HH:MM:SS")
+    return value
+
+
+def _to_date(name, value, query):
+    try:
+        datetime.date.fromisoformat(value)
+    except (TypeError, ValueError):
+        _fail(name, "expected YYYY-mm-dd")
+    return value
+
+
+def _to_time_of_day(name, value, query):
+    # read by the availability grid with the same parser; '24:00' is the end of the day
+    try:
+        if not _TIME_OF_DAY.fullmatch(value) or (value.startswith('24:') and value not in ('24:00', '24:00:00')):
+            raise ValueError(value)
+        parse_time_of_day(value, None)
+    except (TypeError, ValueError):
+        _fail(name, "expected HH:MM or HH:MM:SS")
+    return value
+
+
+_CONVERTERS = {
+    str: _to_str,
+    int: _to_int,
+    bool: _to_bool,
+    'timestamp': _to_timestamp,
+    'date': _to_date,
+    'time': _to_time_of_day,
+}
+
+
+def _compile(name, field, query):
+    # builds the converter of one field, running only the checks it declares
+    checks = []
+    if isinstance(field.kind, Schema):
+        nested = field.kind._decoders[query]
+
+        def convert(value):
+            if not isinstance(value, dict):
+                _fail(name, "expected an object")
+            return nested(value, f"{name}.")._asdict()
+        checks.append(convert)
+    elif isinstance(field.kind, tuple):
+        alternatives = [(kind, _compile(name, Field(kind, items=field.items), query)) for kind in field.kind]
+        expected = ' or '.join(_ALTERNATIVES[kind] for kind in field.kind)
+
+        def convert(value):
+            for kind, alternative in alternatives:
+                if isinstance(value, kind):
+                    return alternative(value)
+            _fail(name, f"expected {expected}")
+        checks.append(convert)
+    elif field.kind is list:
+        item = _compile(f"{name}[]", field.items, query) if field.items is not None else None
+
+        def convert(value):
+            if query and isinstance(value, list) and len(value) == 1:
+                # ?days=1,2,3 as well as ?days=1&days=2&days=3
+                value = [part for part in value[0].split(',') if part]
+            if not isinstance(value, list):
+                _fail(name, "expected a list")
+            if item is None:
+                return value
+            converted = []
+            for n, element in enumerate(value):
+                try:
+                    converted.append(item(element))
+                except ValidationError as e:
+                    raise ValidationError(str(e).replace(f"{name}[]", f"{name}[{n}]", 1)) from None
+            return converted
+        checks.append(convert)
+    elif field.kind is not ANY:
+        to_kind = _CONVERTERS[field.kind]
+        checks.append(lambda value: to_kind(name, value, query))
+    if field.min_length is not None or field.max_length is not None:
+        low = field.min_length or 0
+        high = field.max_length if field.max_length is not None else float('inf')
+
+        def check_length(value):
+            if not low <= len(value) <= high:
+                _fail(name, f"length must be between {low} and {high}" if field.max_length is not None else f"length must be at least {low}")
+            return value
+        checks.append(check_length)
+    if field.pattern is not None:
+        pattern = field.pattern
+
+        def check_pattern(value):
+            if not pattern.fullmatch(value):
+                _fail(name, "invalid format")
+            return value
+        checks.append(check_pattern)
+    if field.choices is not None:
+        choices = field.choices
+
+        def check_choice(value):
+            if value not in choices:
+                _fail(name, f"must be one of {', '.join(sorted(map(str, choices)))}")
+            return value
+        checks.append(check_choice)
+    if field.minimum is not None or field.maximum is not None:
+        minimum, maximum = field.minimum, field.maximum
+
+        def check_range(value):
+            if (minimum is not None and value < minimum) or (maximum is not None and value > maximum):
+                _fail(name, f"must be between {minimum} and {maximum}" if maximum is not None else f"must be at least {minimum}")
+            return value
+        checks.append(check_range)
+
+    if len(checks) == 1:
+        return checks[0]
+
+    def run(value):
+        for check in checks:
+            value = check(value)
+        return value
+    return run
+
+
+# Declarative request schema: Schema('Login', username=Field(str, required=True), ...).
+# Fields are compiled once into converters; decode() walks them in a single pass and
+# returns a namedtuple, or raises ValidationError naming the first invalid field.
+class Schema:
+    def __init__(self, name, /, **fields):
+        self.name = name
+        self.fields = fields
+        self.type = namedtuple(name, fields)
+        # JSON bodies and query strings differ in how lists and empty values arrive
+        self._decoders = {False: self._build(False), True: self._build(True)}
+
+    def _build(self, query):
+        steps = []
+        for attribute, field in self.fields.items():
+            key = field.key or attribute
+            steps.append((key, field.kind is list, field.required, field.default, _compile(key, field, query)))
+        steps = tuple(steps)
+        make = self.type._make
+
+        def decode(source, prefix=''):
+            values = []
+            for key, is_list, required, default, convert in steps:
+                if query:
+                    value = source.getlist(key) if is_list else source.get(key)
+                    if value == '' or value == []:
+                        value = None
+                else:
+                    value = source.get(key)
+                if value is None:
+                    if required:
+                        raise ValidationError(f"Missing required field: {prefix}{key}")
+                    values.append(default)
+                else:
+                    try:
+                        values.append(convert(value))
+                    except ValidationError as e:
+                        if not prefix:
+                            raise
+                        raise ValidationError(str(e).replace("Invalid ", f"Invalid {prefix}", 1)) from None
+            return make(values)
+        return decode
+
+    def decode(self, data):
+        return self._decoders[False](data)
+
+    def decode_query(self, args):
+        return self._decoders[True](args)
+
+
+def body(schema):
+    # decodes and validates the JSON body before the view runs; the view gets the result
+    def decorator(f):
+        @wraps(f)
+        async def decorated_function(*args, **kwargs):
+            try:
+                data = responses.loads(request.get_data() or b'{}')
+            except ValueError:
+                return jsonify({'error': 'Invalid JSON payload'}), 400
+            if not isinstance(data, dict):
+                return jsonify({'error': 'Invalid JSON payload'}), 400
+            try:
+                params = schema.decode(data)
+            except ValidationError as e:
+                return jsonify({'error': str(e)}), 400
+            return await f(params, *args, **kwargs)
+        return decorated_function
+    return decorator
+
+
+def query(schema):
+    # same for the query string of GET endpoints
+    def decorator(f):
+        @wraps(f)
+        async def decorated_function(*args, **kwargs):
+            try:
+                params = schema.decode_query(request.args)
+            except ValidationError as e:
+                return jsonify({'error': str(e)}), 400
+            return await f(params, *args, **kwargs)
+        return decorated_function
+    return decorator
+
+
+USERNAME = Field(str, required=True, min_length=1, max_length=20)
+PASSWORD = Field(str, required=True, min_length=1, max_length=256)
+ID = Field(int, required=True, minimum=1)
+TIMESTAMP = Field('timestamp', required=True)
+TIME_OF_DAY = Field('time')
+WEEKDAYS = Field(list, items=Field(int, minimum=1, maximum=7), max_length=7)
+NAMES = Field(list, items=Field(str, max_length=20))
+PERIODS = Field(list, items=Field(list, items=Field('timestamp'), min_length=2, max_length=2))
+
+SIGNUP = Schema(
+    'Signup',
+    username=Field(str, required=True, min_length=4, max_length=20, pattern=r'[a-zA-Z0-9_]+'),
+    password=PASSWORD,
+    email=Field(str, required=True, max_length=254, pattern=r'[^@]+@[^@]+\.[^@]+'),
+)
+LOGIN = Schema('Login', username=USERNAME, password=PASSWORD)
+MODIFY_USER = Schema(
+    'ModifyUser',
+    target_username=USERNAME,
+    action=Field(str, required=True, choices=('update', 'delete', 'deactivate', 'activate')),
+    password=Field(str, min_length=1, max_length=256),
+    bio=Field(str, max_length=1000),
+    admin=Field(bool, default=False),
+)
+USER_GROUPS = Schema('UserGroups', username=Field(str, max_length=20))
+
+CREATE_GROUP = Schema(
+    'CreateGroup',
+    group_name=Field(str, required=True, min_length=1, max_length=50),
+    admin=Field(str, required=True, min_length=1, max_length=20),
+    not_public=Field(bool, default=False),
+    can_post_announcements=NAMES,
+    can_post_assessment=NAMES,
+    can_post_pull=NAMES,
+    can_post_room_reservation=NAMES,
+    members=NAMES,
+)
+MODIFY_GROUP = Schema('ModifyGroup', group_id=ID, action=Field(str, required=True, max_length=50), subject=Field((str, list), min_length=1, items=Field(str, min_length=1, max_length=20)))
+GROUP = Schema('Group', group_id=ID)
+
+CREATE_POST = Schema(
+    'CreatePost',
+    title=Field(str, required=True, min_length=1, max_length=200),
+    content=Field(str, required=True, max_length=100000),
+    post_type=Field(str, required=True, choices=POST_TYPES),
+    permission=Field(str, pattern=r'\s*\d+(\s*,\s*\d+)*\s*'),
+    post_as=ID,
+    start_at=Field('timestamp'),
+    end_at=Field('timestamp'),
+    label=Field(str, required=True, max_length=50),
+)
+GET_POSTS = Schema(
+    'GetPosts',
+    post_type=Field(str, required=True, choices=POST_TYPES),
+    cursor=Field(str, max_length=200),
+    page_size=Field(int, minimum=1),
+    view_type=Field(str, default='public', choices=('public', 'my', 'user', 'group')),
+    id=Field(str, max_length=50),
+    admin=Field(bool, default=False),
+)
+POST = Schema('Post', post_id=ID)
+VOTE = Schema('Vote', post_id=ID, vote=Field(str, required=True, choices=OPINIONS))
+MODIFY_POST = Schema(
+    'ModifyPost',
+    post_id=ID,
+    action=Field(str, required=True, choices=('edit', 'delete')),
+    title=Field(str, max_length=200),
+    content=Field(str, max_length=100000),
+    label=Field(str, max_length=50),
+    permission=Field(list, items=Field(int, minimum=1)),
+)
+TIMELINE = Schema('Timeline', start=Field('timestamp', key='from'), end=Field('timestamp', key='to'))
+
+CREATE_ROOM = Schema(
+    'CreateRoom',
+    name=Field(str, required=True, min_length=1, max_length=100),
+    open_time=TIME_OF_DAY,
+    close_time=TIME_OF_DAY,
+    available_days=WEEKDAYS,
+    unavailable_periods=PERIODS,
+)
+MODIFY_ROOM = Schema(
+    'ModifyRoom',
+    room_id=ID,
+    action=Field(str, required=True, choices=('update', 'delete', 'deactivate', 'activate')),
+    name=Field(str, min_length=1, max_length=100),
+    open_time=TIME_OF_DAY,
+    close_time=TIME_OF_DAY,
+    available_days=WEEKDAYS,
+    unavailable_periods=PERIODS,
+)
+GET_ROOMS = Schema('GetRooms', admin=Field(bool, default=False))
+ROOMS_BY_TIME = Schema('RoomsByTime', start_time=TIMESTAMP, end_time=TIMESTAMP)
+TIMES_BY_ROOM = Schema('TimesByRoom', room_id=ID, start_time=TIMESTAMP, end_time=TIMESTAMP)
+GET_RESERVATIONS = Schema(
+    'GetReservations',
+    start_time=TIMESTAMP,
+    end_time=TIMESTAMP,
+    room_id=Field(int, minimum=1),
+    user=Field(str, max_length=20),
+    admin=Field(bool, default=False),
+)
+RESERVE_ROOM = Schema(
+    'ReserveRoom',
+    room_id=ID,
+    for_group=ID,
+    reason=Field(str, max_length=500),
+    start_time=TIMESTAMP,
+    end_time=TIMESTAMP,
+)
+RESERVATION_ITEM = Schema('ReservationItem', room_id=ID, start_time=TIMESTAMP, end_time=TIMESTAMP)
+RESERVE_ROOMS = Schema(
+    'ReserveRooms',
+    for_group=ID,
+    reason=Field(str, max_length=500),
+    items=Field(list, required=True, min_length=1, items=Field(RESERVATION_ITEM)),
+)
+RESERVE_ROOM_RECURRING = Schema(
+    'ReserveRoomRecurring',
+    room_id=ID,
+    for_group=ID,
+    reason=Field(str, max_length=500),
+    start_time=TIMESTAMP,
+    end_time=TIMESTAMP,
+    frequency=Field(str, default='weekly', choices=FREQUENCIES),
+    weekdays=WEEKDAYS,
+    until=Field('date'),
+    count=Field(int, minimum=1),
+)
+RESERVATION = Schema('Reservation', reservation_id=ID)
+APPROVE_RESERVATION = Schema(
+    'ApproveReservation',
+    reservation_id=ID,
+    action=Field(str, required=True, choices=('approve', 'reject')),
+    reason=Field(str, max_length=500),
+)
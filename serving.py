@@ -0,0 +1,104 @@
+import asyncio
+import concurrent.futures
+import contextvars
+import inspect
+import threading
+from functools import wraps
+
+from flask import Flask
+
+_startup = []
+_shutdown = []
+_loop = None
+_loop_thread = None
+_loop_lock = threading.Lock()
+
+
+def on_startup(fn):
+    _startup.append(fn)
+    return fn
+
+
+def on_shutdown(fn):
+    _shutdown.append(fn)
+    return fn
+
+
+# The single event loop of this worker. Under an ASGI server it is the server's loop,
+# otherwise a daemon thread runs one for the lifetime of the process.
+def use_loop(loop):
+    global _loop
+    with _loop_lock:
+        _loop = loop
+
+
+def get_loop():
+    global _loop, _loop_thread
+    with _loop_lock:
+        if _loop is None or _loop.is_closed():
+            _loop = asyncio.new_event_loop()
+            _loop_thread = threading.Thread(target=_loop.run_forever, name='event-loop', daemon=True)
+            _loop_thread.start()
+        return _loop
+
+
+def run_coroutine(coro, loop=None, context=None):
+    # like asyncio.run_coroutine_threadsafe, but the task runs in a copy of the caller's
+    # context, so Flask's request and app contexts are visible to the coroutine
+    loop = loop or get_loop()
+    context = context or contextvars.copy_context()
+    future = concurrent.futures.Future()
+
+    def done(task):
+        if task.cancelled():
+            future.set_exception(concurrent.futures.CancelledError())
+        elif task.exception() is not None:
+            future.set_exception(task.exception())
+        else:
+            future.set_result(task.result())
+
+    def start():
+        if not future.set_running_or_notify_cancel():
+            coro.close()
+            return
+        context.run(loop.create_task, coro).add_done_callback(done)
+
+    loop.call_soon_threadsafe(start)
+    return future
+
+
+def run(coro):
+    loop = get_loop()
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is loop:
+        raise RuntimeError("Cannot block on a coroutine from the worker's own event loop")
+    return run_coroutine(coro, loop).result()
+
+
+async def _run_hooks(hooks):
+    for hook in hooks:
+        result = hook()
+        if inspect.isawaitable(result):
+            await result
+
+
+async def startup():
+    await _run_hooks(_startup)
+
+
+async def shutdown():
+    # in reverse, so services stop before what they depend on
+    await _run_hooks(reversed(_shutdown))
+
+
+# Flask runs every async view through a new event loop by default; here they all run on
+# the worker's loop while the request thread waits for the result.
+class AsyncFlask(Flask):
+    def async_to_sync(self, func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            return run(func(*args, **kwargs))
+        return wrapper
@@ -0,0 +1,78 @@
+import configparser
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Every module reads config.conf and opens the database relative to the working directory,
+# so the suite runs in a scratch directory with its own database and a copy of the config
+# in which mail cannot leave the machine and votes are only flushed by the tests.
+WORKDIR = tempfile.mkdtemp(prefix='asite-tests-')
+_config = configparser.ConfigParser()
+_config.read(os.path.join(ROOT, 'config.conf'))
+_config.set('email', 'smtp_server', '127.0.0.1')
+_config.set('email', 'smtp_port', '9')
+_config.set('posts', 'vote_flush_interval', '3600')
+_config.set('posts', 'vote_flush_threshold', '1000000')
+with open(os.path.join(WORKDIR, 'config.conf'), 'w') as f:
+    _config.write(f)
+os.chdir(WORKDIR)
+
+
+@pytest.fixture(scope='session', autouse=True)
+def workdir():
+    yield WORKDIR
+    shutil.rmtree(WORKDIR, ignore_errors=True)
+
+
+@pytest.fixture(scope='session')
+def app():
+    import main
+    import serving
+    serving.run(serving.startup())
+    yield main
+    serving.run(serving.shutdown())
+
+
+@pytest.fixture
+def run(app):
+    # runs a coroutine on the worker's event loop, like a request does
+    import serving
+    return serving.run
+
+
+@pytest.fixture
+def db(app):
+    conn = sqlite3.connect(app.DATABASE_PATH, check_same_thread=False)
+    yield conn
+    conn.close()
+
+
+_users = iter(range(1, 1000000))
+
+
+@pytest.fixture
+def make_user(app, db, run):
+    # a confirmed user with a session; returns (username, session_id)
+    def make_user(prefix='user'):
+        username = f"{prefix}{next(_users)}"
+        db.execute("INSERT INTO users (username, email, password) VALUES (?, ?, 'x')", (username, f"{username}@example.com"))
+        db.commit()
+        return username, run(app.sessions.create(username))
+    return make_user
+
+
+@pytest.fixture
+def room_admin(app, db, make_user):
+    # the session of a room administrator
+    username, session_id = make_user('roomadmin')
+    db.execute("INSERT OR IGNORE INTO user_groups (id, name) VALUES (?, 'room admins')", (int(app.ROOM_ADMIN),))
+    db.execute("INSERT INTO group_members (group_id, username, role) VALUES (?, ?, 'admin')", (int(app.ROOM_ADMIN), username))
+    db.commit()
+    return session_id
@@ -0,0 +1,20 @@
+from werkzeug.wrappers import Request
+
+import asgi
+
+
+def scope(headers):
+    return {
+        'type': 'http', 'method': 'GET', 'path': '/', 'query_string': b'',
+        'headers': [(name.encode(), value.encode()) for name, value in headers],
+    }
+
+
+def test_repeated_headers_are_joined():
+    environ = asgi.app._environ(scope([
+        ('cookie', 'session_id=abc'), ('cookie', 'theme=dark'),
+        ('accept', 'text/html'), ('accept', 'application/json'),
+    ]), b'')
+    assert environ['HTTP_COOKIE'] == 'session_id=abc; theme=dark'
+    assert environ['HTTP_ACCEPT'] == 'text/html,application/json'
+    assert Request(environ).cookies.to_dict() == {'session_id': 'abc', 'theme': 'dark'}
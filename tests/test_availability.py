@@ -0,0 +1,131 @@
+import datetime
+import random
+
+import pytest
+
+import availability
+from availability import DAY_SECONDS, AvailabilityGrid, Room, days_mask
+
+MONDAY = datetime.datetime(2030, 1, 7)
+
+
+def at(day, hour, minute=0):
+    return MONDAY + datetime.timedelta(days=day, hours=hour, minutes=minute)
+
+
+def hours(value):
+    return value * 3600
+
+
+@pytest.fixture(params=['numpy', 'pure'])
+def vectorized(request, monkeypatch):
+    if request.param == 'numpy':
+        if availability.numpy is None:
+            pytest.skip("numpy is not installed")
+    else:
+        monkeypatch.setattr(availability, 'numpy', None)
+    return request.param
+
+
+def make_grid():
+    rooms = [
+        Room(1, 'day room', hours(8), hours(20), days_mask(range(2, 7))),  # Monday to Friday
+        Room(2, 'always open', 0, DAY_SECONDS, days_mask(range(1, 8))),
+        Room(3, 'odd hours', hours(9) + 600, hours(17) + 1200, days_mask(range(1, 8))),
+    ]
+    return AvailabilityGrid(rooms, slot_minutes=15)
+
+
+def test_opening_hours_edges(vectorized):
+    grid = make_grid()
+    assert grid.is_free(1, at(0, 8), at(0, 9))
+    assert grid.is_free(1, at(0, 19), at(0, 20))
+    assert not grid.is_free(1, at(0, 7, 30), at(0, 8, 30))
+    assert not grid.is_free(1, at(0, 19, 30), at(0, 20, 30))
+    # opening times that are not on a slot boundary
+    assert grid.free_rooms(at(0, 9, 10), at(0, 9, 40)) == [1, 2, 3]
+    assert grid.free_rooms(at(0, 9, 5), at(0, 9, 40)) == [1, 2]
+
+
+def test_closed_weekdays(vectorized):
+    grid = make_grid()
+    saturday = 5
+    assert not grid.is_free(1, at(saturday, 10), at(saturday, 11))
+    assert grid.free_rooms(at(saturday, 10), at(saturday, 11)) == [2, 3]
+    assert grid.free_intervals(1, at(saturday, 0), at(saturday + 1, 0)) == []
+
+
+def test_window_across_midnight(vectorized):
+    grid = make_grid()
+    assert grid.is_free(2, at(0, 23), at(1, 1))
+    assert not grid.is_free(1, at(0, 19), at(1, 9))
+    # free until midnight and from midnight on is one interval
+    assert grid.free_intervals(2, at(0, 22), at(1, 2)) == [(at(0, 22), at(1, 2))]
+
+
+def test_reservations_and_blackouts(vectorized):
+    grid = make_grid()
+    grid.blackouts.add(1, 'blackout', at(0, 12), at(0, 13))
+    grid.add(1, 10, at(0, 9), at(0, 10))
+    grid.add(1, 11, at(0, 10), at(0, 11))
+    assert not grid.is_free(1, at(0, 12, 30), at(0, 12, 45))
+    assert not grid.is_free(1, at(0, 10, 59), at(0, 11, 30))
+    assert grid.is_free(1, at(0, 11), at(0, 12))
+    # touching reservations are merged, the blackout splits the afternoon
+    assert grid.free_intervals(1, at(0, 0), at(1, 0)) == [
+        (at(0, 8), at(0, 9)),
+        (at(0, 11), at(0, 12)),
+        (at(0, 13), at(0, 20)),
+    ]
+    assert grid.free_intervals(1, at(0, 9, 30), at(0, 12, 30)) == [(at(0, 11), at(0, 12))]
+
+
+def test_edge_slots_are_checked_exactly(vectorized):
+    # a reservation ending inside a slot leaves the rest of that slot bookable
+    grid = make_grid()
+    grid.add(2, 20, at(0, 10), at(0, 10, 5))
+    assert 2 not in grid.free_rooms(at(0, 10), at(0, 10, 10))
+    assert 2 in grid.free_rooms(at(0, 10, 5), at(0, 10, 15))
+    assert 2 in grid.free_rooms(at(0, 9, 50), at(0, 10))
+
+
+def test_updates_after_a_day_was_built(vectorized):
+    grid = make_grid()
+    assert grid.free_rooms(at(0, 10), at(0, 11)) == [1, 2, 3]
+    grid.add(1, 30, at(0, 10), at(0, 11))
+    assert grid.free_rooms(at(0, 10), at(0, 11)) == [2, 3]
+    # moving a reservation releases its old slots
+    grid.add(1, 30, at(0, 14), at(0, 15))
+    assert grid.free_rooms(at(0, 10), at(0, 11)) == [1, 2, 3]
+    assert grid.free_rooms(at(0, 14), at(0, 15)) == [2, 3]
+    grid.remove(30)
+    assert grid.free_rooms(at(0, 14), at(0, 15)) == [1, 2, 3]
+
+
+def test_free_rooms_matches_exact_checks(vectorized):
+    rng = random.Random(7)
+    grid = make_grid()
+    for reservation_id in range(200):
+        room_id = rng.choice([1, 2, 3])
+        start = at(rng.randrange(7), rng.randrange(24), rng.randrange(0, 60, 5))
+        grid.add(room_id, reservation_id, start, start + datetime.timedelta(minutes=rng.randrange(5, 180, 5)))
+        if rng.random() < 0.2:
+            grid.remove(rng.randrange(reservation_id + 1))
+    for _ in range(300):
+        start = at(rng.randrange(7), rng.randrange(24), rng.randrange(0, 60, 5))
+        end = start + datetime.timedelta(minutes=rng.randrange(5, 240, 5))
+        assert grid.free_rooms(start, end) == [room_id for room_id in (1, 2, 3) if grid.is_free(room_id, start, end)]
+
+
+def test_rooms_by_time_checks_the_range(app, make_user):
+    username, session_id = make_user()
+    client = app.app.test_client()
+    client.set_cookie('session_id', session_id)
+
+    def rooms(start, end):
+        response = client.get(f'/get_available_rooms_by_time?start_time={start}&end_time={end}')
+        return response.status_code, response.get_json()
+    assert rooms('2030-01-07 11:00:00', '2030-01-07 10:00:00') == (400, {'message': 'Invalid time range'})
+    assert rooms('2030-01-07 10:00:00', '2030-01-07 10:00:00') == (400, {'message': 'Invalid time range'})
+    assert rooms('2030-01-07 10:00:00', '2040-01-07 10:00:00')[0] == 400
+    assert rooms('2030-01-07 10:00:00', '2030-01-07 11:00:00')[0] == 200
@@ -0,0 +1,61 @@
+import datetime
+
+from intervals import IntervalIndex
+
+
+def at(hour, minute=0):
+    return datetime.datetime(2030, 1, 7, hour, minute)
+
+
+def test_touching_intervals_do_not_overlap():
+    index = IntervalIndex()
+    index.add(1, 'a', at(10), at(11))
+    assert not index.has_overlap(1, at(11), at(12))
+    assert not index.has_overlap(1, at(9), at(10))
+    assert index.overlapping(1, at(11), at(12)) == []
+    assert index.has_overlap(1, at(10, 59), at(11, 30))
+
+
+def test_long_interval_found_from_a_window_it_covers():
+    # the window starts long after the long interval does, behind a shorter one
+    index = IntervalIndex()
+    index.add(1, 'long', at(8), at(12))
+    index.add(1, 'short', at(11), at(11, 15))
+    assert [entry[2] for entry in index.overlapping(1, at(11, 30), at(11, 45))] == ['long']
+    assert index.has_overlap(1, at(11, 30), at(11, 45))
+
+
+def test_keys_are_independent():
+    index = IntervalIndex()
+    index.add(1, 'a', at(10), at(11))
+    assert not index.has_overlap(2, at(10), at(11))
+    assert index.overlapping(3, at(0), at(23)) == []
+
+
+def test_add_with_the_same_id_moves_the_interval():
+    index = IntervalIndex()
+    index.add(1, 'a', at(10), at(11))
+    index.add(2, 'a', at(14), at(15))
+    assert len(index) == 1
+    assert not index.has_overlap(1, at(10), at(11))
+    assert index.get('a') == (2, at(14), at(15))
+
+
+def test_remove():
+    index = IntervalIndex()
+    index.add(1, 'a', at(8), at(12))
+    index.add(1, 'b', at(12), at(13))
+    assert index.remove('a')
+    assert not index.remove('a')
+    assert not index.has_overlap(1, at(9), at(10))
+    assert index.overlapping(1, at(8), at(23)) == [(at(12), at(13), 'b')]
+    assert index.items() == {'b': (1, at(12), at(13))}
+
+
+def test_identical_intervals_are_kept_apart():
+    index = IntervalIndex()
+    index.add(1, 'a', at(10), at(11))
+    index.add(1, 'b', at(10), at(11))
+    assert sorted(entry[2] for entry in index.overlapping(1, at(10), at(11))) == ['a', 'b']
+    index.remove('a')
+    assert index.overlapping(1, at(10), at(11)) == [(at(10), at(11), 'b')]
@@ -0,0 +1,85 @@
+import sqlite3
+from contextlib import closing
+
+import pytest
+
+import init
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'database.sqlite3')
+
+
+def version(path):
+    with closing(sqlite3.connect(path)) as db:
+        return init.get_schema_version(db)
+
+
+def test_new_database(path):
+    applied = init.initialize_database(path)
+    assert applied == [migration.__name__ for migration in init.MIGRATIONS]
+    assert version(path) == len(init.MIGRATIONS)
+    assert init.initialize_database(path) == []
+    with closing(sqlite3.connect(path)) as db:
+        assert db.execute("PRAGMA journal_mode").fetchone()[0] == 'wal'
+
+
+def test_every_hot_query_uses_an_index(path):
+    init.initialize_database(path)
+    with closing(sqlite3.connect(path)) as db:
+        assert init.check_query_plans(db) == []
+
+
+def test_unversioned_database_from_before_migrations(path):
+    # the schema and data layout of databases created before user_version was used
+    with closing(sqlite3.connect(path)) as db:
+        db.execute('''
+            CREATE TABLE user_groups (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL UNIQUE,
+                admin TEXT,
+                member TEXT,
+                can_post_announcement TEXT,
+                can_post_assessment TEXT,
+                can_post_pull TEXT,
+                can_post_room_reservation TEXT,
+                not_public INTEGER DEFAULT 0
+            )
+        ''')
+        init.create_base_schema(db)
+        db.execute("DROP TABLE group_members")
+        db.execute("INSERT INTO user_groups (id, name, admin, member, can_post_announcement, can_post_room_reservation) VALUES (1, 'admins', 'root', 'alice,bob', 'alice', 'bob, carol')")
+        db.execute("INSERT INTO users (username, password, email, following_posts) VALUES ('alice', 'x', 'a@example.com', '1,2,x')")
+        db.execute("INSERT INTO posts (id, title, content, author, type, label, permission, post_as) VALUES (1, 't', 'c', 1, 'pull', 'l', '1,2', '1')")
+        db.execute("INSERT INTO rooms (id, name, available_days, unavailable_periods) VALUES (1, 'r', '2,3,9', '2030-01-07 10:00:00-2030-01-07 12:00:00,garbage')")
+        db.commit()
+        assert init.get_schema_version(db) == 0
+
+    init.initialize_database(path)
+    assert version(path) == len(init.MIGRATIONS)
+    with closing(sqlite3.connect(path)) as db:
+        assert [row[1] for row in db.execute("PRAGMA table_info(user_groups)")] == ['id', 'name', 'not_public']
+        members = db.execute("SELECT username, role, can_post_announcement, can_post_room_reservation FROM group_members WHERE group_id = 1 ORDER BY username").fetchall()
+        assert members == [('alice', 'member', 1, 0), ('bob', 'member', 0, 1), ('carol', 'member', 0, 1), ('root', 'admin', 0, 0)]
+        assert db.execute("SELECT post_type FROM posts").fetchone() == ('pull',)
+        assert db.execute("SELECT post_id, group_id FROM post_permissions ORDER BY group_id").fetchall() == [(1, 1), (1, 2)]
+        assert db.execute("SELECT post_id FROM post_followers WHERE username = 'alice' ORDER BY post_id").fetchall() == [(1,), (2,)]
+        # weekdays 2 and 3; 9 is not a weekday
+        assert db.execute("SELECT available_days_mask FROM rooms").fetchone() == (0b110,)
+        assert db.execute("SELECT room_id, start_time, end_time FROM room_blackouts").fetchall() == [(1, '2030-01-07 10:00:00', '2030-01-07 12:00:00')]
+        assert init.check_query_plans(db) == []
+
+
+def test_failed_migration_is_rolled_back(path, monkeypatch):
+    init.initialize_database(path)
+
+    def broken(db):
+        db.execute("CREATE TABLE half_done (id INTEGER)")
+        raise sqlite3.OperationalError("boom")
+    monkeypatch.setattr(init, 'MIGRATIONS', init.MIGRATIONS + [broken])
+    with pytest.raises(sqlite3.OperationalError):
+        init.migrate_database(path)
+    assert version(path) == len(init.MIGRATIONS) - 1
+    with closing(sqlite3.connect(path)) as db:
+        assert db.execute("SELECT name FROM sqlite_master WHERE name = 'half_done'").fetchone() is None
@@ -0,0 +1,92 @@
+import pytest
+
+import ratelimit
+from ratelimit import TokenBuckets
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ratelimit, 'time', clock)
+    return clock
+
+
+def test_burst_then_refill(clock):
+    buckets = TokenBuckets(per_minute=6, burst=3)
+    assert [buckets.take('a') for _ in range(3)] == [0.0, 0.0, 0.0]
+    # one token every 10 seconds
+    assert buckets.take('a') == pytest.approx(10)
+    clock.now += 4
+    assert buckets.take('a') == pytest.approx(6)
+    clock.now += 6
+    assert buckets.take('a') == 0.0
+    assert buckets.take('a') == pytest.approx(10)
+    # keys are independent
+    assert buckets.take('b') == 0.0
+
+
+def test_refill_is_capped_at_burst(clock):
+    buckets = TokenBuckets(per_minute=60, burst=2)
+    clock.now += 3600
+    assert [buckets.take('a') for _ in range(3)][:2] == [0.0, 0.0]
+    assert buckets.stats()['limited'] == 1
+
+
+def test_limited_attempts_do_not_consume(clock):
+    buckets = TokenBuckets(per_minute=60, burst=1)
+    buckets.take('a')
+    for _ in range(5):
+        assert buckets.take('a') > 0
+    clock.now += 1
+    assert buckets.take('a') == 0.0
+
+
+def test_eviction_drops_only_refilled_buckets(clock):
+    buckets = TokenBuckets(per_minute=60, burst=5)  # refilled after 5 seconds
+    buckets.take('old')
+    clock.now += 3
+    buckets.take('recent')
+    clock.now += 2.5
+    buckets.evict()
+    assert buckets.stats()['keys'] == 1
+    assert buckets.stats()['evictions'] == 1
+    # an evicted key starts over with a full bucket, as it would have anyway
+    assert [buckets.take('old') for _ in range(5)] == [0.0] * 5
+
+
+def test_max_keys_evicts_least_recently_used(clock):
+    buckets = TokenBuckets(per_minute=1, burst=1, max_keys=2)
+    buckets.take('a')
+    buckets.take('b')
+    buckets.take('c')
+    stats = buckets.stats()
+    assert (stats['keys'], stats['evictions']) == (2, 1)
+    assert buckets.take('b') > 0
+    assert buckets.take('c') > 0
+    assert buckets.take('a') == 0.0
+
+
+def test_admit_checks_address_then_username(clock, monkeypatch):
+    monkeypatch.setattr(ratelimit, 'limiters', {'login': (TokenBuckets(60, 3), TokenBuckets(60, 1))})
+    assert ratelimit.admit('login', '10.0.0.1', 'bob') == 0.0
+    assert ratelimit.admit('login', '10.0.0.1', 'bob') > 0
+    assert ratelimit.admit('login', '10.0.0.1', 'alice') == 0.0
+    # the address is out of tokens now, whoever the attempt is for
+    assert ratelimit.admit('login', '10.0.0.1', 'carol') > 0
+
+
+def test_login_returns_429_with_retry_after(app, monkeypatch):
+    monkeypatch.setattr(ratelimit, 'limiters', {**ratelimit.limiters, 'login': (TokenBuckets(60, 10), TokenBuckets(6, 1))})
+    client = app.app.test_client()
+    client.post('/login', json={'username': 'nobody', 'password': 'x'})
+    response = client.post('/login', json={'username': 'nobody', 'password': 'x'})
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '10'
@@ -0,0 +1,123 @@
+import asyncio
+import itertools
+import threading
+
+import pytest
+
+import main  # noqa: F401  the models import main, which has to come first
+from models import room_reservation
+
+SLOT = ('2030-01-07 10:00:00', '2030-01-07 11:00:00')
+rooms_made = itertools.count()
+
+
+@pytest.fixture
+def booker(app, db, make_user):
+    # a user allowed to book rooms for a group; returns (session_id, group_id)
+    username, session_id = make_user('booker')
+    group_id = db.execute("INSERT INTO user_groups (name) VALUES (?)", (f"{username}-group",)).lastrowid
+    db.execute("INSERT INTO group_members (group_id, username, can_post_room_reservation) VALUES (?, ?, 1)", (group_id, username))
+    db.commit()
+    return session_id, group_id
+
+
+@pytest.fixture
+def make_room(app, db):
+    def make_room():
+        room_id = db.execute("INSERT INTO rooms (name) VALUES (?)", (f"room-{next(rooms_made)}",)).lastrowid
+        db.commit()
+        room_reservation.invalidate_grid()
+        return room_id
+    return make_room
+
+
+def holding(db, room_id):
+    return db.execute("SELECT count(*) FROM reservations WHERE room_id = ? AND approval_status IN (0, 1)", (room_id,)).fetchone()[0]
+
+
+def test_concurrent_attempts_book_a_slot_once(db, booker, make_room):
+    # 200 attempts on four event loops, which share nothing but the database, like workers
+    session_id, group_id = booker
+    room_id = make_room()
+    results = []
+
+    def attempts():
+        async def attempt():
+            return await room_reservation.reserve_room(session_id, room_id, group_id, 'rush', *SLOT)
+        async def run_all():
+            return await asyncio.gather(*[attempt() for _ in range(50)])
+        results.extend(asyncio.run(run_all()))
+
+    threads = [threading.Thread(target=attempts) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(results) == 200
+    assert sorted(code for _, code in results) == [200] + [400] * 199
+    assert holding(db, room_id) == 1
+
+
+def test_other_rooms_are_not_blocked(run, db, booker, make_room):
+    session_id, group_id = booker
+    rooms = [make_room() for _ in range(5)]
+
+    async def book_all():
+        return await asyncio.gather(*[room_reservation.reserve_room(session_id, room_id, group_id, '', *SLOT) for room_id in rooms])
+    assert [code for _, code in run(book_all())] == [200] * 5
+    assert [holding(db, room_id) for room_id in rooms] == [1] * 5
+
+
+def test_booking_made_elsewhere_is_caught_in_the_transaction(run, db, booker, make_room):
+    session_id, group_id = booker
+    room_id = make_room()
+    run(room_reservation.get_grid())
+    # another worker booked the slot; this worker's grid does not know yet
+    db.execute("INSERT INTO reservations (room_id, username, start_time, end_time, approval_status) VALUES (?, 'other', ?, ?, 1)", (room_id, *SLOT))
+    db.commit()
+    assert run(room_reservation.get_grid()).is_free(room_id, *(room_reservation.parse_time(value) for value in SLOT))
+    result, code = run(room_reservation.reserve_room(session_id, room_id, group_id, '', *SLOT))
+    assert (result, code) == ('Room is not available during the specified time', 400)
+    assert holding(db, room_id) == 1
+    # the conflict forced a reload
+    assert not run(room_reservation.get_grid()).is_free(room_id, *(room_reservation.parse_time(value) for value in SLOT))
+
+
+def test_bundle_reports_every_overlapping_item(run, db, booker, make_room):
+    session_id, group_id = booker
+    room_id, other_room_id = make_room(), make_room()
+    items = [
+        {'room_id': room_id, 'start_time': '2030-01-07 10:00:00', 'end_time': '2030-01-07 13:00:00'},
+        {'room_id': room_id, 'start_time': '2030-01-07 10:30:00', 'end_time': '2030-01-07 11:00:00'},
+        {'room_id': room_id, 'start_time': '2030-01-07 11:30:00', 'end_time': '2030-01-07 12:00:00'},
+        {'room_id': room_id, 'start_time': '2030-01-07 13:00:00', 'end_time': '2030-01-07 14:00:00'},
+        {'room_id': other_room_id, 'start_time': '2030-01-07 10:00:00', 'end_time': '2030-01-07 11:00:00'},
+    ]
+    result, code = run(room_reservation.reserve_rooms(session_id, group_id, '', items))
+    assert code == 400
+    assert result['conflicts'] == [
+        {'item': 1, 'error': 'Overlaps item 0'},
+        {'item': 2, 'error': 'Overlaps item 0'},
+    ]
+    assert holding(db, room_id) == holding(db, other_room_id) == 0
+
+    result, code = run(room_reservation.reserve_rooms(session_id, group_id, '', [items[0], items[3], items[4]]))
+    assert code == 200
+    assert len(result['reservation_ids']) == 3
+    assert (holding(db, room_id), holding(db, other_room_id)) == (2, 1)
+
+
+def test_approving_a_rejected_reservation_checks_the_room_again(run, db, booker, room_admin, make_room):
+    session_id, group_id = booker
+    room_id = make_room()
+    first = run(room_reservation.reserve_room(session_id, room_id, group_id, '', *SLOT))[0]['reservation_id']
+    assert run(room_reservation.approve_reservation(room_admin, first, 'reject', 'no')) == ('Reservation rejected', 200)
+    # the rejection freed the slot, and someone else took it
+    second = run(room_reservation.reserve_room(session_id, room_id, group_id, '', *SLOT))[0]['reservation_id']
+    assert run(room_reservation.approve_reservation(room_admin, first, 'approve', '')) == ('Room is not available during the specified time', 400)
+    assert db.execute("SELECT approval_status FROM reservations WHERE id = ?", (first,)).fetchone() == (room_reservation.REJECTED,)
+    assert holding(db, room_id) == 1
+    # approving a reservation does not conflict with itself
+    assert run(room_reservation.approve_reservation(room_admin, second, 'approve', ''))[1] == 200
+    assert run(room_reservation.approve_reservation(room_admin, second, 'approve', ''))[1] == 200
+    assert db.execute("SELECT approval_status FROM reservations WHERE id = ?", (second,)).fetchone() == (room_reservation.APPROVED,)
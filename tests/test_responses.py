@@ -0,0 +1,57 @@
+import json
+
+import pytest
+
+import main  # noqa: F401  the models import main, which has to come first
+import responses
+from models import room_reservation
+from responses import Rows
+
+PAYLOAD = {
+    'posts': Rows(('id', 'title', 'score', 'tags'), [(1, 'héllo "quoted"', 1.5, None), (2, '', -3, None)]),
+    'empty': Rows(('id',), None),
+    'labels': {'a'},
+    7: 'non-string key',
+}
+EXPECTED = {
+    'posts': [{'id': 1, 'title': 'héllo "quoted"', 'score': 1.5, 'tags': None}, {'id': 2, 'title': '', 'score': -3, 'tags': None}],
+    'empty': [],
+    'labels': ['a'],
+    '7': 'non-string key',
+}
+
+
+@pytest.fixture(params=['fragments', 'dicts', 'json'])
+def encoder(request, monkeypatch):
+    # orjson 3.9+, older orjson without Fragment, and no orjson at all
+    if request.param == 'fragments' and not responses.FRAGMENTS:
+        pytest.skip("orjson.Fragment is not available")
+    if request.param != 'fragments':
+        monkeypatch.setattr(responses, 'FRAGMENTS', False)
+    if request.param == 'json':
+        monkeypatch.setattr(responses, 'orjson', None)
+    return request.param
+
+
+def test_rows_encode_the_same_everywhere(encoder):
+    data = responses.dumps(PAYLOAD)
+    assert isinstance(data, bytes)
+    assert json.loads(data) == EXPECTED
+    assert responses.loads(data) == EXPECTED
+
+
+def test_unknown_types_are_rejected(encoder):
+    with pytest.raises(TypeError):
+        responses.dumps({'value': object()})
+
+
+def test_rows_through_a_view(app, db, make_user, encoder):
+    room_id = db.execute("INSERT INTO rooms (name) VALUES (?)", (f"encoded-{encoder}",)).lastrowid
+    db.commit()
+    room_reservation.invalidate_grid()
+    username, session_id = make_user()
+    client = app.app.test_client()
+    client.set_cookie('session_id', session_id)
+    response = client.get('/get_available_rooms_by_time?start_time=2030-01-07 10:00:00&end_time=2030-01-07 11:00:00')
+    assert response.status_code == 200
+    assert {'id': room_id, 'name': f"encoded-{encoder}"} in response.get_json()
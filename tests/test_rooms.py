@@ -0,0 +1,41 @@
+import itertools
+
+import pytest
+
+rooms_made = itertools.count()
+
+
+@pytest.fixture
+def client(app, room_admin):
+    client = app.app.test_client()
+    client.set_cookie('session_id', room_admin)
+    return client
+
+
+def admin_room(client, name):
+    response = client.get('/get_rooms?admin=true')
+    assert response.status_code == 200
+    return next(room for room in response.get_json() if room['name'] == name)
+
+
+def test_rooms_are_open_every_day_by_default(client):
+    name = f"default-{next(rooms_made)}"
+    assert client.post('/create_room', json={'name': name}).status_code == 200
+    assert admin_room(client, name)['available_days'] == [1, 2, 3, 4, 5, 6, 7]
+    response = client.get('/get_available_rooms_by_time?start_time=2030-01-12 10:00:00&end_time=2030-01-12 11:00:00')
+    assert name in [room['name'] for room in response.get_json()]
+
+
+def test_admins_see_the_unavailable_periods(client):
+    name = f"blackouts-{next(rooms_made)}"
+    periods = [['2030-01-08 09:00:00', '2030-01-08 12:00:00'], ['2030-01-07 10:00:00', '2030-01-07 12:00:00']]
+    assert client.post('/create_room', json={'name': name, 'available_days': [2, 3], 'unavailable_periods': periods}).status_code == 200
+    room = admin_room(client, name)
+    assert room['available_days'] == [2, 3]
+    assert room['unavailable_periods'] == sorted(periods)
+
+    periods = [['2030-02-01 00:00:00', '2030-02-02 00:00:00']]
+    assert client.post('/modify_room', json={'room_id': room['id'], 'action': 'update', 'unavailable_periods': periods}).status_code == 200
+    assert admin_room(client, name)['unavailable_periods'] == periods
+    assert client.post('/modify_room', json={'room_id': room['id'], 'action': 'update', 'unavailable_periods': []}).status_code == 200
+    assert admin_room(client, name)['unavailable_periods'] == []
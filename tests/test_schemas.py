@@ -0,0 +1,116 @@
+import pytest
+from werkzeug.datastructures import MultiDict
+
+import main  # noqa: F401  schemas takes its choices from the models, which import main
+import schemas
+from schemas import ANY, Field, Schema, ValidationError
+
+START = '2030-01-07 10:00:00'
+END = '2030-01-07 11:00:00'
+
+
+def error(schema, data, query=False):
+    with pytest.raises(ValidationError) as e:
+        schema.decode_query(MultiDict(data)) if query else schema.decode(data)
+    return str(e.value)
+
+
+def test_defaults_and_conversions():
+    schema = Schema('Example', id=Field(int, required=True), flag=Field(bool, default=False), name=Field(str), extra=Field(ANY))
+    assert schema.decode({'id': '12', 'flag': 'yes', 'extra': [1]}) == (12, True, None, [1])
+    assert schema.decode({'id': 12}) == (12, False, None, None)
+    assert schema.decode_query(MultiDict([('id', '3'), ('flag', 'off'), ('name', '')])) == (3, False, None, None)
+
+
+@pytest.mark.parametrize('value, message', [
+    ('abc', "Invalid post_id: expected an integer"),
+    (True, "Invalid post_id: expected an integer"),
+    (1.5, "Invalid post_id: expected an integer"),
+    ('0', "Invalid post_id: must be at least 1"),
+])
+def test_integer_errors(value, message):
+    assert error(schemas.VOTE, {'post_id': value, 'vote': 'agree'}) == message
+
+
+def test_choices_and_required_fields():
+    assert error(schemas.VOTE, {'post_id': 1, 'vote': 'meh'}) == "Invalid vote: must be one of agree, disagree"
+    assert error(schemas.VOTE, {'post_id': 1}) == "Missing required field: vote"
+    assert error(schemas.LOGIN, {'username': 'bob', 'password': 5}) == "Invalid password: expected a string"
+    assert error(schemas.GET_ROOMS, [('admin', 'maybe')], query=True) == "Invalid admin: expected a boolean"
+
+
+def test_lengths_and_patterns():
+    assert error(schemas.SIGNUP, {'username': 'bob', 'password': 'x', 'email': 'b@example.com'}) == "Invalid username: length must be between 4 and 20"
+    assert error(schemas.SIGNUP, {'username': 'bob bob', 'password': 'x', 'email': 'b@example.com'}) == "Invalid username: invalid format"
+    assert error(schemas.SIGNUP, {'username': 'bobby', 'password': 'x', 'email': 'nobody'}) == "Invalid email: invalid format"
+
+
+def test_timestamps_and_dates():
+    base = {'room_id': 1, 'for_group': 1, 'start_time': START, 'end_time': END}
+    assert error(schemas.RESERVE_ROOM_RECURRING, {**base, 'start_time': '2030-01-07T10:00'}) == "Invalid start_time: expected YYYY-mm-dd HH:MM:SS"
+    assert error(schemas.RESERVE_ROOM_RECURRING, {**base, 'until': '07/01/2030'}) == "Invalid until: expected YYYY-mm-dd"
+    assert schemas.RESERVE_ROOM_RECURRING.decode({**base, 'until': '2030-02-01'}).until == '2030-02-01'
+
+
+@pytest.mark.parametrize('value', ['09:00', '23:59:59', '00:00', '24:00'])
+def test_times_of_day(value):
+    assert schemas.CREATE_ROOM.decode({'name': 'r', 'open_time': value}).open_time == value
+
+
+@pytest.mark.parametrize('value', ['9:00', '25:99', '12:60', '24:30', '09:00:00.5', '2030-01-07 09:00:00', 900])
+def test_times_of_day_the_grid_cannot_read(value):
+    assert error(schemas.CREATE_ROOM, {'name': 'r', 'close_time': value}) == "Invalid close_time: expected HH:MM or HH:MM:SS"
+
+
+def test_query_lists():
+    base = [('room_id', '1'), ('for_group', '2'), ('start_time', START), ('end_time', END)]
+    assert schemas.RESERVE_ROOM_RECURRING.decode_query(MultiDict(base + [('weekdays', '2,4')])).weekdays == [2, 4]
+    assert schemas.RESERVE_ROOM_RECURRING.decode_query(MultiDict(base + [('weekdays', '2'), ('weekdays', '4')])).weekdays == [2, 4]
+    assert error(schemas.RESERVE_ROOM_RECURRING, base + [('weekdays', '2'), ('weekdays', '9')], query=True) == "Invalid weekdays[1]: must be between 1 and 7"
+    assert error(schemas.RESERVE_ROOM_RECURRING, base + [('weekdays', '2,x')], query=True) == "Invalid weekdays[1]: expected an integer"
+
+
+def test_nested_items_are_named_by_position():
+    item = {'room_id': 1, 'start_time': START, 'end_time': END}
+    decoded = schemas.RESERVE_ROOMS.decode({'for_group': 1, 'items': [item]})
+    assert decoded.items == [item]
+    assert error(schemas.RESERVE_ROOMS, {'for_group': 1, 'items': [item, {**item, 'end_time': 'soon'}]}) == "Invalid items[1].end_time: expected YYYY-mm-dd HH:MM:SS"
+    assert error(schemas.RESERVE_ROOMS, {'for_group': 1, 'items': [{'room_id': 1}]}) == "Missing required field: items[0].start_time"
+    assert error(schemas.RESERVE_ROOMS, {'for_group': 1, 'items': [5]}) == "Invalid items[0]: expected an object"
+    assert error(schemas.RESERVE_ROOMS, {'for_group': 1, 'items': []}) == "Invalid items: length must be at least 1"
+
+
+def test_fields_the_models_used_to_check():
+    assert error(schemas.CREATE_GROUP, {'group_name': 'g', 'admin': {'name': 'bob'}}) == "Invalid admin: expected a string"
+    assert schemas.MODIFY_GROUP.decode({'group_id': 1, 'action': 'change_name', 'subject': 'new name'}).subject == 'new name'
+    assert schemas.MODIFY_GROUP.decode({'group_id': 1, 'action': 'add_member', 'subject': ['bob', 'carol']}).subject == ['bob', 'carol']
+    assert error(schemas.MODIFY_GROUP, {'group_id': 1, 'action': 'add_member', 'subject': {'bob': 1}}) == "Invalid subject: expected a string or a list"
+    assert error(schemas.MODIFY_GROUP, {'group_id': 1, 'action': 'add_member', 'subject': ['bob', 5]}) == "Invalid subject[1]: expected a string"
+    assert error(schemas.MODIFY_GROUP, {'group_id': 1, 'action': 'add_member', 'subject': []}) == "Invalid subject: length must be at least 1"
+    post = {'title': 't', 'content': '', 'post_type': 'announcement', 'post_as': 1, 'label': 'l'}
+    assert error(schemas.CREATE_POST, {**post, 'end_at': 'tomorrow'}) == "Invalid end_at: expected YYYY-mm-dd HH:MM:SS"
+    assert error(schemas.TIMELINE, [('from', '2030-01-07')], query=True) == "Invalid from: expected YYYY-mm-dd HH:MM:SS"
+    assert schemas.TIMELINE.decode_query(MultiDict([('to', END)])) == (None, END)
+
+
+def test_unavailable_periods_are_pairs_of_timestamps():
+    assert schemas.CREATE_ROOM.decode({'name': 'r', 'unavailable_periods': [[START, END]]}).unavailable_periods == [[START, END]]
+    assert error(schemas.CREATE_ROOM, {'name': 'r', 'unavailable_periods': f"{START}-{END}"}) == "Invalid unavailable_periods: expected a list"
+    assert error(schemas.CREATE_ROOM, {'name': 'r', 'unavailable_periods': [[START]]}) == "Invalid unavailable_periods[0]: length must be between 2 and 2"
+    assert error(schemas.MODIFY_ROOM, {'room_id': 1, 'action': 'update', 'unavailable_periods': [[START, END], [START, 'noon']]}) == "Invalid unavailable_periods[1][1]: expected YYYY-mm-dd HH:MM:SS"
+
+
+def test_invalid_requests_get_400(app):
+    client = app.app.test_client()
+    response = client.post('/login', data=b'{"username": ', content_type='application/json')
+    assert response.status_code == 400
+    assert response.get_json() == {'error': 'Invalid JSON payload'}
+    response = client.post('/login', json=['bob', 'secret'])
+    assert response.status_code == 400
+    response = client.post('/login', json={'username': 'bob'})
+    assert response.status_code == 400
+    assert response.get_json() == {'error': 'Missing required field: password'}
+    response = client.get('/get_available_rooms_by_time?start_time=soon&end_time=later')
+    assert response.get_json() == {'error': 'Invalid start_time: expected YYYY-mm-dd HH:MM:SS'}
+    response = client.post('/create_group', json={'group_name': 'g', 'admin': {'name': 'bob'}})
+    assert (response.status_code, response.get_json()) == (400, {'error': 'Invalid admin: expected a string'})
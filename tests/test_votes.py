@@ -0,0 +1,104 @@
+import concurrent.futures
+
+import pytest
+
+import main  # noqa: F401  the models import main, which has to come first
+from models import votes
+
+
+@pytest.fixture
+def pull(app, db):
+    post_id = db.execute("INSERT INTO posts (title, content, post_type, label, post_as) VALUES ('pull', '', 'pull', '', '1')").lastrowid
+    db.execute("INSERT INTO pulls (post_id, agree, disagree) VALUES (?, 0, 0)", (post_id,))
+    db.commit()
+    return post_id
+
+
+def snapshot(db, post_id):
+    return db.execute("SELECT agree, disagree, (SELECT seq FROM vote_flush_marks WHERE worker = ?) FROM pulls WHERE post_id = ?", (votes.WORKER_ID, post_id)).fetchone()
+
+
+def counted(db, post_id):
+    agree, disagree, flushed_seq = snapshot(db, post_id)
+    unflushed_agree, unflushed_disagree = votes.unflushed(post_id, flushed_seq)
+    return agree + unflushed_agree, disagree + unflushed_disagree
+
+
+def test_buffered_votes_are_counted_once(app, db, pull):
+    assert votes.add(pull, 'a', 'agree')
+    assert votes.add(pull, 'b', 'disagree')
+    assert not votes.add(pull, 'a', 'disagree')
+    assert counted(db, pull) == (1, 1)
+    assert votes.flush() == 2
+    assert snapshot(db, pull)[:2] == (1, 1)
+    assert counted(db, pull) == (1, 1)
+
+
+def test_snapshot_taken_before_a_flush_commits(app, db, pull):
+    votes.add(pull, 'a', 'agree')
+    votes.add(pull, 'b', 'agree')
+    before = snapshot(db, pull)
+    votes.flush()
+    votes.add(pull, 'c', 'disagree')
+    # the reader got its counters before the flush and asks after it
+    assert votes.unflushed(pull, before[2]) == (2, 1)
+    after = snapshot(db, pull)
+    assert after[:2] == (2, 0)
+    assert votes.unflushed(pull, after[2]) == (0, 1)
+
+
+def test_votes_already_recorded_by_another_worker_are_dropped(app, db, pull):
+    db.execute("INSERT INTO pull_votes (post_id, username, opinion) VALUES (?, 'a', 'agree')", (pull,))
+    db.execute("UPDATE pulls SET agree = 1 WHERE post_id = ?", (pull,))
+    db.commit()
+    dropped = votes.stats()['duplicates_dropped']
+    votes.add(pull, 'a', 'disagree')
+    votes.add(pull, 'b', 'agree')
+    before = snapshot(db, pull)
+    votes.flush()
+    assert votes.stats()['duplicates_dropped'] == dropped + 1
+    assert snapshot(db, pull)[:2] == (2, 0)
+    # only what the flush actually added is reported to older snapshots
+    assert votes.unflushed(pull, before[2]) == (1, 0)
+    assert counted(db, pull) == (2, 0)
+
+
+def test_failed_flush_keeps_the_votes(app, db, pull, monkeypatch):
+    failures = votes.stats()['flush_failures']
+
+    def fail(fn):
+        future = concurrent.futures.Future()
+        future.set_exception(RuntimeError("database is locked"))
+        return future
+    votes.add(pull, 'a', 'agree')
+    with monkeypatch.context() as patch:
+        patch.setattr(app.writer, 'submit_transaction', fail)
+        with pytest.raises(RuntimeError):
+            votes.flush()
+    assert votes.stats()['flush_failures'] == failures + 1
+    assert votes.has_pending_vote(pull, 'a')
+    assert counted(db, pull) == (1, 0)
+    votes.flush()
+    assert snapshot(db, pull)[:2] == (1, 0)
+    assert counted(db, pull) == (1, 0)
+
+
+def test_vote_endpoint(app, pull, make_user):
+    username, session_id = make_user()
+    client = app.app.test_client()
+    client.set_cookie('session_id', session_id)
+    assert client.post('/vote', json={'post_id': pull, 'vote': 'agree'}).status_code == 200
+    response = client.post('/vote', json={'post_id': pull, 'vote': 'agree'})
+    assert (response.status_code, response.get_json()) == (400, {'message': 'Already voted'})
+    votes.flush()
+    assert client.post('/vote', json={'post_id': pull, 'vote': 'disagree'}).status_code == 400
+    assert client.get(f'/get_pull_details?post_id={pull}').get_json() == {'agree': 1, 'disagree': 0}
+
+
+def test_anonymous_votes_are_refused(app, pull):
+    with pytest.raises(ValueError):
+        votes.add(pull, None, 'agree')
+    client = app.app.test_client()
+    response = client.post('/vote', json={'post_id': pull, 'vote': 'agree'})
+    assert response.status_code == 401
+    assert client.get(f'/get_pull_details?post_id={pull}').get_json() == {'agree': 0, 'disagree': 0}